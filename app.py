@@ -17,7 +17,7 @@ from functools import wraps
 ROOT = Path(__file__).resolve().parent
 sys.path.insert(0, str(ROOT))
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, session
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
@@ -287,17 +287,6 @@ def send_app_email(email_type, subject, body_html_or_text, to_emails=None):
         return (False, err_msg)
 
 
-def run_pipeline():
-    """Run full pipeline: ingest → clean → analyze → report → send_payload."""
-    from tools import ingest_data, clean_data, analyze, generate_report, send_payload
-    steps = [ingest_data.ingest, clean_data.clean, analyze.analyze, lambda: generate_report.generate_report(), send_payload.send_payload]
-    for step in steps:
-        code = step()
-        if code != 0:
-            return code
-    return 0
-
-
 @app.route("/health", methods=["GET"])
 def health():
     """Health check: env and integrations. Fail fast if unreachable."""
@@ -308,14 +297,15 @@ def health():
     return jsonify({
         "status": "ok",
         "tmp_dir": str(TMP_DIR),
-        "data_source": "path" if os.environ.get("DATA_SOURCE_PATH") else ("url" if os.environ.get("DATA_SOURCE_URL") else "none"),
+        "data_source": "path" if os.environ.get("DATA_SOURCE_PATH") else ("urls" if os.environ.get("DATA_SOURCE_URLS") else ("url" if os.environ.get("DATA_SOURCE_URL") else "none")),
     }), 200
 
 
 @app.route("/trigger", methods=["POST", "GET"])
 def trigger():
-    """Cron/webhook: route request then run pipeline or single tool."""
+    """Cron/webhook: route request, then queue the pipeline or single tool as a background job (202 + job id)."""
     from navigation.router import route
+    from tools import jobs
     body = request.get_json(silent=True) or {}
     req = {"action": body.get("action", "full_pipeline"), "payload": body.get("payload", {}), "options": body.get("options", {})}
     result = route(req)
@@ -324,28 +314,61 @@ def trigger():
         from tools import health_check
         code = health_check.health_check()
         return jsonify({"route": result, "health_exit": code}), 200 if code == 0 else 503
+    params = {}
     if tool_name == "full_pipeline":
-        code = run_pipeline()
-        return jsonify({"route": result, "pipeline_exit": code}), 200 if code == 0 else 500
-    # Single-tool dispatch
-    if tool_name == "ingest_data":
-        from tools import ingest_data
-        code = ingest_data.ingest()
-    elif tool_name == "clean_data":
-        from tools import clean_data
-        code = clean_data.clean()
-    elif tool_name == "analyze":
-        from tools import analyze
-        code = analyze.analyze()
-    elif tool_name == "generate_report":
-        from tools import generate_report
-        code = generate_report.generate_report()
-    elif tool_name == "send_payload":
-        from tools import send_payload
-        code = send_payload.send_payload()
-    else:
-        code = run_pipeline()
-    return jsonify({"route": result, "tool_exit": code}), 200 if code == 0 else 500
+        opts = req["options"]
+        params = {k: opts.get(k) for k in ("checkpoint", "incremental", "full_rebuild") if opts.get(k) is not None}
+    elif tool_name == "backfill":
+        from tools import backfill
+        opts = req["options"]
+        params = {k: opts.get(k) for k in ("start", "end", "slice", "workers") if opts.get(k) is not None}
+        try:
+            backfill.make_slices(str(params.get("start", "")), str(params.get("end", "")), str(params.get("slice") or backfill.DEFAULT_SLICE))
+            if "workers" in params:
+                params["workers"] = backfill.parse_workers(params["workers"])
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+    job, created = jobs.submit(tool_name, params)
+    out = {
+        "route": result,
+        "job_id": job["id"],
+        "status": job["status"],
+        "deduplicated": not created,
+        "status_url": url_for("api_job_status", job_id=job["id"]),
+    }
+    if tool_name == "full_pipeline" and req["options"].get("preview"):
+        # Estimate from a sample while the pipeline runs (preview jobs do not wait for its lock).
+        preview_job, _ = jobs.submit("preview")
+        out["preview_job_id"] = preview_job["id"]
+        out["preview_status_url"] = url_for("api_job_status", job_id=preview_job["id"])
+    return jsonify(out), 202
+
+
+@app.route("/api/jobs", methods=["GET"])
+@login_required
+def api_jobs_list():
+    """Recent pipeline jobs, newest first (?limit=20), each with its per-stage metrics; "runs" is this process's ring buffer."""
+    from tools import jobs, metrics
+    limit = min(max(request.args.get("limit", 20, type=int) or 20, 1), 200)
+    return jsonify({"jobs": jobs.list_jobs(limit), "runs": metrics.recent(limit)})
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Per-stage pipeline metrics of this process in Prometheus text format (see architecture/pipeline.md)."""
+    from tools import metrics
+    return Response(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@login_required
+def api_job_status(job_id):
+    """Status of one job: queued/running/succeeded/failed, exit code and per-stage progress."""
+    from tools import jobs
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 
 # — Auth routes
@@ -1074,6 +1097,98 @@ def api_dashboard_stats():
     })
 
 
+# — API: analytics rollups (hour/day/week by source, built by analyze)
+@app.route("/api/analytics/rollup", methods=["GET"])
+@login_required
+def api_analytics_rollup():
+    """Range and group-by query over the rollups: ?grain=day&start=&end=&source=a,b&group_by=bucket,source"""
+    from tools import rollup
+    grain = (request.args.get("grain") or "day").strip().lower()
+    sources = [s.strip() for s in (request.args.get("source") or "").split(",") if s.strip()]
+    group_by = [g.strip() for g in (request.args.get("group_by") or "bucket,source").split(",") if g.strip()]
+    try:
+        rows = rollup.query(grain, request.args.get("start"), request.args.get("end"), sources or None, group_by)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"grain": grain, "group_by": [g for g in rollup.GROUP_BY if g in group_by], "rows": rows})
+
+
+# — API: analytics history (every analyze result, by period)
+@app.route("/api/analytics/latest", methods=["GET"])
+@login_required
+def api_analytics_latest():
+    """Newest Analytics Result, served from the in-process cache (null before the first analyze run)."""
+    from tools import history
+    return jsonify({"result": history.latest()})
+
+
+@app.route("/api/analytics/history", methods=["GET"])
+@login_required
+def api_analytics_history():
+    """Stored results by period: ?start=&end=&limit=100&kind=run|backfill; compare=previous adds the change against the period before."""
+    from tools import history
+    compare = (request.args.get("compare") or "").strip().lower()
+    if compare not in ("", "none", "previous"):
+        return jsonify({"error": "compare must be previous or none"}), 400
+    limit = request.args.get("limit", history.DEFAULT_LIMIT, type=int)
+    try:
+        rows = history.query(request.args.get("start"), request.args.get("end"), limit, compare == "previous", request.args.get("kind") or None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"compare": compare == "previous", "rows": rows})
+
+
+# — API: sampled preview of the analytics (tools/preview.py)
+@app.route("/api/analytics/preview", methods=["GET", "POST"])
+@login_required
+def api_analytics_preview():
+    """
+    POST: queue a preview job (?sample=10000&stratify=source|none&confidence=0.95&seed=0) and return 202 + job id.
+    GET: the latest preview written by such a job (or the CLI).
+    """
+    from tools import jobs, preview
+    if request.method == "GET":
+        try:
+            with open(preview.OUTPUT_FILE, encoding="utf-8") as f:
+                return jsonify({"result": json.load(f)})
+        except FileNotFoundError:
+            return jsonify({"error": "No preview yet; POST to this URL to start one"}), 404
+    try:
+        size, stratify, confidence = preview.check_args(
+            request.args.get("sample", type=int), request.args.get("stratify") or None, request.args.get("confidence", type=float),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    params = {"sample": size, "stratify": stratify, "confidence": confidence, "seed": request.args.get("seed", 0, type=int)}
+    job, _ = jobs.submit("preview", params)
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": url_for("api_job_status", job_id=job["id"]),
+        "result_url": url_for("api_analytics_preview"),
+    }), 202
+
+
+# — API: ad-hoc queries over the cleaned records (tools/query.py)
+@app.route("/api/query", methods=["POST"])
+@login_required
+def api_query():
+    """Filter / group-by / aggregate spec as the JSON body (see architecture/analytics.md); ?explain=1 adds the SQLite plan. 503 while the first store is built."""
+    from tools import query
+    spec = request.get_json(silent=True)
+    try:
+        result = query.run(spec)
+        if request.args.get("explain") in ("1", "true"):
+            result = {**result, "plan": query.explain(spec)}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except query.StoreBuilding as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify(result)
+
+
 # — API: tasks (with assignee, due_date, urgency; task_assigned email when assigned_to set)
 def _task_row_to_json(r):
     out = {
@@ -14,7 +14,7 @@ except ImportError:
     GEMINI_AVAILABLE = False
 
 ALLOWED_ACTIONS = {
-    "ingest", "clean", "analyze", "report", "deliver", "health", "full_pipeline"
+    "ingest", "clean", "analyze", "report", "deliver", "health", "full_pipeline", "backfill"
 }
 
 
@@ -40,6 +40,7 @@ def _action_to_tool(action: str) -> str:
         "deliver": "send_payload",
         "health": "health_check",
         "full_pipeline": "full_pipeline",
+        "backfill": "backfill",
     }
     return m.get(action, "full_pipeline")
 
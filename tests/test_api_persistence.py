@@ -6,6 +6,7 @@ Or: python -m unittest tests.test_api_persistence
 import os
 import sys
 import tempfile
+import time
 import unittest
 
 # Use in-memory or temp DB so we don't touch dev data
@@ -194,6 +195,153 @@ class TestApiPersistence(unittest.TestCase):
         r3 = self.client.delete("/api/workspace/nonexistent-id-12345")
         self.assertEqual(r3.status_code, 404)
 
+    def test_analytics_rollup_query(self):
+        from pathlib import Path
+        from unittest import mock
+        from tools import rollup
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(rollup, "ROLLUP_DB", Path(tmp) / "r.db"):
+            b = rollup.RollupBuilder()
+            b.add("2026-01-01T10:15:00Z", "ads", 5, 1, 2.5)
+            b.add("2026-01-02T11:00:00Z", "ads", 3, 0, 0)
+            rollup.write_rollups(b)
+            r = self.client.get("/api/analytics/rollup?grain=day&start=2026-01-02&group_by=bucket")
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.get_json()["rows"], [{"bucket": "2026-01-02T00:00:00Z", "record_count": 1, "visits": 3.0, "conversions": 0.0, "revenue": 0.0}])
+            self.assertEqual(self.client.get("/api/analytics/rollup?grain=year").status_code, 400)
+
+    def test_analytics_history_and_latest(self):
+        from pathlib import Path
+        from unittest import mock
+        from tools import analyze, history
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(history, "HISTORY_DB", Path(tmp) / "h.db"):
+            self.assertIsNone(self.client.get("/api/analytics/latest").get_json()["result"])
+            for day, visits in ((1, 10), (2, 15), (3, 12)):
+                ts = f"2026-01-0{day}T00:00:00+00:00"
+                history.record(analyze.aggregate([{"id": f"r{day}", "timestamp": ts, "source": "ads", "visits": visits, "conversions": 1, "revenue": 2.0}]))
+            r = self.client.get("/api/analytics/history?start=2026-01-02&compare=previous")
+            self.assertEqual(r.status_code, 200)
+            rows = r.get_json()["rows"]
+            self.assertEqual([row["totals"]["visits"] for row in rows], [15.0, 12.0])
+            self.assertEqual(rows[0]["previous"]["period_start"], "2026-01-01T00:00:00+00:00")
+            self.assertEqual(rows[0]["change"]["visits"], {"delta": 5.0, "pct": 50.0})
+            self.assertEqual(rows[1]["change"]["visits"], {"delta": -3.0, "pct": -20.0})
+            self.assertEqual(rows[1]["by_source"][0]["source"], "ads")
+            self.assertNotIn("change", self.client.get("/api/analytics/history?limit=1").get_json()["rows"][0])
+            self.assertEqual(self.client.get("/api/analytics/latest").get_json()["result"]["totals"]["visits"], 12.0)
+            self.assertEqual(self.client.get("/api/analytics/history?limit=0").status_code, 400)
+            self.assertEqual(self.client.get("/api/analytics/history?compare=year").status_code, 400)
+
+    def test_query_endpoint(self):
+        from pathlib import Path
+        from unittest import mock
+        from tools import query
+        from tools.columnar import write_columns
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            with mock.patch.multiple(query, TMP_DIR=tmp, COLUMNS_FILE=tmp / "c.col", INPUT_FILE=tmp / "c.json", STORE_DB=tmp / "q.db", BUILD_LOCK=tmp / "q.lock"):
+                self.assertEqual(self.client.post("/api/query", json={}).status_code, 404)
+                records = [{"id": f"r{i}", "timestamp": f"2026-01-0{1 + i % 3}T10:00:00+00:00", "source": ("fb_ads", "fb_feed", "email")[i % 3], "visits": 1, "conversions": 0, "revenue": 2.5} for i in range(9)]
+                write_columns(tmp / "c.col", {"schema_version": "1.0"}, iter(records))
+                spec = {"filters": [{"field": "source", "op": "glob", "value": "fb_*"}], "group_by": ["day"], "aggregates": [{"fn": "sum", "field": "revenue"}]}
+                r = self.client.post("/api/query", json=spec)
+                self.assertEqual((r.status_code, r.headers.get("Retry-After")), (503, "5"))  # built in the background, not in the request
+                query._store["builder"].join(10)
+                r = self.client.post("/api/query?explain=1", json=spec)
+                self.assertEqual(r.status_code, 200)
+                data = r.get_json()
+                self.assertEqual(data["rows"], [{"day": "2026-01-01T00:00:00Z", "sum_revenue": 7.5}, {"day": "2026-01-02T00:00:00Z", "sum_revenue": 7.5}])
+                self.assertIn("idx_records_source", data["plan"][0])
+                self.assertEqual(self.client.post("/api/query", json={"group_by": ["colour"]}).status_code, 400)
+                query.clear_cache()
+
+    def test_analytics_preview(self):
+        import json
+        import os
+        from pathlib import Path
+        from unittest import mock
+        from tools import jobs, preview
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            with open(tmp / "feed.ndjson", "w", encoding="utf-8") as f:
+                for i in range(300):
+                    f.write(json.dumps({"id": f"r{i}", "timestamp": "2026-01-01T00:00:00+00:00", "source": ("ads", "email")[i % 2],
+                                        "metrics": {"visits": 2, "conversions": 0, "revenue": 1.5}}) + "\n")
+            env = {"DATA_SOURCE_PATH": str(tmp / "feed.ndjson"), "DATA_SOURCE_FORMAT": "ndjson", "DATA_SOURCE_URL": "", "DATA_SOURCE_URLS": ""}
+            with mock.patch.dict(os.environ, env), mock.patch.multiple(preview, TMP_DIR=tmp, OUTPUT_FILE=tmp / "p.json"), \
+                    mock.patch.multiple(jobs, JOBS_DB=tmp / "jobs.db", LOCK_FILE=tmp / "pipeline.lock"):
+                self.assertEqual(self.client.get("/api/analytics/preview").status_code, 404)
+                r = self.client.post("/api/analytics/preview?sample=50&stratify=source")
+                self.assertEqual(r.status_code, 202)
+                body = r.get_json()
+                for _ in range(500):
+                    job = self.client.get(body["status_url"]).get_json()
+                    if job["status"] not in jobs.ACTIVE:
+                        break
+                    time.sleep(0.02)
+                self.assertEqual((job["kind"], job["status"], job["params"]["sample"]), ("preview", "succeeded", 50))
+                result = self.client.get(body["result_url"]).get_json()["result"]
+                self.assertEqual((result["population_count"], result["strata"]), (300, 2))
+                self.assertEqual(result["totals"]["visits"]["estimate"], 600.0)  # constant within each stratum: no error
+                self.assertEqual(self.client.post("/api/analytics/preview?stratify=region").status_code, 400)
+                self.assertEqual(self.client.post("/api/analytics/preview?confidence=2").status_code, 400)
+
+    def test_trigger_queues_job(self):
+        from pathlib import Path
+        from unittest import mock
+        from tools import jobs
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(jobs, "JOBS_DB", Path(tmp) / "jobs.db"), \
+                mock.patch.object(jobs, "LOCK_FILE", Path(tmp) / "pipeline.lock"), \
+                mock.patch.object(jobs, "_execute"):
+            r = self.client.post("/trigger", json={"action": "full_pipeline", "options": {"checkpoint": True}})
+            self.assertEqual(r.status_code, 202)
+            body = r.get_json()
+            job = self.client.get(body["status_url"]).get_json()
+            self.assertEqual((job["id"], job["status"], job["params"]), (body["job_id"], "queued", {"checkpoint": True}))
+            self.assertEqual(self.client.get("/api/jobs/missing").status_code, 404)
+
+    def test_trigger_backfill_workers(self):
+        import os
+        from pathlib import Path
+        from unittest import mock
+        from tools import jobs
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(jobs, "JOBS_DB", Path(tmp) / "jobs.db"), \
+                mock.patch.object(jobs, "LOCK_FILE", Path(tmp) / "pipeline.lock"), \
+                mock.patch.object(jobs, "_execute"), mock.patch.dict(os.environ, {"BACKFILL_WORKERS": "3"}):
+            options = {"start": "2026-01-01", "end": "2026-03-01"}
+            for workers, expected in (("2", 2), (50, 3), (0, 1)):
+                r = self.client.post("/trigger", json={"action": "backfill", "options": {**options, "workers": workers}})
+                self.assertEqual(r.status_code, 202)
+                self.assertEqual(jobs.get_job(r.get_json()["job_id"])["params"]["workers"], expected)
+            for workers in ("four", 2.5, True, [2]):
+                r = self.client.post("/trigger", json={"action": "backfill", "options": {**options, "workers": workers}})
+                self.assertEqual(r.status_code, 400, msg=repr(workers))
+
+    def test_job_endpoints_require_login(self):
+        anonymous = app_module.app.test_client()
+        anonymous.environ_base["HTTP_HOST"] = "localhost"
+        for path in ("/api/jobs", "/api/jobs/missing"):
+            r = anonymous.get(path)
+            self.assertEqual(r.status_code, 302, msg=path)
+            self.assertIn("/login", r.headers["Location"])
+
+    def test_metrics_endpoint_and_job_runs(self):
+        from tools import metrics
+        metrics.reset()
+        with metrics.recording("analyze") as run:
+            with run.measure("analyze"):
+                metrics.note("analyze", records_in=7, bytes_read=100)
+            run.exit_code = 0
+        r = self.client.get("/metrics")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.content_type.startswith("text/plain; version=0.0.4"))
+        text = r.get_data(as_text=True)
+        self.assertIn('pipeline_runs_total{kind="analyze",status="succeeded"} 1', text)
+        self.assertIn('pipeline_stage_records_in_total{stage="analyze"} 7', text)
+        self.assertEqual(self.client.get("/api/jobs").get_json()["runs"][0]["stages"]["analyze"]["bytes_read"], 100)
+        metrics.reset()
+
 
 if __name__ == "__main__":
     unittest.main()
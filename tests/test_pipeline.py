@@ -0,0 +1,1400 @@
+"""
+Tests for the data pipeline tools (ingest → clean → analyze → report → send_payload).
+Run with: python -m pytest tests/test_pipeline.py -v
+Or: python -m unittest tests.test_pipeline
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import unittest
+import zlib
+from contextlib import redirect_stderr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools import ingest_data, clean_data, analyze, generate_report, send_payload, pipeline, rollup, jobs, http_pool, http_cache, benchmark, metrics, history, query, backfill, preview, render, sketches
+from tools.sketches import HyperLogLog, TDigest
+from tools.columnar import export_json, open_columns, write_columns
+from tools.jsonstream import open_records
+
+
+def _point_tools_at(tmp: Path):
+    """Patch every tool's .tmp paths to `tmp`. Returns a list of started patchers."""
+    targets = {
+        ingest_data: {"TMP_DIR": tmp, "OUTPUT_FILE": tmp / "raw_input.json"},
+        clean_data: {"TMP_DIR": tmp, "INPUT_FILE": tmp / "raw_input.json", "OUTPUT_FILE": tmp / "cleaned_data.json", "COLUMNS_FILE": tmp / "cleaned_data.col"},
+        analyze: {"TMP_DIR": tmp, "INPUT_FILE": tmp / "cleaned_data.json", "COLUMNS_FILE": tmp / "cleaned_data.col", "OUTPUT_FILE": tmp / "analytics_result.json"},
+        generate_report: {"TMP_DIR": tmp, "INPUT_FILE": tmp / "analytics_result.json", "OUTPUT_FILE": tmp / "report_output.json"},
+        send_payload: {"TMP_DIR": tmp, "INPUT_FILE": tmp / "report_output.json", "SUMMARY_FILE": tmp / "report_summary.txt", "STATE_FILE": tmp / "delivery_state.json"},
+        jobs: {"TMP_DIR": tmp, "JOBS_DB": tmp / "jobs.db", "LOCK_FILE": tmp / "pipeline.lock"},
+        http_cache: {"TMP_DIR": tmp, "CACHE_DIR": tmp / "http_cache"},
+        rollup: {"TMP_DIR": tmp, "ROLLUP_DB": tmp / "analytics_rollup.db"},
+        history: {"TMP_DIR": tmp, "HISTORY_DB": tmp / "analytics_history.db"},
+        backfill: {"TMP_DIR": tmp, "BACKFILL_DIR": tmp / "backfill"},
+        preview: {"TMP_DIR": tmp, "OUTPUT_FILE": tmp / "analytics_preview.json"},
+        query: {"TMP_DIR": tmp, "COLUMNS_FILE": tmp / "cleaned_data.col", "INPUT_FILE": tmp / "cleaned_data.json",
+                "STORE_DB": tmp / "query_store.db", "BUILD_LOCK": tmp / "query_store.lock"},
+        render: {"TMP_DIR": tmp, "CACHE_DIR": tmp / "render_cache"},
+        pipeline: {"TMP_DIR": tmp, "STATE_FILE": tmp / "pipeline_state.json", "MANIFEST_DIR": tmp / "manifests"},
+    }
+    patchers = [mock.patch.object(mod, name, value) for mod, attrs in targets.items() for name, value in attrs.items()]
+    for p in patchers:
+        p.start()
+    return patchers
+
+
+def _write_csv(path: Path, rows: int):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,timestamp,source,visits,conversions,revenue\n")
+        for i in range(rows):
+            f.write(f"r{i},2026-01-{1 + i % 28:02d}T{i % 24:02d}:00:00+00:00,src{i % 5},{i % 17},{i % 3},{(i % 11) * 1.25}\n")
+
+
+def _raw_record(i: int) -> dict:
+    return {
+        "id": f"r{i}",
+        "timestamp": f"2026-01-{1 + i % 28:02d}T{i % 24:02d}:00:00+00:00",
+        "source": f"src{i % 5}",
+        "metrics": {"visits": i % 17, "conversions": i % 3, "revenue": (i % 11) * 1.25},
+        "meta": {},
+    }
+
+
+def _write_ndjson(path: Path, rows: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(rows):
+            f.write(json.dumps(_raw_record(i)) + "\n")
+
+
+def _strip_volatile(result: dict) -> dict:
+    return {k: v for k, v in result.items() if k not in ("computed_at", "generated_at")}
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.patchers = _point_tools_at(self.tmp)
+        self.env = mock.patch.dict(os.environ, {"DATA_SOURCE_URL": "", "DATA_SOURCE_URLS": "", "DELIVERY_WEBHOOK_URL": "", "DELIVERY_WEBHOOK_URLS": ""})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        for p in self.patchers:
+            p.stop()
+        self._tmp.cleanup()
+
+    def read_json(self, name: str) -> dict:
+        with open(self.tmp / name, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+class TestInMemoryPipeline(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.tmp / "source.csv"
+        _write_csv(self.source, 200)
+        os.environ["DATA_SOURCE_PATH"] = str(self.source)
+        os.environ["DATA_SOURCE_FORMAT"] = "csv"
+
+    def _run_tools(self) -> dict:
+        for step in (ingest_data.ingest, clean_data.clean, analyze.analyze, generate_report.generate_report, send_payload.send_payload):
+            self.assertEqual(step(), 0)
+        return self.read_json("analytics_result.json")
+
+    def test_matches_file_based_tools(self):
+        expected = self._run_tools()
+        for name in ("raw_input.json", "cleaned_data.col", "analytics_result.json"):
+            (self.tmp / name).unlink()
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        self.assertEqual(_strip_volatile(self.read_json("analytics_result.json")), _strip_volatile(expected))
+        self.assertTrue((self.tmp / "report_output.json").is_file())
+        self.assertTrue((self.tmp / "report_summary.txt").is_file())
+
+    def test_intermediates_only_with_checkpoint(self):
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        self.assertFalse((self.tmp / "raw_input.json").exists())
+        self.assertFalse((self.tmp / "cleaned_data.col").exists())
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        raw = self.read_json("raw_input.json")
+        cleaned = open_columns(self.tmp / "cleaned_data.col")
+        self.assertEqual(len(raw["records"]), 200)
+        self.assertEqual(cleaned["record_count"], 200)
+        self.assertEqual(cleaned["header"]["validation_errors_count"], 0)
+        self.assertEqual(list(self.tmp.glob("*.part")), [])
+
+
+class TestColumnarFormat(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        _write_csv(self.tmp / "source.csv", 500)
+        os.environ.update({"DATA_SOURCE_PATH": str(self.tmp / "source.csv"), "DATA_SOURCE_FORMAT": "csv", "CLEANED_DATA_FORMAT": "both"})
+        self.assertEqual(ingest_data.ingest(), 0)
+        self.assertEqual(clean_data.clean(), 0)
+
+    def test_zero_copy_columns_and_json_export(self):
+        cols = open_columns(self.tmp / "cleaned_data.col")
+        self.assertEqual(cols["record_count"], 500)
+        self.assertEqual(cols["visits"].format, "d")
+        self.assertEqual(len(cols["sources"]), 5)
+        self.assertLess((self.tmp / "cleaned_data.col").stat().st_size, (self.tmp / "cleaned_data.json").stat().st_size)
+        export_json(self.tmp / "cleaned_data.col", self.tmp / "exported.json")
+        self.assertEqual(self.read_json("exported.json")["records"], self.read_json("cleaned_data.json")["records"])
+
+    def test_analyze_reads_columns_identically(self):
+        self.assertEqual(analyze.analyze(), 0)
+        from_columns = self.read_json("analytics_result.json")
+        (self.tmp / "cleaned_data.col").unlink()
+        self.assertEqual(analyze.analyze(), 0)
+        self.assertEqual(_strip_volatile(from_columns), _strip_volatile(self.read_json("analytics_result.json")))
+
+    def test_single_format_removes_stale_file(self):
+        os.environ["CLEANED_DATA_FORMAT"] = "columnar"
+        self.assertEqual(clean_data.clean(), 0)
+        self.assertFalse((self.tmp / "cleaned_data.json").exists())
+        self.assertTrue((self.tmp / "cleaned_data.col").exists())
+
+
+class TestValidation(PipelineTestCase):
+    def _bad_rows(self) -> list:
+        rows = [_raw_record(i) for i in range(20)]
+        rows[2]["timestamp"] = "yesterday"
+        rows[3]["timestamp"] = "1999-12-31T23:00:00+00:00"
+        rows[4]["timestamp"] = "2999-01-01T00:00:00Z"
+        rows[5]["metrics"]["revenue"] = -4.5
+        rows[6]["metrics"]["visits"] = "many"
+        rows[7]["metrics"]["conversions"] = float("nan")
+        rows[8]["metrics"].update(revenue=-1, visits="x")  # two fields, one dropped row
+        rows[9] = ["not", "a", "record"]
+        return rows
+
+    def test_rejections_by_field_with_samples(self):
+        stats = {}
+        kept = list(clean_data.clean_records(self._bad_rows(), stats))
+        self.assertEqual([r["id"] for r in kept], ["r0", "r1"] + [f"r{i}" for i in range(10, 20)])
+        self.assertEqual(stats["validation_errors_count"], 8)
+        self.assertEqual(stats["rejections"], {
+            "record": {"not_object": 1},
+            "timestamp": {"unparseable": 1, "out_of_range": 2},
+            "visits": {"not_numeric": 2},
+            "conversions": {"not_finite": 1},
+            "revenue": {"negative": 2},
+        })
+        self.assertIn({"row": 5, "field": "revenue", "reason": "negative", "value": "-4.5"}, stats["rejected_samples"])
+        os.environ.update({"CLEAN_ALLOW_NEGATIVE": "revenue", "CLEAN_REJECT_SAMPLES": "1"})
+        stats = {}
+        kept = list(clean_data.clean_records(self._bad_rows(), stats))
+        self.assertIn("r5", [r["id"] for r in kept])
+        self.assertEqual(len([s for s in stats["rejected_samples"] if s["field"] == "timestamp"]), 1)
+
+    def test_counts_in_cleaned_header(self):
+        with open(self.tmp / "raw_input.json", "w", encoding="utf-8") as f:
+            json.dump({"schema_version": "1.0", "records": self._bad_rows()}, f)
+        os.environ["CLEANED_DATA_FORMAT"] = "both"
+        self.assertEqual(clean_data.clean(), 0)
+        for header in (open_columns(self.tmp / "cleaned_data.col")["header"], self.read_json("cleaned_data.json")):
+            self.assertEqual(header["validation_errors_count"], 8)
+            self.assertEqual(header["rejections"]["timestamp"]["out_of_range"], 2)
+            self.assertEqual(len(header["rejected_samples"]), 9)  # one per failing field
+
+
+class TestDedup(PipelineTestCase):
+    def test_replayed_export_counted_once(self):
+        _write_csv(self.tmp / "a.csv", 300)
+        with open(self.tmp / "a.csv", "a", encoding="utf-8") as f, open(self.tmp / "a.csv", "r", encoding="utf-8") as src:
+            f.writelines(src.readlines()[101:201])  # rows r100..r199 again
+        os.environ.update({"DATA_SOURCE_PATH": str(self.tmp / "a.csv"), "DATA_SOURCE_FORMAT": "csv"})
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        cols = open_columns(self.tmp / "cleaned_data.col")
+        self.assertEqual((cols["record_count"], cols["header"]["duplicates_dropped_count"]), (300, 100))
+        _write_csv(self.tmp / "b.csv", 300)
+        os.environ["DATA_SOURCE_PATH"] = str(self.tmp / "b.csv")
+        expected = self.read_json("analytics_result.json")["totals"]
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        self.assertEqual(self.read_json("analytics_result.json")["totals"], expected)
+
+    def test_spilled_keys_stay_exact(self):
+        raw = [_raw_record(i % 700) for i in range(2000)] + [{"id": "", "metrics": {}}] * 3
+        with mock.patch.object(clean_data, "_SPILL_EVERY", 64), mock.patch.object(clean_data, "DEFAULT_DEDUP_CAPACITY", 1000):
+            stats = {}
+            ids = [r["id"] for r in clean_data.clean_records(raw, stats)]
+        self.assertEqual(ids, [f"r{i}" for i in range(700)] + [""] * 3)  # first occurrence wins; empty keys kept
+        self.assertEqual(stats["duplicates_dropped_count"], 1300)
+        self.assertEqual(list(self.tmp.glob("dedup_keys.*")), [])
+
+    def test_spill_dir(self):
+        spill = self.tmp / "slice"
+        seen = clean_data.KeySet(1000, spill_dir=spill)
+        with mock.patch.object(clean_data, "_SPILL_EVERY", 4):
+            for i in range(10):
+                seen.add(i.to_bytes(16, "big"))
+        self.assertEqual(len(list(spill.glob("dedup_keys.*"))), 1)
+        self.assertEqual(list(self.tmp.glob("dedup_keys.*")), [])
+        self.assertTrue(seen.add((3).to_bytes(16, "big")))
+        seen.close()
+        self.assertEqual(list(spill.glob("dedup_keys.*")), [])
+
+    def test_key_tuple_and_off(self):
+        raw = [_raw_record(i) for i in range(50)] + [{**_raw_record(i), "id": f"x{i}"} for i in range(20)]
+        os.environ["CLEAN_DEDUP_KEY"] = "source, timestamp"
+        stats = {}
+        self.assertEqual(len(list(clean_data.clean_records(raw, stats))), 50)
+        os.environ["CLEAN_DEDUP_KEY"] = "none"
+        self.assertEqual(len(list(clean_data.clean_records(raw + raw, {}))), 140)
+
+
+class TestVectorizedAnalyze(PipelineTestCase):
+    def test_backends_match_row_aggregation(self):
+        sources = ["fb", " fb", "", "google ", "google", "email"]
+        records = [
+            {"id": str(i), "timestamp": f"2026-03-{1 + i % 30:02d}T00:00:00Z" if i % 9 else "", "source": sources[i % 6],
+             "visits": float(i % 13), "conversions": (i % 7) * 0.1, "revenue": i * 0.37 + 0.01}
+            for i in range(5000)
+        ]
+        expected = _strip_volatile(analyze.aggregate(records))
+        write_columns(self.tmp / "c.col", {"schema_version": "1.0"}, records)
+        cols = open_columns(self.tmp / "c.col")
+        backends = ["python", "numpy"] if analyze.NUMPY_AVAILABLE else ["python"]
+        for backend in backends:
+            self.assertEqual(_strip_volatile(analyze.aggregate_columns(cols, backend=backend)), expected, backend)
+        self.assertEqual([s["source"] for s in expected["by_source"]], ["email", "fb", "google", "unknown"])
+
+
+class TestPartialAggregation(PipelineTestCase):
+    def _records(self, n: int, offset: int = 0) -> list:
+        return [
+            {"id": str(i), "timestamp": f"2026-04-{1 + i % 28:02d}T00:00:00Z", "source": f"s{i % 4}" if i % 50 else f"rare{i}",
+             "visits": float(i % 13), "conversions": float(i % 2), "revenue": float(i % 97)}
+            for i in range(offset, offset + n)
+        ]
+
+    def test_merge_is_associative_with_identity(self):
+        a, b, c = (analyze.partial_from_records(self._records(300, k * 300)) for k in range(3))
+        left = analyze.merge_partials(analyze.merge_partials(a, b), c)
+        right = analyze.merge_partials(a, analyze.merge_partials(b, c))
+        self.assertEqual(left, right)
+        self.assertEqual(analyze.merge_partials(analyze.empty_partial(), a), a)
+        self.assertEqual(left, analyze.partial_from_records(self._records(900)))
+        self.assertEqual(a["record_count"], 300)
+
+    def test_sharded_matches_single_process(self):
+        records = self._records(4000)
+        write_columns(self.tmp / "c.col", {"schema_version": "1.0"}, records)
+        merged = analyze.aggregate_sharded(self.tmp / "c.col", workers=2, shards=5)
+        self.assertEqual(_strip_volatile(analyze.finalize(merged)), _strip_volatile(analyze.aggregate(records)))
+        cols = open_columns(self.tmp / "c.col")
+        pieces = [analyze.partial_from_columns(cols, a, b) for a, b in ((0, 1000), (1000, 2500), (2500, 4000))]
+        self.assertEqual(analyze.merge_all(pieces), analyze.partial_from_records(records))
+
+
+class TestSketches(PipelineTestCase):
+    def test_hll_and_digest_estimates_merge(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        a.update(str(i).encode() for i in range(60000))
+        b.update(str(i).encode() for i in range(40000, 100000))
+        merged = HyperLogLog.from_state(a.merge(b).to_state())
+        self.assertLess(abs(merged.estimate() - 100000) / 100000, 4 * merged.error())
+        small = HyperLogLog()
+        small.update([b"x", b"y", b"x"])
+        self.assertEqual(small.estimate(), 2)
+        lo, hi = TDigest(), TDigest()
+        lo.update([float(i) for i in range(0, 50000)])
+        hi.update([float(i) for i in range(50000, 100000)])
+        digest = TDigest.from_state(lo.merge(hi).to_state())
+        for q in (0.5, 0.9, 0.99):
+            self.assertLess(abs(digest.quantile(q) - q * 100000), 500, q)
+        self.assertEqual((digest.quantile(0), digest.quantile(1)), (0.0, 99999.0))
+        skewed = TDigest()
+        skewed.update([0.0] * 90 + [100.0] * 10)
+        self.assertEqual([skewed.quantile(q) for q in (0.5, 0.89, 0.95)], [0.0, 0.0, 100.0])
+        self.assertIsNone(TDigest().quantile(0.5))
+
+    def test_columns_match_records(self):
+        records = [{"id": f"u{i % 3000}" if i % 10 else "", "timestamp": "2026-04-01T00:00:00Z", "source": "s",
+                    "visits": 1.0, "conversions": 0.0, "revenue": (i * 7919 % 1000) / 10} for i in range(6000)]
+        write_columns(self.tmp / "c.col", {"schema_version": "1.0"}, records)
+        result = analyze.aggregate_columns(open_columns(self.tmp / "c.col"))
+        self.assertEqual(_strip_volatile(result), _strip_volatile(analyze.aggregate(records)))
+        self.assertLess(abs(result["distinct_ids"] - 2700), 60)
+        self.assertLess(abs(result["revenue_percentiles"]["p90"] - 90), 1)
+
+    def test_batches_match_per_value_path(self):
+        values = [f"user-{i}".encode() * (i % 4) for i in range(3000)]  # empty, one- and multi-word ids
+        scalar = HyperLogLog()
+        for v in values:
+            if v:
+                scalar.add_hash(sketches.hash64(v))
+        batched = HyperLogLog()
+        batched.update(v for v in values if v)
+        self.assertEqual(batched.to_state(), scalar.to_state())
+        records = [{"id": f"u{i % 3000}", "timestamp": "2026-04-01T00:00:00Z", "source": "s", "visits": 1.0,
+                    "conversions": 0.0, "revenue": float(i * 7919 % 5000) / 7} for i in range(5000)]
+        write_columns(self.tmp / "c.col", {"schema_version": "1.0"}, records)
+        with mock.patch.object(sketches, "_BATCH", 700):  # several batches, the last one partial
+            result = analyze.aggregate_columns(open_columns(self.tmp / "c.col"))
+            self.assertEqual(_strip_volatile(result), _strip_volatile(analyze.aggregate(records)))
+        for q in (0.5, 0.9, 0.99):
+            self.assertLess(abs(result["revenue_percentiles"][f"p{round(q * 100)}"] - q * 5000 / 7), 5, q)
+
+    def test_top_sources_fold_into_other(self):
+        records = [{"id": str(i), "timestamp": "2026-04-01T00:00:00Z", "source": f"s{i % 40:02d}",
+                    "visits": 1.0, "conversions": 0.0, "revenue": float(i % 40)} for i in range(400)]
+        with mock.patch.dict(os.environ, {"ANALYZE_TOP_SOURCES": "3"}):
+            result = analyze.aggregate(records)
+        self.assertEqual([s["source"] for s in result["by_source"]], ["s39", "s38", "s37", "other"])
+        other = result["by_source"][-1]
+        self.assertEqual((other["folded_sources"], other["visits"], other["revenue"]), (37, 370.0, 10.0 * sum(range(37))))
+        self.assertEqual(result["source_count"], 40)
+        self.assertEqual(sum(s["visits"] for s in result["by_source"]), result["totals"]["visits"])
+        report = generate_report.build_report(result)
+        self.assertIn("Top source: s39 (of 40)", report["narrative"])
+        self.assertEqual(report["distinct_ids"], result["distinct_ids"])
+
+    def test_incremental_state_carries_sketches(self):
+        source = self.tmp / "feed.ndjson"
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "ndjson"})
+        _write_ndjson(source, 100)
+        self.assertEqual(pipeline.run(incremental=True), 0)
+        state = self.read_json("pipeline_state.json")
+        del state["partial"]["ids_hll"]  # a state written before sketches existed
+        (self.tmp / "pipeline_state.json").write_text(json.dumps(state), encoding="utf-8")
+        with open(source, "a", encoding="utf-8") as f:
+            for i in range(100, 150):
+                rec = _raw_record(i)
+                rec["timestamp"] = "2026-02-01T00:00:00+00:00"
+                f.write(json.dumps(rec) + "\n")
+        self.assertEqual(pipeline.run(incremental=True), 0)
+        result = self.read_json("analytics_result.json")
+        self.assertAlmostEqual(result["distinct_ids"], 150, delta=3)  # rebuilt from all records, not just the new 50
+        self.assertEqual(self.read_json("pipeline_state.json")["partial"]["record_count"], 150)
+
+
+class TestBenchmark(PipelineTestCase):
+    def test_synthetic_inputs_are_the_same_records_in_every_format(self):
+        seen = []
+        for fmt in benchmark.FORMATS:
+            path = benchmark.generate(self.tmp / f"in.{fmt}", fmt, 300, seed=7)
+            with mock.patch.dict(os.environ, {"DATA_SOURCE_PATH": str(path), "DATA_SOURCE_FORMAT": fmt}):
+                records = list(ingest_data.read_raw()["records"])
+            seen.append([(r["id"], r["timestamp"], r["source"], float(r["metrics"]["revenue"])) for r in records])
+        self.assertEqual(len(seen[0]), 300)
+        self.assertEqual(seen[0], seen[1])
+        self.assertEqual(seen[1], seen[2])
+        self.assertLess(len({r[0] for r in seen[0]}), 300)  # some ids repeat, for de-duplication
+        self.assertEqual(benchmark.parse_count("2.5k"), 2500)
+
+    def test_baseline_round_trip_and_regression(self):
+        baseline = self.tmp / "baseline.json"
+        args = ["--records", "200", "--formats", "ndjson", "--stages", "analyze,pipeline", "--baseline", str(baseline)]
+        with mock.patch.object(benchmark, "BENCH_DIR", self.tmp / "bench"), mock.patch.object(benchmark, "RESULT_FILE", self.tmp / "bench" / "result.json"), \
+                redirect_stderr(io.StringIO()) as err, mock.patch("sys.stdout", io.StringIO()):
+            self.assertEqual(benchmark.main(args + ["--save-baseline"]), 0)
+            saved = json.loads(baseline.read_text(encoding="utf-8"))
+            self.assertEqual(sorted(saved["results"]), ["ndjson/200/analyze", "ndjson/200/pipeline"])
+            self.assertGreater(saved["results"]["ndjson/200/pipeline"]["bytes_written"], 0)
+            saved["results"]["ndjson/200/analyze"]["records_per_sec"] = 1e12
+            baseline.write_text(json.dumps(saved), encoding="utf-8")
+            self.assertEqual(benchmark.main(args + ["--threshold", "90"]), 1)  # only the doctored stage is that far off
+        self.assertIn("ndjson/200/analyze: records/s", err.getvalue())
+        self.assertNotIn("pipeline", err.getvalue())
+        self.assertFalse((self.tmp / "bench" / "run").exists())
+
+    def test_real_tmp_is_untouched(self):
+        real = Path(benchmark.__file__).resolve().parent.parent / ".tmp"
+        stage_modules = [pipeline] + [m for m in vars(pipeline).values() if isinstance(m, types.ModuleType) and m.__name__.startswith("tools.")]
+        saved = [(m, dict(vars(m))) for m in stage_modules]
+        try:
+            benchmark._point_tools_at(self.tmp / "run")
+            for m in stage_modules:
+                for name, value in vars(m).items():
+                    # setUp already moved them to self.tmp: anything there but outside run/ was not redirected.
+                    if isinstance(value, Path) and (value.is_relative_to(real) or value.is_relative_to(self.tmp)):
+                        self.assertTrue(value.is_relative_to(self.tmp / "run"), f"{m.__name__}.{name} still points at {value}")
+        finally:
+            for m, attrs in saved:
+                vars(m).update(attrs)
+
+        def snapshot():
+            return {p: p.stat().st_mtime_ns for p in real.rglob("*") if p.is_file()} if real.is_dir() else {}
+
+        before = snapshot()
+        args = ["--records", "200", "--formats", "csv", "--stages", "clean,pipeline"]
+        with mock.patch.object(benchmark, "BENCH_DIR", self.tmp / "bench"), mock.patch.object(benchmark, "RESULT_FILE", self.tmp / "bench" / "result.json"), \
+                redirect_stderr(io.StringIO()), mock.patch("sys.stdout", io.StringIO()):
+            self.assertEqual(benchmark.main(args), 0)
+        self.assertEqual(snapshot(), before)
+
+
+class TestIncrementalPipeline(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.tmp / "feed.ndjson"
+        os.environ.update({"DATA_SOURCE_PATH": str(self.source), "DATA_SOURCE_FORMAT": "ndjson"})
+
+    def _append(self, start: int, stop: int):
+        with open(self.source, "a", encoding="utf-8") as f:
+            for i in range(start, stop):
+                rec = _raw_record(i)
+                rec["timestamp"] = f"2026-05-01T00:{i // 60:02d}:{i % 60:02d}Z"
+                f.write(json.dumps(rec) + "\n")
+
+    def test_folds_only_new_records(self):
+        self._append(0, 100)
+        self.assertEqual(pipeline.run(checkpoint=True, incremental=True), 0)
+        self._append(100, 150)
+        self.assertEqual(pipeline.run(checkpoint=True, incremental=True), 0)
+        self.assertEqual(len(self.read_json("raw_input.json")["records"]), 50)
+        incremental = self.read_json("analytics_result.json")
+        self.assertEqual(self.read_json("pipeline_state.json")["watermark"], {"field": "timestamp", "value": "2026-05-01T00:02:29Z"})
+        self.assertEqual(pipeline.run(checkpoint=True, incremental=True, full_rebuild=True), 0)
+        self.assertEqual(len(self.read_json("raw_input.json")["records"]), 150)
+        self.assertEqual(_strip_volatile(self.read_json("analytics_result.json")), _strip_volatile(incremental))
+        self._append(150, 160)
+        self.assertEqual(pipeline.run(checkpoint=True, incremental=True), 0)
+        self.assertEqual(len(self.read_json("raw_input.json")["records"]), 10)
+        self.assertEqual(self.read_json("analytics_result.json")["totals"]["visits"], incremental["totals"]["visits"] + sum(i % 17 for i in range(150, 160)))
+
+    def test_numeric_id_watermark(self):
+        mark = {}
+        records = [{"id": str(i)} for i in (3, 9, 10, 2, 11)]
+        self.assertEqual([r["id"] for r in ingest_data.filter_since(records, "id", "9", mark)], ["10", "11"])
+        self.assertEqual(mark["value"], "11")
+
+
+class TestStageManifests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.tmp / "feed.csv"
+        _write_csv(self.source, 200)
+        os.environ.update({"DATA_SOURCE_PATH": str(self.source), "DATA_SOURCE_FORMAT": "csv"})
+
+    def test_resumes_at_failed_delivery(self):
+        with mock.patch.object(send_payload, "deliver", return_value=1):
+            self.assertEqual(pipeline.run(checkpoint=True), 1)
+        self.assertIsNone(pipeline.load_manifest("deliver"))
+        self.assertEqual(pipeline.load_manifest("report")["tool_version"], pipeline.tool_version("report"))
+        with mock.patch.object(ingest_data, "read_raw") as read_raw, mock.patch.object(generate_report, "build_report") as build:
+            self.assertEqual(pipeline.run(checkpoint=True), 0)
+        read_raw.assert_not_called()
+        build.assert_not_called()
+        self.assertTrue((self.tmp / "report_summary.txt").is_file())
+        with mock.patch.object(send_payload, "deliver") as deliver:
+            self.assertEqual(pipeline.run(checkpoint=True), 0)
+        deliver.assert_not_called()
+
+    def test_changed_input_reruns_from_that_stage(self):
+        self.assertEqual(pipeline.run(checkpoint=True, title="A"), 0)
+        ingested = pipeline.load_manifest("ingest")
+        with mock.patch.object(ingest_data, "read_raw") as read_raw:
+            self.assertEqual(pipeline.run(checkpoint=True, title="B"), 0)
+        read_raw.assert_not_called()
+        self.assertEqual(self.read_json("report_output.json")["title"], "B")
+        self.assertEqual(pipeline.load_manifest("ingest"), ingested)
+        _write_csv(self.source, 201)
+        self.assertEqual(pipeline.run(checkpoint=True, title="B"), 0)
+        self.assertNotEqual(pipeline.load_manifest("ingest")["input_hash"], ingested["input_hash"])
+        self.assertEqual(self.read_json("analytics_result.json")["totals"]["visits"], sum(i % 17 for i in range(201)))
+
+    def test_analyze_resumes_from_cleaned_checkpoint(self):
+        self.assertEqual(pipeline.run(checkpoint=True, incremental=True), 0)
+        expected = self.read_json("analytics_result.json")
+        (self.tmp / "analytics_result.json").unlink()
+        with mock.patch.object(ingest_data, "read_raw") as read_raw:
+            self.assertEqual(pipeline.run(checkpoint=True, incremental=True), 0)
+        read_raw.assert_not_called()
+        self.assertEqual(self.read_json("analytics_result.json")["totals"], expected["totals"])
+
+
+class TestRollups(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.tmp / "feed.csv"
+        _write_csv(self.source, 300)
+        os.environ.update({"DATA_SOURCE_PATH": str(self.source), "DATA_SOURCE_FORMAT": "csv"})
+
+    def test_buckets(self):
+        self.assertEqual(rollup.buckets_for("2026-03-04T23:59:59+02:00"), ("2026-03-04T21:00:00Z", "2026-03-04T00:00:00Z", "2026-03-02T00:00:00Z"))
+        self.assertEqual(rollup.buckets_for("2026-03-08T22:30:00-05:30")[1], "2026-03-09T00:00:00Z")
+        self.assertIsNone(rollup.buckets_for("not a time"))
+        builder = rollup.RollupBuilder()
+        for ts in ("2026-01-01T10:00:00+0500", "2026-01-01T10:30:00", "2026-01-01T10:15:00Z", "2026-01-01T10:45:00+05:00", "2026-01-01T10:50:00+01:00"):
+            builder.add(ts, "ads", 1, 0, 0)
+        self.assertEqual({hour: cell[0] for (hour, _), cell in builder.hours.items()},
+                         {"2026-01-01T05:00:00Z": 2, "2026-01-01T10:00:00Z": 2, "2026-01-01T09:00:00Z": 1})
+
+    def test_column_rollup_matches_row_rollup(self):
+        stamps = ("2026-01-01T10:00:00+0500", "2026-01-01T10:30:00", "2026-01-01 10:15:00Z", "2026-01-01T10:45:00+05:00",
+                  "2026-01-01T23:50:00-01:00", "2026-01-01T10:20:00.123Z", "not a time", "", "2026-13-01T10:00:00Z", "2026-01-01",
+                  "2026-01-01T10:00:00-09:00", "2026-01-01T10:00:00+09:00", "2026-01-01T10:59:59-23:00", "2026-01-01T10:00:00-00:00")
+        records = [{"id": f"r{i}", "timestamp": stamps[i % len(stamps)], "source": ("ads", " ads ", "", "web")[i % 4],
+                    "visits": i, "conversions": i % 3, "revenue": i * 0.25} for i in range(280)]
+        write_columns(self.tmp / "mixed.col", {"schema_version": "1.0"}, iter(records))
+        rows, cols = rollup.RollupBuilder(), rollup.RollupBuilder()
+        for r in records:
+            rows.add(r["timestamp"], r["source"], r["visits"], r["conversions"], r["revenue"])
+        cols.add_columns(open_columns(self.tmp / "mixed.col"))
+        self.assertEqual(cols.hours, rows.hours)
+        self.assertEqual(cols.skipped, rows.skipped)
+        hours = {hour for hour, _ in cols.hours}
+        # Same local hour, different (negative) offsets: each lands in its own UTC hour.
+        self.assertLessEqual({"2026-01-01T19:00:00Z", "2026-01-01T01:00:00Z", "2026-01-02T09:00:00Z", "2026-01-01T10:00:00Z"}, hours)
+
+    def test_rollups_match_totals(self):
+        self.assertEqual(pipeline.run(), 0)
+        result = self.read_json("analytics_result.json")
+        for grain in rollup.GRAINS:
+            rows = rollup.query(grain, group_by=["source"])
+            self.assertEqual({r["source"]: r["visits"] for r in rows}, {s["source"]: s["visits"] for s in result["by_source"]})
+        (total,) = rollup.query("hour", group_by=[])
+        self.assertEqual(total["record_count"], 300)
+        days = rollup.query("day", start="2026-01-02", end="2026-01-04", sources=["src1"])
+        self.assertEqual([r["bucket"] for r in days], ["2026-01-02T00:00:00Z", "2026-01-03T00:00:00Z"])
+        with self.assertRaises(ValueError):
+            rollup.query("month")
+
+    def test_analyze_tool_matches_pipeline_and_incremental_adds(self):
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        expected = rollup.query("hour")
+        (self.tmp / "analytics_rollup.db").unlink()
+        self.assertEqual(analyze.analyze(), 0)
+        self.assertEqual(rollup.query("hour"), expected)
+        os.environ["DATA_SOURCE_FORMAT"] = "ndjson"
+        self.source = self.tmp / "feed.ndjson"
+        os.environ["DATA_SOURCE_PATH"] = str(self.source)
+        _write_ndjson(self.source, 40)
+        self.assertEqual(pipeline.run(incremental=True, full_rebuild=True), 0)
+        with open(self.source, "a", encoding="utf-8") as f:
+            rec = _raw_record(1)
+            rec["timestamp"] = "2026-02-01T00:00:00+00:00"
+            f.write(json.dumps(rec) + "\n")
+        self.assertEqual(pipeline.run(incremental=True), 0)
+        (total,) = rollup.query("week", group_by=[])
+        self.assertEqual(total["record_count"], 41)
+
+
+class TestHistory(PipelineTestCase):
+    def test_runs_accumulate_and_latest_is_cached(self):
+        source = self.tmp / "feed.ndjson"
+        _write_ndjson(source, 100)
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "ndjson", "PIPELINE_WATERMARK_FIELD": "timestamp"})
+        self.assertEqual(pipeline.run(incremental=True), 0)
+        first = history.latest()
+        self.assertEqual(first["record_count"], 100)
+        with mock.patch.object(history, "connect") as connect:
+            self.assertIs(history.latest(), first)
+        connect.assert_not_called()
+        self.assertEqual(pipeline.run(incremental=True), 0)  # same data: same period, row replaced
+        self.assertEqual(len(history.query()), 1)
+        self.assertIsNot(history.latest(), first)
+
+        with open(source, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**_raw_record(100), "timestamp": "2026-02-01T00:00:00+00:00"}) + "\n")
+        self.assertEqual(pipeline.run(incremental=True), 0)
+        rows = history.query(compare=True)
+        self.assertEqual([r["record_count"] for r in rows], [100, 101])
+        self.assertEqual(rows[1]["change"]["record_count"], {"delta": 1, "pct": 1.0})
+        self.assertIsNone(rows[0]["change"])
+        self.assertEqual(history.latest()["record_count"], 101)
+        self.assertEqual([r["period_end"] for r in history.query(start="2026-01-29")], ["2026-02-01T00:00:00+00:00"])
+
+
+class TestBackfill(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        source = self.tmp / "feed.ndjson"
+        _write_ndjson(source, 400)
+        with open(source, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**_raw_record(400), "timestamp": "2025-12-31T23:00:00+00:00"}) + "\n")  # before the range
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "ndjson"})
+
+    def test_slices(self):
+        self.assertEqual(backfill.make_slices("2026-01-30", "2026-03-02T12:00:00+02:00", "month"), [
+            ("2026-01-30T00:00:00Z", "2026-02-01T00:00:00Z"), ("2026-02-01T00:00:00Z", "2026-03-01T00:00:00Z"),
+            ("2026-03-01T00:00:00Z", "2026-03-02T10:00:00Z"),
+        ])
+        self.assertEqual(len(backfill.make_slices("2026-01-01", "2026-01-15", "3d")), 5)
+        for args in (("2026-02-01", "2026-01-01", "day"), ("2026-01-01", "2026-02-01", "year"), ("x", "2026-02-01", "day")):
+            with self.assertRaises(ValueError, msg=args):
+                backfill.make_slices(*args)
+
+    def test_merged_slices_match_a_full_run(self):
+        self.assertEqual(backfill.backfill("2026-01-01", "2026-02-01", "week", workers=2), 0)
+        self.assertIsNone(history.latest())  # backfills are not run results
+        rows = history.query(kind="backfill")
+        self.assertEqual([(r["period_start"], r["period_end"]) for r in rows], [
+            ("2026-01-01T00:00:00Z", "2026-01-08T00:00:00Z"), ("2026-01-08T00:00:00Z", "2026-01-15T00:00:00Z"),
+            ("2026-01-15T00:00:00Z", "2026-01-22T00:00:00Z"), ("2026-01-22T00:00:00Z", "2026-01-29T00:00:00Z"),
+            ("2026-01-01T00:00:00Z", "2026-02-01T00:00:00Z"),
+        ])
+        merged = rows[-1]
+        self.assertEqual(sum(r["record_count"] for r in rows[:-1]), merged["record_count"])
+
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        expected = self.read_json("analytics_result.json")
+        self.assertEqual(merged["record_count"], expected["record_count"] - 1)
+        self.assertEqual(history.latest()["record_count"], expected["record_count"])
+        self.assertEqual(len(history.query(kind="run")), 1)
+
+    def test_failed_slice_is_retried_alone(self):
+        run_dir = backfill.BACKFILL_DIR / backfill.run_key("2026-01-01", "2026-02-01", "week")
+        self.assertEqual(backfill.backfill("2026-01-01", "2026-02-01", "week", workers=2), 0)
+        expected = history.query(kind="backfill")
+        for d in run_dir.glob("[0-9]*"):
+            (d / "slice.json").unlink()
+        raw = run_dir / "0001" / "raw.ndjson"
+        good = raw.read_bytes()
+        raw.write_bytes(good + b"{not json\n")
+        with redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(backfill.backfill("2026-01-01", "2026-02-01", "week", workers=2, retries=1), 1)
+        self.assertIn("slice 2026-01-08T00:00:00Z failed", err.getvalue())
+        self.assertEqual(json.loads((run_dir / "0001" / "slice.json").read_text())["attempts"], 2)
+        done = {d.name: (d / "slice.json").stat().st_mtime_ns for d in run_dir.glob("[0-9]*") if d.name != "0001"}
+
+        raw.write_bytes(good)
+        stages = {}
+        self.assertEqual(backfill.backfill("2026-01-01", "2026-02-01", "week", on_stage=lambda s, st, **i: stages.__setitem__(s, st)), 0)
+        self.assertEqual({d: (run_dir / d / "slice.json").stat().st_mtime_ns for d in done}, done)
+        self.assertEqual(stages["ingest"], "skipped")
+        self.assertEqual(stages["slice 2026-01-08T00:00:00Z"], "done")
+        self.assertEqual(stages["slice 2026-01-01T00:00:00Z"], "skipped")
+        self.assertEqual([(r["period_start"], r["record_count"], r["totals"]) for r in history.query(kind="backfill")],
+                         [(r["period_start"], r["record_count"], r["totals"]) for r in expected])
+
+
+class TestPreview(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        source = self.tmp / "feed.ndjson"
+        _write_ndjson(source, 4000)
+        with open(source, "a", encoding="utf-8") as f:
+            for i in range(40):  # rejected by validation: estimated away, not counted
+                f.write(json.dumps({**_raw_record(5000 + i), "timestamp": "not a time"}) + "\n")
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "ndjson"})
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        self.expected = self.read_json("analytics_result.json")
+
+    def test_full_sample_is_exact(self):
+        out = preview.preview(size=5000)
+        self.assertTrue(out["exact"])
+        self.assertEqual(out["population_count"], 4040)
+        self.assertEqual(out["record_count"]["estimate"], self.expected["record_count"])
+        for m in ("visits", "conversions", "revenue"):
+            cell = out["totals"][m]
+            self.assertAlmostEqual(cell["estimate"], self.expected["totals"][m], places=2)
+            self.assertEqual((cell["low"], cell["high"]), (cell["estimate"], cell["estimate"]))
+        self.assertEqual([r["source"] for r in out["by_source"]], [r["source"] for r in self.expected["by_source"]])
+        self.assertEqual(self.read_json("analytics_preview.json")["totals"], out["totals"])
+
+    def test_estimates_cover_the_full_result(self):
+        for stratify in ("source", "none"):
+            out = preview.preview(size=400, stratify=stratify, confidence=0.99)
+            first = _strip_volatile(out)
+            self.assertEqual(_strip_volatile(preview.preview(size=400, stratify=stratify, confidence=0.99)), first)  # same seed, same sample
+            self.assertFalse(out["exact"])
+            self.assertEqual(out["strata"], 5 if stratify == "source" else 1)
+            self.assertLessEqual(abs(out["sample_size"] - 400), 5)
+            cells = [(out["record_count"], self.expected["record_count"])]
+            cells += [(out["totals"][m], self.expected["totals"][m]) for m in ("visits", "conversions", "revenue")]
+            cells += [(row["revenue"], want["revenue"]) for row, want in zip(out["by_source"], self.expected["by_source"])]
+            for cell, want in cells:
+                self.assertLess(cell["low"], cell["high"], msg=stratify)
+                self.assertLessEqual(cell["low"], want, msg=stratify)
+                self.assertGreaterEqual(cell["high"], want, msg=stratify)
+        with self.assertRaises(ValueError):
+            preview.preview(stratify="region")
+
+    def test_sample_is_cleaned_once(self):
+        a, b = {**_raw_record(1), "source": "s1"}, {**_raw_record(2), "source": "s2"}
+        strata = {"s1": (10, [a]), "s2": (10, [b, {**a, "source": "s2"}])}  # the same id in another stratum
+        made, real = [], clean_data.KeySet
+        with mock.patch.object(clean_data, "KeySet", side_effect=lambda *args, **kw: made.append(args) or real(*args, **kw)):
+            out = preview.estimate(strata)
+        self.assertEqual(made, [(1000,)])  # one dedup set, sized to the sample
+        self.assertEqual(out["duplicates_dropped_count"], 1)
+        self.assertEqual([r["source"] for r in out["by_source"]], ["s1", "s2"])
+
+    def test_sample_held_is_capped(self):
+        held = []
+
+        class Counting(preview.Reservoir):
+            def __init__(self, k, rng):
+                super().__init__(k, rng)
+                held.append(k)
+
+        batches = [[{"id": str(i), "source": f"s{i % 30}"} for i in range(j, j + 500)] for j in range(0, 3000, 500)]
+        with mock.patch.object(preview, "Reservoir", Counting):
+            strata = preview.sample_records(batches, 100, "source")
+        self.assertLessEqual(sum(held), 100 + 2 * (preview.MAX_STRATA + 1))
+        self.assertEqual((len(strata), sum(p for p, _ in strata.values())), (preview.MAX_STRATA + 1, 3000))
+        self.assertTrue(all(len(sample) >= 2 for _, sample in strata.values()))
+
+    def test_reservoir_is_uniform(self):
+        counts = [0] * 20
+        for seed in range(2000):
+            res = preview.Reservoir(5, random.Random(seed))
+            for i in range(20):
+                res.add(i)
+            for i in res.items:
+                counts[i] += 1
+        self.assertEqual(sum(counts), 10000)
+        self.assertTrue(all(400 <= c <= 600 for c in counts), counts)
+
+
+class TestRender(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        source = self.tmp / "feed.csv"
+        _write_csv(source, 150)
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "csv", "REPORT_FORMATS": "csv,html,md"})
+
+    def test_formats_match_the_report(self):
+        self.assertEqual(pipeline.run(checkpoint=False), 0)
+        report = self.read_json("report_output.json")
+        with open(self.tmp / "report_output.csv", newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([r["source"] for r in rows], [s["source"] for s in report["by_source"]] + ["total"])
+        self.assertEqual(float(rows[-1]["revenue"]), report["metrics"]["revenue"])
+        self.assertIn(f"<h1>{report['title']}</h1>", (self.tmp / "report_output.html").read_text(encoding="utf-8"))
+        self.assertTrue((self.tmp / "report_output.md").read_text(encoding="utf-8").startswith(f"# {report['title']}\n"))
+
+        hostile = {**report, "title": "<script>|x", "by_source": [{"source": "a|<b>", "visits": 1, "conversions": 0, "revenue": 2}]}
+        page = "".join(render.render_html(hostile))
+        self.assertNotIn("<script>", page)
+        self.assertIn("a|&lt;b&gt;", page)
+        self.assertIn("| a\\|<b> |", "".join(render.render_md(hostile)))
+
+    def test_unchanged_results_come_from_the_cache(self):
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        first = (self.tmp / "report_output.html").read_bytes()
+        self.assertEqual(len(list((self.tmp / "render_cache").iterdir())), 3)
+
+        def boom(report):
+            raise AssertionError("re-rendered")
+            yield
+
+        with mock.patch.dict(render.RENDERERS, {"csv": boom, "html": boom, "md": boom}):
+            self.assertEqual(analyze.analyze(), 0)  # new computed_at, same figures
+            self.assertEqual(generate_report.generate_report(), 0)
+            result = self.read_json("analytics_result.json")
+            report = self.read_json("report_output.json")
+            self.assertEqual({f: v["cached"] for f, v in render.render_all(result, report).items()}, {"csv": True, "html": True, "md": True})
+            with self.assertRaises(AssertionError):
+                generate_report.generate_report(title="Weekly")
+        self.assertEqual((self.tmp / "report_output.html").read_bytes(), first)
+
+        self.assertEqual(generate_report.generate_report(title="Weekly"), 0)
+        self.assertIn(b"<h1>Weekly</h1>", (self.tmp / "report_output.html").read_bytes())
+        self.assertEqual(len(list((self.tmp / "render_cache").iterdir())), 6)
+        with mock.patch.dict(os.environ, {"RENDER_CACHE_MAX": "4"}):
+            self.assertEqual(generate_report.generate_report(title="Monthly"), 0)
+        self.assertEqual(len(list((self.tmp / "render_cache").iterdir())), 4)
+
+    def test_report_formats_setting(self):
+        os.environ["REPORT_FORMATS"] = "md, pdf"
+        self.assertEqual(render.report_formats(), ("md",))
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        self.assertTrue((self.tmp / "report_output.md").is_file())
+        self.assertFalse((self.tmp / "report_output.csv").exists())
+        self.assertEqual(sorted(pipeline.load_manifest("report")["outputs"]), ["report_output.json", "report_output.md"])
+        os.environ["REPORT_FORMATS"] = "none"
+        self.assertEqual(render.report_formats(), ())
+
+
+class TestQuery(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        query.clear_cache()
+        source = self.tmp / "feed.ndjson"
+        _write_ndjson(source, 300)
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "ndjson", "CLEANED_DATA_FORMAT": "both"})
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        query.refresh_store()
+
+    def tearDown(self):
+        query.clear_cache()
+        super().tearDown()
+
+    def test_matches_a_scan_of_the_cleaned_records(self):
+        spec = {
+            "filters": [{"field": "source", "op": "prefix", "value": "src"}, {"field": "source", "op": "ne", "value": "src0"},
+                        {"field": "timestamp", "op": "between", "value": ["2026-01-03", "2026-01-10T00:00:00+00:00"]}],
+            "group_by": ["source", "day"],
+            "aggregates": [{"fn": "sum", "field": "revenue"}, {"fn": "count", "as": "n"}, {"fn": "max", "field": "visits"}],
+            "order_by": [{"field": "sum_revenue", "desc": True}, "source", "day"],
+        }
+        result = query.run(spec)
+        expected = {}
+        for r in self.read_json("cleaned_data.json")["records"]:
+            day = r["timestamp"][:10]
+            if r["source"] != "src0" and "2026-01-03" <= day < "2026-01-10":
+                cell = expected.setdefault((r["source"], day + "T00:00:00Z"), [0.0, 0, 0.0])
+                cell[0] += r["revenue"]
+                cell[1] += 1
+                cell[2] = max(cell[2], r["visits"])
+        got = {(row["source"], row["day"]): [row["sum_revenue"], row["n"], row["max_visits"]] for row in result["rows"]}
+        self.assertEqual(got, expected)
+        self.assertEqual(result["columns"], ["source", "day", "sum_revenue", "n", "max_visits"])
+        revenue = [row["sum_revenue"] for row in result["rows"]]
+        self.assertEqual(revenue, sorted(revenue, reverse=True))
+        self.assertTrue(all("USING" in step for step in query.explain(spec) if step.startswith("SEARCH")))
+
+    def test_cache_is_keyed_by_data_version(self):
+        spec = {"group_by": ["week"], "aggregates": [{"fn": "sum", "field": "visits"}, {"fn": "count_distinct", "field": "source"}]}
+        first = query.run(spec)
+        self.assertFalse(first["cached"])
+        with mock.patch.object(query, "connect") as connect:
+            self.assertTrue(query.run(spec)["cached"])
+        connect.assert_not_called()
+        self.assertEqual(sum(r["sum_visits"] for r in first["rows"]), self.read_json("analytics_result.json")["totals"]["visits"])
+
+        _write_ndjson(Path(os.environ["DATA_SOURCE_PATH"]), 50)
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        second = query.run(spec)  # the pipeline rebuilt the store
+        self.assertFalse(second["cached"] or second["stale"])
+        self.assertNotEqual(second["data_version"], first["data_version"])
+        self.assertEqual(sum(r["sum_visits"] for r in second["rows"]), self.read_json("analytics_result.json")["totals"]["visits"])
+
+    def test_queries_never_build_the_store(self):
+        spec = {"aggregates": [{"fn": "count"}]}
+        self.assertEqual(query.run(spec)["rows"], [{"count": 300}])
+        _write_ndjson(Path(os.environ["DATA_SOURCE_PATH"]), 50)
+        with mock.patch.object(query, "refresh_in_background"):
+            self.assertEqual(pipeline.run(checkpoint=True), 0)  # cleaned file changed, store not rebuilt
+        with query._building(True):  # a rebuild in progress elsewhere
+            first = query.run(spec)
+        self.assertEqual((first["rows"], first["stale"]), ([{"count": 300}], True))
+        self.assertTrue(query.run(spec)["stale"])  # starts the rebuild the busy lock refused
+        query._store["builder"].join(10)
+        second = query.run(spec)
+        self.assertEqual((second["rows"], second["stale"]), ([{"count": 50}], False))
+        (self.tmp / "query_store.db").unlink()
+        query.clear_cache()
+        with self.assertRaises(query.StoreBuilding):
+            query.run(spec)
+        query._store["builder"].join(10)
+        self.assertEqual(query.run(spec)["rows"], [{"count": 50}])
+
+    def test_cleaning_rebuilds_only_a_store_in_use(self):
+        spec = {"aggregates": [{"fn": "count"}]}
+        store = self.tmp / "query_store.db"
+        store.unlink()
+        _write_ndjson(Path(os.environ["DATA_SOURCE_PATH"]), 50)
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        self.assertFalse(store.exists())  # no store, so nobody queries: the run builds nothing
+        (self.tmp / "query_store.db.dead.part").write_bytes(b"")
+        query.refresh_store()
+        self.assertEqual(list(self.tmp.glob("*.part")), [])
+        _write_ndjson(Path(os.environ["DATA_SOURCE_PATH"]), 80)
+        self.assertEqual(pipeline.run(checkpoint=True), 0)  # rebuilds in the background
+        query._store["builder"].join(10)
+        result = query.run(spec)
+        self.assertEqual((result["rows"], result["stale"]), ([{"count": 80}], False))
+
+    def test_invalid_specs(self):
+        for spec in ({"filters": [{"field": "colour", "op": "eq", "value": "x"}]}, {"filters": [{"field": "visits", "op": "eq", "value": "1"}]},
+                     {"filters": [{"field": "revenue", "op": "glob", "value": "1*"}]}, {"aggregates": [{"fn": "sum", "field": "source"}]},
+                     {"group_by": ["year"]}, {"order_by": ["revenue"]}, {"limit": 0}, {"select": ["*"]}, []):
+            with self.assertRaises(ValueError, msg=spec):
+                query.run(spec)
+
+
+class TestJobs(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.tmp / "feed.csv"
+        _write_csv(self.source, 120)
+        os.environ.update({"DATA_SOURCE_PATH": str(self.source), "DATA_SOURCE_FORMAT": "csv"})
+
+    def wait(self, job_id: str, timeout: float = 10) -> dict:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = jobs.get_job(job_id)
+            if job["status"] not in jobs.ACTIVE:
+                return job
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_pipeline_job_records_stage_progress(self):
+        job, created = jobs.submit("full_pipeline", {"checkpoint": True})
+        self.assertTrue(created)
+        job = self.wait(job["id"])
+        self.assertEqual((job["status"], job["exit_code"]), ("succeeded", 0))
+        self.assertEqual({s: e["status"] for s, e in job["stages"].items()}, {s: "done" for s in pipeline.STAGES})
+        m = job["metrics"]
+        self.assertEqual(set(m), set(pipeline.STAGES))
+        self.assertEqual((m["ingest"]["records_out"], m["clean"]["records_in"], m["clean"]["records_out"], m["analyze"]["records_in"]), (120, 120, 120, 120))
+        self.assertEqual(m["ingest"]["bytes_read"], self.source.stat().st_size)
+        self.assertEqual(m["ingest"]["bytes_written"], (self.tmp / "raw_input.json").stat().st_size)
+        self.assertGreater(m["clean"]["bytes_written"], 0)
+        self.assertTrue(all(e["wall_seconds"] >= 0 and e["cpu_seconds"] >= 0 for e in m.values()))
+        job = self.wait(jobs.submit("full_pipeline", {"checkpoint": True})[0]["id"])
+        self.assertEqual({e["status"] for e in job["stages"].values()}, {"skipped"})
+        self.assertEqual(job["metrics"], {})  # skipped stages are not measured
+        tool_job = self.wait(jobs.submit("clean_data")[0]["id"])
+        self.assertEqual(tool_job["metrics"]["clean"]["records_out"], 120)
+        self.assertEqual(tool_job["metrics"]["clean"]["bytes_read"], (self.tmp / "raw_input.json").stat().st_size)
+        self.assertEqual(metrics.recent(1)[0]["run_id"], tool_job["id"])
+
+    def test_preview_job_does_not_wait_for_the_lock(self):
+        with jobs.single_flight():
+            job = self.wait(jobs.submit("preview", {"sample": 50})[0]["id"])
+        self.assertEqual((job["status"], job["stages"]["preview"]["sample_size"]), ("succeeded", 50))
+
+    def test_final_status_is_written_under_the_lock(self):
+        update, locked = jobs._update, {}
+
+        def spy(job_id, **fields):
+            if fields.get("status") in ("succeeded", "failed"):
+                locked[fields["status"]] = jobs.is_locked()
+            update(job_id, **fields)
+
+        with mock.patch.object(jobs, "_update", spy):
+            self.assertEqual(self.wait(jobs.submit("ingest_data")[0]["id"])["status"], "succeeded")
+            with mock.patch.object(clean_data, "clean", side_effect=RuntimeError("boom")):
+                self.assertEqual(self.wait(jobs.submit("clean_data")[0]["id"])["error"], "boom")
+        self.assertEqual(locked, {"succeeded": True, "failed": True})
+
+    def test_stream_stage_times_are_exclusive(self):
+        metrics.reset()
+        with mock.patch.object(clean_data, "clean_records", side_effect=lambda records, stats: (time.sleep(0.0005) or r for r in records)):
+            self.assertEqual(pipeline.run(), 0)
+        run = metrics.recent()[0]
+        stages = run["stages"]
+        self.assertGreater(stages["clean"]["wall_seconds"], 0.05)  # 120 records x 0.5 ms
+        self.assertLess(stages["ingest"]["wall_seconds"], stages["clean"]["wall_seconds"])
+        self.assertLessEqual(sum(s["wall_seconds"] for s in stages.values()), run["wall_seconds"] + 1e-3)
+        text = metrics.render_prometheus()
+        self.assertIn('pipeline_stage_records_out_total{stage="ingest"} 120', text)
+        self.assertIn('pipeline_last_run_exit_code{kind="full_pipeline"} 0', text)
+        metrics.reset()
+
+    def test_concurrent_runs_stay_separate(self):
+        metrics.reset()
+        inside, done = threading.Event(), threading.Event()
+        seen = {}
+
+        def job():
+            with metrics.recording("full_pipeline") as run:
+                seen["job"] = run
+                inside.set()
+                done.wait(5)
+                run.exit_code = 0
+
+        t = threading.Thread(target=job)
+        t.start()
+        inside.wait(5)
+        with metrics.recording("preview") as run:
+            metrics.note("ingest", records_out=5)
+            worker = threading.Thread(target=metrics.in_run(lambda: metrics.note("ingest", bytes_read=3)))
+            worker.start()
+            worker.join()
+            run.exit_code = 0
+        done.set()
+        t.join()
+        self.assertIsNot(run, seen["job"])
+        self.assertEqual(seen["job"].stages, {})
+        self.assertEqual((run.stages["ingest"]["records_out"], run.stages["ingest"]["bytes_read"]), (5, 3))
+        metrics.reset()
+
+    def test_single_flight(self):
+        release, started = threading.Event(), threading.Event()
+
+        def blocked_run(**kwargs):
+            started.set()
+            release.wait(5)
+            return 0
+
+        with mock.patch.object(pipeline, "run", side_effect=blocked_run):
+            first, _ = jobs.submit("full_pipeline")
+            self.assertTrue(started.wait(5))
+            self.assertTrue(jobs.is_locked())
+            second, created = jobs.submit("full_pipeline")
+            self.assertFalse(created)
+            self.assertEqual(second["id"], first["id"])
+            tool_job, _ = jobs.submit("analyze")
+            time.sleep(0.05)
+            self.assertEqual(jobs.get_job(tool_job["id"])["status"], "queued")
+            release.set()
+            self.assertEqual(self.wait(first["id"])["status"], "succeeded")
+        self.assertEqual(self.wait(tool_job["id"])["status"], "failed")  # nothing cleaned yet: analyze exits 1
+        self.assertFalse(jobs.is_locked())
+
+
+class FeedServer:
+    """
+    Local keep-alive HTTP server for URL-source tests. routes: path (with or without the query) -> (body bytes,
+    delay seconds); etags: path -> ETag.
+    """
+
+    def __init__(self, routes: dict, etags: dict | None = None):
+        self.routes = routes
+        self.etags = etags or {}
+        self.encodings = {}  # path -> "gzip" | "deflate", applied when the client accepts it
+        self.links = {}  # path -> Link header
+        self.post_statuses = {}  # path -> statuses answered to successive POSTs, 200 once used up
+        self.posts = []
+        self.connections = set()
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.connections.add(self.client_address)
+                server.requests.append((self.path, dict(self.headers)))
+                route = server.routes.get(self.path) or server.routes.get(self.path.split("?")[0])
+                if route is None:
+                    self.send_error(404)
+                    return
+                body, delay = route
+                time.sleep(delay)
+                etag = server.etags.get(self.path)
+                if etag and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                encoding = server.encodings.get(self.path)
+                if encoding and encoding in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body) if encoding == "gzip" else zlib.compress(body)
+                self.send_response(200)
+                if etag:
+                    self.send_header("ETag", etag)
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                if self.path in server.links:
+                    self.send_header("Link", server.links[self.path])
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                server.connections.add(self.client_address)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.posts.append((self.path, dict(self.headers), body))
+                route = server.routes.get(self.path)
+                if route:
+                    time.sleep(route[1])
+                statuses = server.post_statuses.get(self.path)
+                self.send_response(statuses.pop(0) if statuses else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestMultiSourceIngest(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        feed = lambda start, n: json.dumps({"records": [_raw_record(i) for i in range(start, start + n)]}).encode()
+        self.server = FeedServer({"/a": (feed(0, 30), 0.3), "/b": (feed(30, 20), 0.3), "/c": (feed(50, 10), 0.3), "/slow": (feed(0, 1), 2)})
+        self.pool = http_pool.HostPool()
+        self.pool_patch = mock.patch.object(http_pool, "_default", self.pool)
+        self.pool_patch.start()
+        os.environ.update({"DATA_SOURCE_PATH": "", "INGEST_FETCH_CONCURRENCY": "3"})
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        self.pool.close()
+        self.server.close()
+        super().tearDown()
+
+    def test_concurrent_merge_in_order(self):
+        os.environ["DATA_SOURCE_URLS"] = ",".join(self.server.url(p) for p in ("/a", "/b", "/c"))
+        started = time.monotonic()
+        raw = ingest_data.read_raw()
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual([r["id"] for r in raw["records"]], [f"r{i}" for i in range(60)])
+        self.assertEqual([s["url"] for s in raw["metadata"]["sources"]], os.environ["DATA_SOURCE_URLS"].split(","))
+        self.assertIsNotNone(ingest_data.read_raw())
+        self.assertEqual(self.pool.opened, 3)  # second run reuses the keep-alive connections
+
+    def test_per_source_timeout(self):
+        os.environ.update({"DATA_SOURCE_URLS": f"{self.server.url('/a')} {self.server.url('/slow')}", "INGEST_SOURCE_TIMEOUT_SEC": "0.6"})
+        started = time.monotonic()
+        self.assertIsNone(ingest_data.read_raw())
+        os.environ["DATA_SOURCE_SKIP_FAILED"] = "1"
+        raw = ingest_data.read_raw()
+        self.assertLess(time.monotonic() - started, 1.8)
+        self.assertEqual(len(list(raw["records"])), 30)
+        self.assertEqual([f["url"] for f in raw["metadata"]["failed_sources"]], [self.server.url("/slow")])
+
+    def test_compressed_feeds_stream_through_file_readers(self):
+        ndjson = "".join(json.dumps(_raw_record(i)) + "\n" for i in range(500)).encode()
+        self.server.routes.update({"/gz": (ndjson, 0), "/deflate": (ndjson, 0)})
+        self.server.encodings.update({"/gz": "gzip", "/deflate": "deflate"})
+        os.environ.update({"DATA_SOURCE_URLS": f"{self.server.url('/gz')},{self.server.url('/deflate')}", "DATA_SOURCE_FORMAT": "ndjson"})
+        raw = ingest_data.read_raw()
+        self.assertEqual([r["id"] for r in raw["records"]], [f"r{i}" for i in range(500)] * 2)
+        entry = http_cache.load_entry(self.server.url("/gz"))
+        self.assertEqual((entry["content_encoding"], entry["size"]), ("gzip", len(ndjson)))
+        self.assertLess(entry["wire_bytes"], entry["size"])
+        self.assertEqual(Path(entry["path"]).read_bytes(), ndjson)
+
+    def test_conditional_get_skips_unchanged_feed(self):
+        self.server.etags["/a"] = '"v1"'
+        os.environ["DATA_SOURCE_URL"] = self.server.url("/a")
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        self.assertEqual(len(self.server.requests), 1)
+        with mock.patch.object(ingest_data, "open_records_file") as parse:
+            self.assertEqual(pipeline.run(checkpoint=True), 0)
+        parse.assert_not_called()
+        self.assertEqual(self.server.requests[-1][1].get("If-None-Match"), '"v1"')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(list(ingest_data.read_raw()["records"])), 30)  # 304 again: parsed from the cached body
+        self.server.routes["/a"] = (json.dumps([_raw_record(1)]).encode(), 0)
+        self.server.etags["/a"] = '"v2"'
+        self.assertEqual(pipeline.run(checkpoint=True), 0)
+        self.assertEqual(self.read_json("analytics_result.json")["totals"]["visits"], 1)
+
+
+
+class TestWebhookDelivery(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FeedServer({})
+        self.pool = http_pool.HostPool()
+        self.pool_patch = mock.patch.object(send_payload, "_pool", self.pool)
+        self.pool_patch.start()
+        os.environ.update({"DELIVERY_BACKOFF_SEC": "0.01", "DELIVERY_RETRIES": "3", "DELIVERY_TIMEOUT_SEC": "2"})
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        self.pool.close()
+        self.server.close()
+        super().tearDown()
+
+    def posted(self, path: str) -> int:
+        return sum(1 for p, _, _ in self.server.posts if p == path)
+
+    def test_retries_per_target_and_redelivers_only_failures(self):
+        source = self.tmp / "feed.csv"
+        _write_csv(source, 50)
+        os.environ.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": "csv",
+                           "DELIVERY_WEBHOOK_URLS": ",".join(self.server.url(p) for p in ("/ok", "/flaky", "/bad"))})
+        self.server.post_statuses.update({"/flaky": [503, 502], "/bad": [400]})
+        self.assertEqual(pipeline.run(checkpoint=True), 1)
+        self.assertEqual([self.posted(p) for p in ("/ok", "/flaky", "/bad")], [1, 3, 1])  # 4xx is not retried
+        self.assertEqual(self.pool.opened, 3)  # retries reuse the keep-alive connection
+        targets = send_payload.load_state()["targets"]
+        self.assertEqual({u.rsplit("/", 1)[1]: t["status"] for u, t in targets.items()}, {"ok": "delivered", "flaky": "delivered", "bad": "failed"})
+        self.assertEqual(targets[self.server.url("/bad")]["http_status"], 400)
+        body = self.server.posts[0][2]
+        self.assertEqual(self.server.posts[0][1]["X-Delivery-Id"], hashlib.sha256(body).hexdigest())
+
+        with mock.patch.object(ingest_data, "read_raw") as read_raw, mock.patch.object(generate_report, "build_report") as build:
+            self.assertEqual(pipeline.run(checkpoint=True), 0)
+        read_raw.assert_not_called()
+        build.assert_not_called()
+        self.assertEqual([self.posted(p) for p in ("/ok", "/flaky", "/bad")], [1, 3, 2])
+        self.assertEqual(self.server.posts[-1][2], body)
+        self.assertEqual(send_payload.send_payload(), 0)  # everything delivered: nothing is posted again
+        self.assertEqual(len(self.server.posts), 6)
+
+    def test_slow_target_does_not_hold_up_the_others(self):
+        self.server.routes.update({"/a": (b"", 0.4), "/b": (b"", 0.4), "/slow": (b"", 3)})
+        os.environ.update({"DELIVERY_WEBHOOK_URLS": " ".join(self.server.url(p) for p in ("/a", "/b", "/slow")),
+                           "DELIVERY_TIMEOUT_SEC": "1", "DELIVERY_RETRIES": "0"})
+        started = time.monotonic()
+        self.assertEqual(send_payload.deliver({"title": "T"}), 1)
+        self.assertLess(time.monotonic() - started, 2)
+        targets = send_payload.load_state()["targets"]
+        self.assertEqual([t["status"] for t in targets.values()], ["delivered", "delivered", "failed"])
+        self.assertEqual(targets[self.server.url("/slow")]["attempts"], 1)
+        self.assertTrue((self.tmp / "report_summary.txt").is_file())
+
+    def test_backoff_is_jittered_and_capped(self):
+        delays = [send_payload.backoff(a, 0.5, 3) for a in range(8) for _ in range(50)]
+        self.assertTrue(all(0 <= d <= 3 for d in delays))
+        self.assertGreater(len(set(delays)), 300)
+        self.assertLessEqual(max(send_payload.backoff(0, 0.5, 3) for _ in range(50)), 0.5)
+
+
+def _page(start: int, n: int, **extra) -> bytes:
+    return json.dumps({"records": [_raw_record(i) for i in range(start, start + n)], **extra}).encode()
+
+
+class TestPaginatedIngest(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FeedServer({})
+        self.pool = http_pool.HostPool()
+        self.pool_patch = mock.patch.object(http_pool, "_default", self.pool)
+        self.pool_patch.start()
+        os.environ.update({"DATA_SOURCE_PATH": "", "DATA_SOURCE_URLS": ""})
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        self.pool.close()
+        self.server.close()
+        super().tearDown()
+
+    def _ids(self, raw) -> list:
+        return [r["id"] for r in raw["records"]]
+
+    def test_next_links_from_body_and_link_header(self):
+        self.server.routes.update({
+            "/p1": (_page(0, 10, next="/p2"), 0),
+            "/p2": (_page(10, 10), 0),
+            "/p3": (json.dumps([_raw_record(i) for i in range(20, 25)]).encode(), 0),
+        })
+        self.server.links["/p2"] = f'<{self.server.url("/p3")}>; rel="next", <{self.server.url("/p1")}>; rel="first"'
+        os.environ.update({"DATA_SOURCE_URL": self.server.url("/p1"), "DATA_SOURCE_PAGINATION": "next"})
+        raw = ingest_data.read_raw()
+        self.assertEqual(raw["metadata"]["source_label"], "paginated")
+        self.assertEqual(self._ids(raw), [f"r{i}" for i in range(25)])
+
+    def test_cursor_with_nested_fields(self):
+        body = lambda start, after: json.dumps({"data": {"items": [_raw_record(i) for i in range(start, start + 5)]}, "paging": {"after": after}}).encode()
+        self.server.routes.update({"/c": (body(0, "x1"), 0), "/c?cursor=x1": (body(5, "x2"), 0), "/c?cursor=x2": (body(10, None), 0)})
+        os.environ.update({
+            "DATA_SOURCE_URL": self.server.url("/c"), "DATA_SOURCE_PAGINATION": "cursor",
+            "DATA_SOURCE_RECORDS_FIELD": "data.items", "DATA_SOURCE_NEXT_FIELD": "paging.after",
+        })
+        self.assertEqual(self._ids(ingest_data.read_raw()), [f"r{i}" for i in range(15)])
+
+    def test_numbered_pages_stop_at_empty_page_under_rate_cap(self):
+        for n in range(1, 4):
+            self.server.routes[f"/n?page={n}"] = (_page((n - 1) * 4, 4), 0)
+        self.server.routes["/n?page=4"] = (_page(0, 0), 0)  # pages past 4 are 404 and must not fail the ingest
+        os.environ.update({
+            "DATA_SOURCE_URL": self.server.url("/n"), "DATA_SOURCE_PAGINATION": "page",
+            "INGEST_PREFETCH_PAGES": "3", "INGEST_MAX_RPS": "20",
+        })
+        started = time.monotonic()
+        self.assertEqual(self._ids(ingest_data.read_raw()), [f"r{i}" for i in range(12)])
+        requested = len(self.server.requests)
+        self.assertGreaterEqual(requested, 4)
+        self.assertGreaterEqual(time.monotonic() - started, (requested - 1) / 20 - 0.01)
+
+    def test_prefetch_overlaps_fetching_with_consumption(self):
+        for n in range(1, 5):
+            self.server.routes[f"/s{n}"] = (_page((n - 1) * 3, 3, next=f"/s{n + 1}" if n < 4 else None), 0.2)
+        os.environ.update({"DATA_SOURCE_URL": self.server.url("/s1"), "DATA_SOURCE_PAGINATION": "next", "INGEST_BATCH_SIZE": "3"})
+        started = time.monotonic()
+        for i, _ in enumerate(ingest_data.read_raw()["records"]):
+            if i % 3 == 0:
+                time.sleep(0.2)  # a slow consumer, one page at a time
+        self.assertLess(time.monotonic() - started, 1.35)  # 1.6s if fetching and consuming alternated
+
+    def test_failures_first_page_and_mid_stream(self):
+        self.server.routes["/p1"] = (_page(0, 3, next="/gone"), 0)
+        os.environ.update({"DATA_SOURCE_URL": self.server.url("/missing"), "DATA_SOURCE_PAGINATION": "next"})
+        with redirect_stderr(io.StringIO()):
+            self.assertIsNone(ingest_data.read_raw())
+            os.environ["DATA_SOURCE_URL"] = self.server.url("/p1")
+            self.assertEqual(ingest_data.ingest(), 1)
+            self.assertEqual(pipeline.run(checkpoint=True), 1)
+
+class TestStreamingReader(PipelineTestCase):
+    def _read_all(self, path: Path, fmt: str, batch_size: int = 64) -> tuple[dict, list]:
+        os.environ["DATA_SOURCE_PATH"] = str(path)
+        os.environ["DATA_SOURCE_FORMAT"] = fmt
+        head, batches = ingest_data.read_batches(batch_size)
+        batches = list(batches)
+        self.assertTrue(all(len(b) <= batch_size for b in batches))
+        return head, [r for b in batches for r in b]
+
+    def test_formats_yield_same_records(self):
+        records = [_raw_record(i) for i in range(300)]
+        _write_ndjson(self.tmp / "src.ndjson", 300)
+        with open(self.tmp / "src.json", "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        with open(self.tmp / "obj.json", "w", encoding="utf-8") as f:
+            json.dump({"schema_version": "1.0", "records": records, "metadata": {"source_label": "export"}}, f, indent=2)
+        self.assertEqual(self._read_all(self.tmp / "src.ndjson", "ndjson")[1], records)
+        self.assertEqual(self._read_all(self.tmp / "src.json", "json")[1], records)
+        head, got = self._read_all(self.tmp / "obj.json", "json")
+        self.assertEqual(got, records)
+        self.assertEqual(head["metadata"], {"source_label": "export"})
+
+    def test_values_split_across_chunks(self):
+        text = json.dumps({"a": 1, "records": [{"v": 12345.5}, [1, "x,]"], True, 9876], "z": {"k": None}})
+        for size in (1, 2, 3, 7):
+            chunks = (text[i:i + size] for i in range(0, len(text), size))
+            header, records = open_records(chunks)
+            self.assertEqual(list(records), [{"v": 12345.5}, [1, "x,]"], True, 9876])
+            self.assertEqual(header, {"a": 1, "z": {"k": None}})
+
+    def _peak_while_reading(self, path: Path, fmt: str) -> int:
+        os.environ["DATA_SOURCE_PATH"] = str(path)
+        os.environ["DATA_SOURCE_FORMAT"] = fmt
+        tracemalloc.start()
+        try:
+            _, batches = ingest_data.read_batches(500)
+            for _ in batches:
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_memory_independent_of_file_size(self):
+        def write_json(path: Path, rows: int):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"records": [_raw_record(i) for i in range(rows)]}, f)
+
+        for fmt, writer in (("ndjson", _write_ndjson), ("csv", _write_csv), ("json", write_json)):
+            small, large = self.tmp / f"small.{fmt}", self.tmp / f"large.{fmt}"
+            writer(small, 2_000)
+            writer(large, 20_000)
+            peak_small = self._peak_while_reading(small, fmt)
+            peak_large = self._peak_while_reading(large, fmt)
+            self.assertLess(peak_large, peak_small * 1.5 + 256 * 1024, fmt)
+
+
+class TestParallelIngest(PipelineTestCase):
+    def _read(self, path: Path, fmt: str, workers: int) -> list:
+        os.environ.update({"DATA_SOURCE_PATH": str(path), "DATA_SOURCE_FORMAT": fmt, "INGEST_WORKERS": str(workers), "INGEST_RANGE_MB": "0.004"})
+        _, batches = ingest_data.read_batches(100)
+        return [r for b in batches for r in b]
+
+    def test_matches_single_process(self):
+        csv_path = self.tmp / "noid.csv"
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("Source,Visits,Revenue,Timestamp\n")
+            for i in range(3000):
+                f.write(f"src{i % 7},{i},{i * 0.5},2026-02-01T00:00:{i % 60:02d}Z\n")
+                if i % 500 == 0:
+                    f.write("\n")
+        ndjson_path = self.tmp / "src.ndjson"
+        _write_ndjson(ndjson_path, 3000)
+        for path, fmt in ((csv_path, "csv"), (ndjson_path, "ndjson")):
+            single = self._read(path, fmt, 1)
+            parallel = self._read(path, fmt, 3)
+            self.assertEqual(len(single), 3000)
+            self.assertEqual(parallel, single, fmt)
+            if fmt == "csv":
+                self.assertEqual([r["id"] for r in parallel], [str(i) for i in range(3000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,32 +1,116 @@
 """
 Compute deterministic aggregations over cleaned data.
-Input: .tmp/cleaned_data.json. Output: .tmp/analytics_result.json (Analytics Result schema).
+Input: .tmp/cleaned_data.col (memory-mapped columns) or .tmp/cleaned_data.json.
+Output: .tmp/analytics_result.json (Analytics Result schema, also added to .tmp/analytics_history.db by
+tools/history.py) and hour/day/week rollups by source in .tmp/analytics_rollup.db (tools/rollup.py).
+Aggregation is expressed as mergeable partial states (totals, per-source sums, timestamp min/max, plus a
+HyperLogLog of ids and a t-digest of revenue from tools/sketches.py), so shards, runs, or machines can be combined
+with merge_partials(); finalize() turns a partial into the result, folding all but the top sources into "other".
 Python only; no LLM.
 """
 
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from functools import reduce
 from pathlib import Path
-from collections import defaultdict
+
+# Allow running as a script (python tools/analyze.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import history, metrics
+from tools.columnar import iter_bytes, iter_strings, open_columns
+from tools.jsonstream import open_records_file
+from tools.rollup import RollupBuilder, write_rollups
+from tools.sketches import HyperLogLog, TDigest
+
+# Optional: NumPy backend for columnar aggregation. Falls back to the pure-Python loop if unavailable.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 INPUT_FILE = TMP_DIR / "cleaned_data.json"
+COLUMNS_FILE = TMP_DIR / "cleaned_data.col"
 OUTPUT_FILE = TMP_DIR / "analytics_result.json"
 SCHEMA_VERSION = "1.0"
+METRICS = ("visits", "conversions", "revenue")
+DEFAULT_TOP_SOURCES = 25
+PERCENTILES = (50, 90, 95, 99)
+_SUM_CHUNK = 1 << 20
 
 
-def analyze() -> int:
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
-    if not INPUT_FILE.is_file():
-        print("cleaned_data.json not found. Run clean_data first.", file=sys.stderr)
-        return 1
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    records = data.get("records", [])
-    totals = {"visits": 0.0, "conversions": 0.0, "revenue": 0.0}
-    by_source = defaultdict(lambda: {"visits": 0.0, "conversions": 0.0, "revenue": 0.0})
-    timestamps = []
+# — Partial aggregation state
+
+
+def empty_partial() -> dict:
+    """Identity element for merge_partials()."""
+    return {
+        "record_count": 0,
+        "totals": {m: 0.0 for m in METRICS},
+        "by_source": {},
+        "timestamp_min": None,
+        "timestamp_max": None,
+        "ids_hll": None,
+        "revenue_digest": None,
+    }
+
+
+def _merge_sketch(cls, a: dict | None, b: dict | None) -> dict | None:
+    if a is None or b is None:
+        return a if b is None else b
+    return cls.from_state(a).merge(cls.from_state(b)).to_state()
+
+
+def _merge_min(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+
+def _merge_max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+def merge_partials(a: dict, b: dict) -> dict:
+    """
+    Combine two partial states into a new one (inputs are not modified). Associative and commutative,
+    with empty_partial() as identity; float sums are exact for integer-valued metrics and otherwise equal
+    up to rounding order.
+    """
+    by_source = {k: dict(v) for k, v in a["by_source"].items()}
+    for src, sums in b["by_source"].items():
+        acc = by_source.get(src)
+        if acc is None:
+            by_source[src] = dict(sums)
+        else:
+            for m in METRICS:
+                acc[m] += sums[m]
+    return {
+        "record_count": a["record_count"] + b["record_count"],
+        "totals": {m: a["totals"][m] + b["totals"][m] for m in METRICS},
+        "by_source": by_source,
+        "timestamp_min": _merge_min(a["timestamp_min"], b["timestamp_min"]),
+        "timestamp_max": _merge_max(a["timestamp_max"], b["timestamp_max"]),
+        "ids_hll": _merge_sketch(HyperLogLog, a.get("ids_hll"), b.get("ids_hll")),
+        "revenue_digest": _merge_sketch(TDigest, a.get("revenue_digest"), b.get("revenue_digest")),
+    }
+
+
+def merge_all(partials) -> dict:
+    return reduce(merge_partials, partials, empty_partial())
+
+
+def partial_from_records(records) -> dict:
+    """Single pass over an iterable of cleaned records; memory grows with the number of sources, not records."""
+    totals = {m: 0.0 for m in METRICS}
+    by_source = {}
+    period_start = period_end = None
+    ids, revenue = HyperLogLog(), TDigest()
+    n = 0
     for r in records:
         v = float(r.get("visits", 0) or 0)
         c = float(r.get("conversions", 0) or 0)
@@ -35,27 +119,256 @@ def analyze() -> int:
         totals["visits"] += v
         totals["conversions"] += c
         totals["revenue"] += rev
-        by_source[src]["visits"] += v
-        by_source[src]["conversions"] += c
-        by_source[src]["revenue"] += rev
+        acc = by_source.get(src)
+        if acc is None:
+            acc = by_source[src] = {m: 0.0 for m in METRICS}
+        acc["visits"] += v
+        acc["conversions"] += c
+        acc["revenue"] += rev
         ts = r.get("timestamp")
         if ts:
-            timestamps.append(ts)
-    period_start = min(timestamps) if timestamps else datetime.now(timezone.utc).isoformat()
-    period_end = max(timestamps) if timestamps else datetime.now(timezone.utc).isoformat()
-    by_source_list = [{"source": k, "visits": v["visits"], "conversions": v["conversions"], "revenue": v["revenue"]} for k, v in sorted(by_source.items())]
+            if period_start is None or ts < period_start:
+                period_start = ts
+            if period_end is None or ts > period_end:
+                period_end = ts
+        rid = r.get("id")
+        if rid is not None and rid != "":
+            ids.add(str(rid).encode("utf-8"))
+        revenue.add(rev)
+        n += 1
+    return {
+        "record_count": n, "totals": totals, "by_source": by_source, "timestamp_min": period_start, "timestamp_max": period_end,
+        "ids_hll": ids.to_state() if n else None, "revenue_digest": revenue.to_state() if n else None,
+    }
+
+
+def partial_from_columns(cols: dict, start: int = 0, stop: int | None = None, backend: str | None = None, bounds: bool = True) -> dict:
+    """
+    Partial state for rows [start, stop) of memory-mapped columns (tools.columnar.open_columns).
+    backend: "numpy", "python", or None for ANALYZE_BACKEND (default "auto": numpy when installed).
+    Both backends add values in record order. bounds=False skips the timestamp min/max.
+    """
+    n = cols["record_count"]
+    stop = n if stop is None else min(stop, n)
+    backend = (backend or os.environ.get("ANALYZE_BACKEND", "auto") or "auto").strip().lower()
+    names, group_of_code = _source_groups(cols["sources"])
+    if NUMPY_AVAILABLE and backend != "python":
+        totals, sums, counts = _sum_numpy(cols, start, stop, group_of_code, len(names))
+    else:
+        totals, sums, counts = _sum_python(cols, start, stop, group_of_code, len(names))
+    by_source = {name: {m: sums[m][g] for m in METRICS} for g, name in enumerate(names) if counts[g]}
+    ts_min = ts_max = None
+    if bounds:
+        ts_min, ts_max = _timestamp_bounds(cols, start, stop)
+    ids, revenue = _sketch_columns(cols, start, stop)
+    return {
+        "record_count": max(0, stop - start), "totals": totals, "by_source": by_source, "timestamp_min": ts_min, "timestamp_max": ts_max,
+        "ids_hll": ids, "revenue_digest": revenue,
+    }
+
+
+def _sketch_columns(cols: dict, start: int, stop: int) -> tuple:
+    """(ids HyperLogLog, revenue t-digest) states for rows [start, stop); (None, None) for an empty range."""
+    if stop <= start:
+        return None, None
+    ids, revenue = HyperLogLog(), TDigest()
+    if NUMPY_AVAILABLE:
+        offsets, data = cols["id"]
+        offs = np.frombuffer(offsets, dtype=np.uint64)[start:stop + 1].astype(np.int64)
+        ids.update_packed(offs - offs[0], np.frombuffer(data, dtype=np.uint8)[offs[0]:offs[-1]])
+        revenue.update(np.frombuffer(cols["revenue"], dtype=np.float64)[start:stop])
+    else:
+        ids.update(v for v in iter_bytes(cols, "id", start, stop) if len(v))
+        for i in range(start, stop, _SUM_CHUNK):
+            revenue.update(cols["revenue"][i:min(i + _SUM_CHUNK, stop)].tolist())
+    return ids.to_state(), revenue.to_state()
+
+
+def _source_groups(sources: list) -> tuple[list, list]:
+    """Normalize dictionary sources once. Returns (group names, group index per source code)."""
+    names, index, group_of_code = [], {}, []
+    for s in sources:
+        name = str(s or "").strip() or "unknown"
+        if name not in index:
+            index[name] = len(names)
+            names.append(name)
+        group_of_code.append(index[name])
+    return names, group_of_code
+
+
+def _sum_python(cols: dict, start: int, stop: int, group_of_code: list, n_groups: int) -> tuple:
+    codes = cols["source"][start:stop]
+    counts = [0] * n_groups
+    for code in codes:
+        counts[group_of_code[code]] += 1
+    totals = {}
+    sums = {m: [0.0] * n_groups for m in METRICS}
+    for m in METRICS:
+        total, acc = 0.0, sums[m]
+        for code, x in zip(codes, cols[m][start:stop]):
+            total += x
+            acc[group_of_code[code]] += x
+        totals[m] = total
+    return totals, sums, counts
+
+
+def _sum_numpy(cols: dict, start: int, stop: int, group_of_code: list, n_groups: int) -> tuple:
+    codes = np.frombuffer(cols["source"], dtype=np.uint32)[start:stop]
+    if group_of_code != list(range(len(group_of_code))):
+        codes = np.asarray(group_of_code, dtype=np.intp)[codes]
+    counts = np.bincount(codes, minlength=n_groups).tolist()
+    totals, sums = {}, {}
+    for m in METRICS:
+        col = np.frombuffer(cols[m], dtype=np.float64)[start:stop]
+        # bincount and add.accumulate both add in index order (no pairwise summation), matching the row loop.
+        sums[m] = np.bincount(codes, weights=col, minlength=n_groups).tolist()
+        total = 0.0
+        for i in range(0, len(col), _SUM_CHUNK):
+            chunk = np.concatenate(([total], col[i:i + _SUM_CHUNK]))
+            total = float(np.add.accumulate(chunk)[-1])
+        totals[m] = total
+    return totals, sums, counts
+
+
+def _timestamp_bounds(cols: dict, start: int, stop: int) -> tuple:
+    """Min/max non-empty timestamp: from the file header stats for the whole file, else one bulk pass over the slice."""
+    stats = cols["header"].get("stats")
+    if stats is not None and start == 0 and stop == cols["record_count"]:
+        return stats.get("timestamp_min"), stats.get("timestamp_max")
+    stamps = [ts for ts in iter_strings(cols, "timestamp", start, stop) if ts]
+    return (min(stamps), max(stamps)) if stamps else (None, None)
+
+
+# — Sharded aggregation
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.environ.get("ANALYZE_WORKERS", "1") or "1"))
+    except ValueError:
+        return 1
+
+
+def _shard_partial(path: str, start: int, stop: int, backend: str | None, bounds: bool) -> dict:
+    """Worker: partial state for one row range of a columnar file."""
+    return partial_from_columns(open_columns(Path(path)), start, stop, backend=backend, bounds=bounds)
+
+
+def aggregate_sharded(path: Path, workers: int, shards: int | None = None, backend: str | None = None) -> dict:
+    """
+    Split a columnar file into row-range shards, compute their partial states in a process pool, and reduce.
+    Timestamp bounds come from the file header when present instead of being recomputed per shard.
+    Returns the merged partial state.
+    """
+    cols = open_columns(path)
+    n = cols["record_count"]
+    stats = cols["header"].get("stats")
+    shards = max(1, min(shards or workers, n or 1))
+    cuts = [n * i // shards for i in range(shards + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(
+            _shard_partial, [str(path)] * shards, cuts[:-1], cuts[1:], [backend] * shards, [stats is None] * shards,
+        ))
+    merged = merge_all(parts)
+    if stats is not None:
+        merged["timestamp_min"] = stats.get("timestamp_min")
+        merged["timestamp_max"] = stats.get("timestamp_max")
+    return merged
+
+
+# — Analytics Result
+
+
+def _top_sources() -> int:
+    try:
+        return max(1, int(os.environ.get("ANALYZE_TOP_SOURCES", DEFAULT_TOP_SOURCES) or DEFAULT_TOP_SOURCES))
+    except ValueError:
+        return DEFAULT_TOP_SOURCES
+
+
+def _top_by() -> str:
+    metric = (os.environ.get("ANALYZE_TOP_BY", "revenue") or "revenue").strip().lower()
+    return metric if metric in METRICS else "revenue"
+
+
+def top_sources(by_source: dict, k: int, metric: str = "revenue") -> list:
+    """
+    by_source rows for the Analytics Result: every source sorted by name when there are at most k; otherwise the
+    k largest by `metric` (ties by name), then one "other" row summing the rest with "folded_sources" = their count.
+    """
+    rows = [{"source": name, **{m: sums[m] for m in METRICS}} for name, sums in by_source.items()]
+    if len(rows) <= k:
+        return sorted(rows, key=lambda r: r["source"])
+    rows.sort(key=lambda r: (-r[metric], r["source"]))
+    top, rest = rows[:k], rows[k:]
+    other = {"source": "other", **{m: sum(r[m] for r in rest) for m in METRICS}, "folded_sources": len(rest)}
+    return top + [other]
+
+
+def finalize(partial: dict) -> dict:
+    """Turn a partial state into an Analytics Result dict (gemini.md 1.3)."""
+    totals = dict(partial["totals"])
+    period_start = partial["timestamp_min"] or datetime.now(timezone.utc).isoformat()
+    period_end = partial["timestamp_max"] or datetime.now(timezone.utc).isoformat()
+    by_source_list = top_sources(partial["by_source"], _top_sources(), _top_by())
     summary = f"Total visits: {totals['visits']:.0f}, conversions: {totals['conversions']:.0f}, revenue: ${totals['revenue']:.2f}"
-    out = {
+    ids = HyperLogLog.from_state(partial.get("ids_hll"))
+    revenue = TDigest.from_state(partial.get("revenue_digest"))
+    return {
         "schema_version": SCHEMA_VERSION,
         "computed_at": datetime.now(timezone.utc).isoformat(),
         "period_start": period_start,
         "period_end": period_end,
+        "record_count": partial["record_count"],
         "totals": totals,
         "by_source": by_source_list,
+        "source_count": len(partial["by_source"]),
+        "distinct_ids": ids.estimate(),
+        "distinct_ids_error": round(ids.error(), 4),
+        "revenue_percentiles": {f"p{q}": revenue.quantile(q / 100) for q in PERCENTILES},
         "summary": summary,
     }
+
+
+def aggregate(records) -> dict:
+    """Aggregate an iterable of cleaned records into an Analytics Result dict (single pass)."""
+    return finalize(partial_from_records(records))
+
+
+def aggregate_columns(cols: dict, backend: str | None = None) -> dict:
+    """Aggregate memory-mapped columns into an Analytics Result dict; identical to aggregate() over the same records."""
+    return finalize(partial_from_columns(cols, backend=backend))
+
+
+def write_result(out: dict) -> None:
+    """Write analytics_result.json and add the result to the history store (tools/history.py)."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
     with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
         json.dump(out, f, indent=2)
+    history.record(out)
+
+
+def analyze() -> int:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    rollups = RollupBuilder()
+    if COLUMNS_FILE.is_file():
+        workers = _workers()
+        metrics.note("analyze", bytes_read=COLUMNS_FILE.stat().st_size)
+        cols = open_columns(COLUMNS_FILE)
+        metrics.note("analyze", records_in=cols["record_count"], records_out=cols["record_count"])
+        if workers > 1:
+            write_result(finalize(aggregate_sharded(COLUMNS_FILE, workers)))
+        else:
+            write_result(aggregate_columns(cols))
+        rollups.add_columns(cols)
+    elif INPUT_FILE.is_file():
+        metrics.note("analyze", bytes_read=INPUT_FILE.stat().st_size)
+        _, records = open_records_file(INPUT_FILE)
+        write_result(aggregate(rollups.tee(metrics.counted(records, "analyze", "records_in", "records_out"))))
+    else:
+        print("cleaned_data not found. Run clean_data first.", file=sys.stderr)
+        return 1
+    write_rollups(rollups, replace=True)
     return 0
 
 
@@ -0,0 +1,329 @@
+"""
+Backfill a date range of the configured source into the history store, in parallel slices.
+The range [start, end) is cut into slices (day, week, month or N days, UTC). One pass over the source (ingest_data)
+partitions its records by timestamp into a scratch directory per slice under .tmp/backfill/<key>/; a process pool
+(BACKFILL_WORKERS) then cleans and aggregates each slice on its own into a partial state (tools/analyze.py).
+Each slice's result and the merged result for the whole range are stored in .tmp/analytics_history.db with
+kind "backfill". A slice is done once its slice.json says so: re-running the same backfill (same source, range,
+slicing and clean/analyze settings = same key) reruns only the slices that failed, without partitioning again.
+CLI: python tools/backfill.py START END [--slice month] [--workers N] [--retries N] [--fresh]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from pathlib import Path
+
+# Allow running as a script (python tools/backfill.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import analyze, clean_data, history, ingest_data, metrics, validation
+from tools.pipeline import hash_parts, tool_version
+from tools.rollup import to_utc, utc_bound
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+BACKFILL_DIR = TMP_DIR / "backfill"
+DEFAULT_SLICE = "month"
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 1
+MAX_SLICES = 1000
+_FLUSH_LINES = 50_000
+
+
+def _env_int(name: str, default: int, low: int) -> int:
+    try:
+        return max(low, int(os.environ.get(name, default) or default))
+    except ValueError:
+        return default
+
+
+def max_workers() -> int:
+    """Most slice processes a backfill may start: BACKFILL_WORKERS if set, else the CPU count."""
+    return _env_int("BACKFILL_WORKERS", os.cpu_count() or DEFAULT_WORKERS, 1)
+
+
+def parse_workers(value) -> int:
+    """An integer (or integer string) worker count, clamped to [1, max_workers()]. Raises ValueError."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("workers must be an integer")
+    try:
+        n = int(value)
+    except ValueError:
+        raise ValueError("workers must be an integer") from None
+    return max(1, min(n, max_workers()))
+
+
+# — Slices
+
+
+def make_slices(start: str, end: str, size: str = DEFAULT_SLICE) -> list:
+    """
+    [(slice_start, slice_end)] covering [start, end) as UTC "YYYY-MM-DDTHH:MM:SSZ" strings. `size` is "day",
+    "week", "month" (calendar months; the first and last may be partial) or "<N>d". Raises ValueError.
+    """
+    lo, hi = utc_bound(start), utc_bound(end)
+    if lo is None or hi is None or lo >= hi:
+        raise ValueError("backfill needs a start before its end")
+    step = None
+    if size in ("day", "week"):
+        step = timedelta(days=1 if size == "day" else 7)
+    elif size.endswith("d") and size[:-1].isdigit() and int(size[:-1]) > 0:
+        step = timedelta(days=int(size[:-1]))
+    elif size != "month":
+        raise ValueError("slice must be day, week, month or <N>d")
+    cur, stop = datetime.fromisoformat(lo), datetime.fromisoformat(hi)
+    slices = []
+    while cur < stop:
+        if step is not None:
+            nxt = cur + step
+        else:
+            nxt = datetime(cur.year + cur.month // 12, cur.month % 12 + 1, 1, tzinfo=timezone.utc)
+        nxt = min(nxt, stop)
+        slices.append((cur.strftime("%Y-%m-%dT%H:%M:%SZ"), nxt.strftime("%Y-%m-%dT%H:%M:%SZ")))
+        if len(slices) > MAX_SLICES:
+            raise ValueError(f"more than {MAX_SLICES} slices; use a larger slice")
+        cur = nxt
+    return slices
+
+
+def run_key(start: str, end: str, size: str) -> str:
+    """Directory name of a backfill: the source, range, slicing and the settings and code that shape a slice's result."""
+    path = (os.environ.get("DATA_SOURCE_PATH") or "").strip()
+    if path and Path(path).is_file():
+        st = Path(path).stat()
+        source = [path, st.st_size, st.st_mtime_ns]
+    else:
+        source = [path, ingest_data.source_urls()]
+    return hash_parts(
+        source, os.environ.get("DATA_SOURCE_FORMAT", "json"), utc_bound(start), utc_bound(end), size,
+        tool_version("clean"), tool_version("analyze"), clean_data.dedup_key(), validation.rule_settings(),
+    )[:16]
+
+
+def _write_json(path: Path, data: dict) -> None:
+    part = path.with_name(path.name + ".part")
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(part, path)
+
+
+def _read_json(path: Path) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# — Partition (one pass over the source)
+
+
+def partition(run_dir: Path, slices: list) -> dict | None:
+    """
+    Stream the source once and append each record to <run_dir>/<slice>/raw.ndjson by its timestamp. Records outside
+    the range or with an unparseable timestamp are counted, not written. Returns the partition summary
+    (also saved as partitioned.json), or None if the source cannot be read.
+    """
+    opened = ingest_data.read_batches()
+    if opened is None:
+        return None
+    _, batches = opened
+    starts, end = [s for s, _ in slices], slices[-1][1]
+    dirs = [run_dir / f"{i:04d}" for i in range(len(slices))]
+    for d in dirs:
+        d.mkdir(parents=True, exist_ok=True)
+        (d / "raw.ndjson.part").write_bytes(b"")
+    buffers = [[] for _ in slices]
+    counts = [0] * len(slices)
+    outside = unparsed = buffered = 0
+
+    def flush():
+        for d, lines in zip(dirs, buffers):
+            if lines:
+                with open(d / "raw.ndjson.part", "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+                lines.clear()
+
+    for batch in batches:
+        for r in batch:
+            ts = to_utc(str(r.get("timestamp") or ""))
+            if len(ts) != 20 or ts[-1] != "Z":
+                unparsed += 1
+                continue
+            if ts < starts[0] or ts >= end:
+                outside += 1
+                continue
+            i = bisect_right(starts, ts) - 1
+            buffers[i].append(json.dumps(r) + "\n")
+            counts[i] += 1
+            buffered += 1
+        if buffered >= _FLUSH_LINES:
+            flush()
+            buffered = 0
+    flush()
+    for d in dirs:
+        os.replace(d / "raw.ndjson.part", d / "raw.ndjson")
+    summary = {
+        "slices": [{"start": s, "end": e, "records": n} for (s, e), n in zip(slices, counts)],
+        "outside_range": outside,
+        "unparseable_timestamps": unparsed,
+    }
+    _write_json(run_dir / "partitioned.json", summary)
+    return summary
+
+
+# — Slices (process pool)
+
+
+def _run_slice(slice_dir: str) -> dict:
+    """Worker: clean and aggregate one slice's raw records into partial.json, then mark it done in slice.json."""
+    d = Path(slice_dir)
+    stats = {}
+    with open(d / "raw.ndjson", "r", encoding="utf-8") as f:
+        # The dedup spill stays in this slice's scratch directory.
+        partial = analyze.partial_from_records(clean_data.clean_records((json.loads(line) for line in f), stats, spill_dir=d))
+    _write_json(d / "partial.json", partial)
+    done = {
+        "status": "done",
+        "record_count": partial["record_count"],
+        "validation_errors_count": stats.get("validation_errors_count", 0),
+        "duplicates_dropped_count": stats.get("duplicates_dropped_count", 0),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _write_json(d / "slice.json", done)
+    return done
+
+
+def _is_done(d: Path) -> bool:
+    return (_read_json(d / "slice.json") or {}).get("status") == "done" and (d / "partial.json").is_file()
+
+
+def run_slices(run_dir: Path, slices: list, workers: int, retries: int, notify) -> list:
+    """
+    Run every slice that is not done yet, `workers` at a time, each in its own process. Slices that fail are
+    retried on their own up to `retries` more times. Returns the indexes of the slices that still failed.
+    """
+    pending = [i for i in range(len(slices)) if not _is_done(run_dir / f"{i:04d}")]
+    for i in range(len(slices)):
+        if i not in pending:
+            notify(f"slice {slices[i][0]}", "skipped")
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        failed = []
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            futures = {pool.submit(_run_slice, str(run_dir / f"{i:04d}")): i for i in pending}
+            for i in pending:
+                notify(f"slice {slices[i][0]}", "running")
+            for fut in as_completed(futures):
+                i = futures[fut]
+                label = f"slice {slices[i][0]}"
+                try:
+                    done = fut.result()
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    _write_json(run_dir / f"{i:04d}" / "slice.json", {"status": "failed", "error": error, "attempts": attempt + 1})
+                    notify(label, "failed", error=error)
+                    failed.append(i)
+                    continue
+                metrics.note("slices", records_out=done["record_count"])
+                notify(label, "done", records=done["record_count"])
+        pending = sorted(failed)
+    return pending
+
+
+# — Merge
+
+
+def merge(run_dir: Path, slices: list) -> dict:
+    """
+    Store each non-empty slice's result and the merged result for the whole range in the history store, with the
+    slice (or range) bounds as their period so a re-run replaces the same rows.
+    """
+    partials = []
+    for i, (s, e) in enumerate(slices):
+        partial = _read_json(run_dir / f"{i:04d}" / "partial.json")
+        if partial is None:
+            raise ValueError(f"slice {s} has no partial state")
+        partials.append(partial)
+        if partial["record_count"]:
+            history.record({**analyze.finalize(partial), "period_start": s, "period_end": e}, kind="backfill")
+    result = analyze.finalize(reduce(analyze.merge_partials, partials, analyze.empty_partial()))
+    result.update(period_start=slices[0][0], period_end=slices[-1][1])
+    history.record(result, kind="backfill")
+    _write_json(run_dir / "result.json", result)
+    return result
+
+
+def backfill(start: str, end: str, size: str | None = None, workers: int | None = None, retries: int | None = None,
+             fresh: bool = False, on_stage=None) -> int:
+    """
+    Backfill [start, end) in slices of `size` (BACKFILL_SLICE), `workers` processes (BACKFILL_WORKERS), retrying
+    a failed slice `retries` times (BACKFILL_RETRIES). fresh=True discards an earlier attempt's scratch directory.
+    on_stage(stage, status, **info) reports "ingest" (partitioning), "slice <start>" per slice and "merge".
+    Returns 0 when every slice merged into the history store, 1 otherwise (errors printed to stderr).
+    """
+    notify = on_stage or (lambda stage, status, **info: None)
+    size = size or (os.environ.get("BACKFILL_SLICE") or DEFAULT_SLICE).strip().lower()
+    retries = _env_int("BACKFILL_RETRIES", DEFAULT_RETRIES, 0) if retries is None else retries
+    try:
+        workers = _env_int("BACKFILL_WORKERS", DEFAULT_WORKERS, 1) if workers is None else parse_workers(workers)
+        slices = make_slices(start, end, size)
+    except ValueError as e:
+        print(f"Backfill: {e}", file=sys.stderr)
+        return 1
+    run_dir = BACKFILL_DIR / run_key(start, end, size)
+    if fresh and run_dir.exists():
+        shutil.rmtree(run_dir)
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    with metrics.recording("backfill") as rec:
+        rec.exit_code = 1
+        if (run_dir / "partitioned.json").is_file():
+            notify("ingest", "skipped")
+        else:
+            notify("ingest", "running")
+            with rec.measure("ingest"):
+                summary = partition(run_dir, slices)
+            if summary is None:
+                notify("ingest", "failed")
+                return 1
+            rec.add("ingest", records_out=sum(s["records"] for s in summary["slices"]))
+            notify("ingest", "done", records=sum(s["records"] for s in summary["slices"]))
+        with rec.measure("slices"):
+            failed = run_slices(run_dir, slices, workers, retries, notify)
+        if failed:
+            for i in failed:
+                error = (_read_json(run_dir / f"{i:04d}" / "slice.json") or {}).get("error")
+                print(f"Backfill slice {slices[i][0]} failed: {error}", file=sys.stderr)
+            print(f"{len(failed)} of {len(slices)} slices failed; run the same backfill again to retry them.", file=sys.stderr)
+            return 1
+        notify("merge", "running")
+        with rec.measure("merge"):
+            merge(run_dir, slices)
+        notify("merge", "done")
+        rec.exit_code = 0
+        return 0
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Backfill a date range into the analytics history in parallel slices.")
+    parser.add_argument("start", help="ISO-8601 start (inclusive)")
+    parser.add_argument("end", help="ISO-8601 end (exclusive)")
+    parser.add_argument("--slice", default=None, help="day, week, month or <N>d (default BACKFILL_SLICE or month)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default BACKFILL_WORKERS or 4)")
+    parser.add_argument("--retries", type=int, default=None, help="retries per failed slice (default BACKFILL_RETRIES or 1)")
+    parser.add_argument("--fresh", action="store_true", help="discard an earlier attempt and partition again")
+    args = parser.parse_args(argv)
+    return backfill(args.start, args.end, args.slice, args.workers, args.retries, args.fresh)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
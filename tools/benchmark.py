@@ -0,0 +1,328 @@
+"""
+Synthetic-data benchmarks for the pipeline tools.
+Generates deterministic raw inputs (gemini.md 1.1 schema) in CSV, JSON and NDJSON under .tmp/bench/inputs/,
+then for each format and size runs every stage tool (ingest, clean, analyze, report, deliver) on its own and the
+in-process pipeline end to end, each in a fresh subprocess working in .tmp/bench/run/. Reports records per second,
+peak RSS and bytes written per stage to stdout and .tmp/bench/result.json.
+--save-baseline stores the result as the baseline (.tmp/bench/baseline.json, or BENCH_BASELINE); otherwise the
+result is compared with it and the run fails if a stage got slower, or used more memory or disk, by more than
+BENCH_REGRESSION_PCT percent (default 20).
+Usage: python tools/benchmark.py [--records 10k,1m] [--formats csv,json,ndjson] [--stages ...] [--save-baseline]
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Optional: peak RSS via getrusage (Unix). Without it, peak_rss_bytes is reported as null and not compared.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Allow running as a script (python tools/benchmark.py).
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+BENCH_DIR = TMP_DIR / "bench"
+RESULT_FILE = BENCH_DIR / "result.json"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+SCHEMA_VERSION = "1.0"
+FORMATS = ("csv", "json", "ndjson")
+STAGES = ("ingest", "clean", "analyze", "report", "deliver", "pipeline")
+DEFAULT_RECORDS = 10_000
+DEFAULT_REGRESSION_PCT = 20.0
+GENERATOR_VERSION = 1  # bump when generate() output changes, so cached inputs are rebuilt
+_SOURCES = ("google", "facebook", "email", "direct", "referral", "tiktok", "linkedin", "newsletter", "partner", "affiliate")
+_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+_DUPLICATE_EVERY = 100  # every 100th record repeats an earlier id, so clean_data's de-duplication does real work
+# Process-wide settings a benchmark must not inherit from the caller's environment.
+_CLEARED_ENV = ("DATA_SOURCE_URL", "DATA_SOURCE_URLS", "DELIVERY_WEBHOOK_URL", "DELIVERY_WEBHOOK_URLS", "PIPELINE_INCREMENTAL", "PIPELINE_CHECKPOINT")
+
+
+def parse_count(text: str) -> int:
+    """Record count with an optional k/m suffix: "10k" → 10000, "10m" → 10000000."""
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _regression_pct() -> float:
+    try:
+        return max(0.0, float(os.environ.get("BENCH_REGRESSION_PCT", DEFAULT_REGRESSION_PCT) or DEFAULT_REGRESSION_PCT))
+    except ValueError:
+        return DEFAULT_REGRESSION_PCT
+
+
+def _baseline_path() -> Path:
+    value = (os.environ.get("BENCH_BASELINE") or "").strip()
+    return Path(value) if value else DEFAULT_BASELINE
+
+
+# — Synthetic input
+
+
+def synthetic_records(n: int, seed: int = 0):
+    """Yield n deterministic raw records; the same (n, seed) always gives the same records in every format."""
+    rng = random.Random(seed)
+    for i in range(n):
+        ident = i - rng.randrange(1, i + 1) if i and i % _DUPLICATE_EVERY == 0 else i
+        visits = rng.randrange(0, 500)
+        conversions = rng.randrange(0, visits // 10 + 1)
+        yield {
+            "id": f"r{ident}",
+            "timestamp": (_EPOCH + timedelta(seconds=i * 7 + rng.randrange(7))).isoformat(),
+            "source": _SOURCES[int(rng.paretovariate(1.2)) % len(_SOURCES)],
+            "metrics": {"visits": visits, "conversions": conversions, "revenue": round(conversions * rng.uniform(5, 120), 2)},
+            "meta": {},
+        }
+
+
+def generate(path: Path, fmt: str, n: int, seed: int = 0) -> Path:
+    """Write n synthetic records to `path` in `fmt` (csv, json or ndjson), streaming; writes via a .part file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(path.name + ".part")
+    with open(part, "w", encoding="utf-8", newline="") as f:
+        records = synthetic_records(n, seed)
+        if fmt == "csv":
+            w = csv.writer(f)
+            w.writerow(["id", "timestamp", "source", "visits", "conversions", "revenue"])
+            for r in records:
+                m = r["metrics"]
+                w.writerow([r["id"], r["timestamp"], r["source"], m["visits"], m["conversions"], m["revenue"]])
+        elif fmt == "ndjson":
+            for r in records:
+                f.write(json.dumps(r) + "\n")
+        else:
+            f.write('{"schema_version": "1.0", "records": [')
+            for i, r in enumerate(records):
+                f.write((",\n" if i else "\n") + json.dumps(r))
+            generated = {"generated_at": _EPOCH.isoformat(), "source_label": "benchmark"}
+            f.write(f'\n], "metadata": {json.dumps(generated)}}}\n')
+    os.replace(part, path)
+    return path
+
+
+def input_file(fmt: str, n: int, seed: int = 0) -> Path:
+    """Cached synthetic input for (fmt, n, seed), generated on first use."""
+    path = BENCH_DIR / "inputs" / f"v{GENERATOR_VERSION}-s{seed}-{n}.{fmt}"
+    return path if path.is_file() else generate(path, fmt, n, seed)
+
+
+# — Measurement (child process)
+
+
+def _point_tools_at(workdir: Path) -> None:
+    """Send every tool's .tmp paths to `workdir` so a benchmark never touches the real .tmp/ files."""
+    from tools import ingest_data, clean_data, analyze, generate_report, send_payload, pipeline, query, render, rollup, http_cache, history
+
+    targets = {
+        ingest_data: {"TMP_DIR": workdir, "OUTPUT_FILE": workdir / "raw_input.json"},
+        clean_data: {"TMP_DIR": workdir, "INPUT_FILE": workdir / "raw_input.json", "OUTPUT_FILE": workdir / "cleaned_data.json", "COLUMNS_FILE": workdir / "cleaned_data.col"},
+        analyze: {"TMP_DIR": workdir, "INPUT_FILE": workdir / "cleaned_data.json", "COLUMNS_FILE": workdir / "cleaned_data.col", "OUTPUT_FILE": workdir / "analytics_result.json"},
+        generate_report: {"TMP_DIR": workdir, "INPUT_FILE": workdir / "analytics_result.json", "OUTPUT_FILE": workdir / "report_output.json"},
+        send_payload: {"TMP_DIR": workdir, "INPUT_FILE": workdir / "report_output.json", "SUMMARY_FILE": workdir / "report_summary.txt", "STATE_FILE": workdir / "delivery_state.json"},
+        http_cache: {"TMP_DIR": workdir, "CACHE_DIR": workdir / "http_cache"},
+        render: {"TMP_DIR": workdir, "CACHE_DIR": workdir / "render_cache"},
+        rollup: {"TMP_DIR": workdir, "ROLLUP_DB": workdir / "analytics_rollup.db"},
+        history: {"TMP_DIR": workdir, "HISTORY_DB": workdir / "analytics_history.db"},
+        query: {"TMP_DIR": workdir, "COLUMNS_FILE": workdir / "cleaned_data.col", "INPUT_FILE": workdir / "cleaned_data.json",
+                "STORE_DB": workdir / "query_store.db", "BUILD_LOCK": workdir / "query_store.lock"},
+        pipeline: {"TMP_DIR": workdir, "STATE_FILE": workdir / "pipeline_state.json", "MANIFEST_DIR": workdir / "manifests"},
+    }
+    for module, attrs in targets.items():
+        for name, value in attrs.items():
+            setattr(module, name, value)
+
+
+def _stage_entry(stage: str):
+    from tools import ingest_data, clean_data, analyze, generate_report, send_payload, pipeline
+
+    return {
+        "ingest": ingest_data.ingest,
+        "clean": clean_data.clean,
+        "analyze": analyze.analyze,
+        "report": generate_report.generate_report,
+        "deliver": send_payload.send_payload,
+        "pipeline": lambda: pipeline.run(checkpoint=False, incremental=False),
+    }[stage]
+
+
+def _peak_rss_bytes() -> int | None:
+    """Peak RSS of this process or any of its worker processes (INGEST_WORKERS / ANALYZE_WORKERS pools)."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+def _child(stage: str, workdir: Path) -> int:
+    """Run one stage in this process and print {"code", "seconds", "peak_rss_bytes"} as the last stdout line."""
+    _point_tools_at(workdir)
+    entry = _stage_entry(stage)
+    start = time.perf_counter()
+    code = entry()
+    seconds = time.perf_counter() - start
+    print(json.dumps({"code": code, "seconds": seconds, "peak_rss_bytes": _peak_rss_bytes()}))
+    return code
+
+
+def _bytes_written_since(workdir: Path, start_ns: int) -> int:
+    return sum(p.stat().st_size for p in workdir.rglob("*") if p.is_file() and p.stat().st_mtime_ns >= start_ns)
+
+
+def run_stage(stage: str, workdir: Path, source: Path, fmt: str, records: int) -> dict:
+    """Run `stage` in a fresh interpreter against `source`; returns its measurements. Raises RuntimeError on failure."""
+    env = {k: v for k, v in os.environ.items() if k not in _CLEARED_ENV}
+    env.update({"DATA_SOURCE_PATH": str(source), "DATA_SOURCE_FORMAT": fmt})
+    start_ns = time.time_ns()
+    proc = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--child", stage, str(workdir)],
+        env=env, capture_output=True, text=True,
+    )
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"{stage} failed (exit {proc.returncode}): {proc.stderr.strip()[-500:]}")
+    measured = json.loads(lines[-1])
+    return {
+        "records": records,
+        "seconds": round(measured["seconds"], 4),
+        "records_per_sec": round(records / measured["seconds"], 1) if measured["seconds"] > 0 else None,
+        "peak_rss_bytes": measured["peak_rss_bytes"],
+        "bytes_written": _bytes_written_since(workdir, start_ns),
+    }
+
+
+def run_benchmarks(counts: list, formats: list, stages: list, seed: int = 0, on_result=None) -> dict:
+    """
+    Benchmark every (format, count) pair: the stage tools in pipeline order, each reading the previous one's
+    output, then "pipeline" from a clean work directory. Returns the result dict (see architecture/benchmarks.md).
+    on_result(key, measurement) is called as each stage finishes.
+    """
+    results = {}
+    workdir = BENCH_DIR / "run"
+    tools = [s for s in STAGES if s in stages and s != "pipeline"]
+    # A tool reads the previous tool's output, so every tool up to the last one requested has to run.
+    plan = list(STAGES[:STAGES.index(tools[-1]) + 1]) if tools else []
+    if "pipeline" in stages:
+        plan.append("pipeline")
+    for n in counts:
+        for fmt in formats:
+            source = input_file(fmt, n, seed)
+            for stage in plan:
+                if stage in ("ingest", "pipeline"):
+                    shutil.rmtree(workdir, ignore_errors=True)
+                workdir.mkdir(parents=True, exist_ok=True)
+                measured = run_stage(stage, workdir, source, fmt, n)
+                if stage in stages:
+                    key = f"{fmt}/{n}/{stage}"
+                    results[key] = measured
+                    if on_result:
+                        on_result(key, measured)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(), "seed": seed},
+        "results": results,
+    }
+
+
+# — Baseline comparison
+
+
+def compare(result: dict, baseline: dict, threshold_pct: float) -> list:
+    """
+    Regressions of `result` against `baseline` for keys present in both: records_per_sec lower, or peak_rss_bytes
+    or bytes_written higher, by more than threshold_pct percent. Returns messages (empty if none).
+    """
+    problems = []
+    limit = threshold_pct / 100
+    for key, cur in sorted(result["results"].items()):
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        if base.get("records_per_sec") and cur.get("records_per_sec") is not None:
+            drop = 1 - cur["records_per_sec"] / base["records_per_sec"]
+            if drop > limit:
+                problems.append(f"{key}: records/s {cur['records_per_sec']:.0f} vs {base['records_per_sec']:.0f} (-{drop:.0%})")
+        for metric in ("peak_rss_bytes", "bytes_written"):
+            if base.get(metric) and cur.get(metric) is not None and cur[metric] > base[metric] * (1 + limit):
+                problems.append(f"{key}: {metric} {cur[metric]} vs {base[metric]} (+{cur[metric] / base[metric] - 1:.0%})")
+    return problems
+
+
+def _print_row(key: str, m: dict) -> None:
+    rps = f"{m['records_per_sec']:>12,.0f}" if m["records_per_sec"] else f"{'-':>12}"
+    rss = f"{m['peak_rss_bytes'] / 2**20:>8.1f}" if m["peak_rss_bytes"] is not None else f"{'-':>8}"
+    print(f"{key:<28} {m['seconds']:>9.3f}s {rps} rec/s {rss} MiB RSS {m['bytes_written'] / 2**20:>9.2f} MiB written")
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline tools on synthetic data.")
+    parser.add_argument("--records", default=str(DEFAULT_RECORDS), help="comma-separated counts, k/m suffixes allowed (default 10000)")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma-separated: csv, json, ndjson")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated: " + ", ".join(STAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=None, help="regression threshold in percent (default BENCH_REGRESSION_PCT or 20)")
+    parser.add_argument("--baseline", default=None, help="baseline file (default BENCH_BASELINE or .tmp/bench/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return _child(args.child[0], Path(args.child[1]))
+
+    try:
+        counts = [parse_count(c) for c in args.records.split(",") if c.strip()]
+    except ValueError:
+        print(f"Invalid --records: {args.records}", file=sys.stderr)
+        return 1
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [f for f in formats if f not in FORMATS] + [s for s in stages if s not in STAGES]
+    if unknown or not counts or any(n < 1 for n in counts):
+        print(f"Invalid benchmark selection: {', '.join(unknown) or args.records}", file=sys.stderr)
+        return 1
+
+    try:
+        result = run_benchmarks(counts, formats, stages, seed=args.seed, on_result=_print_row)
+    except RuntimeError as e:
+        print(f"Benchmark failed: {e}", file=sys.stderr)
+        return 1
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    with open(RESULT_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    baseline_path = Path(args.baseline) if args.baseline else _baseline_path()
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(RESULT_FILE, baseline_path)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+    if not baseline_path.is_file():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one.")
+        return 0
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    threshold = _regression_pct() if args.threshold is None else args.threshold
+    problems = compare(result, baseline, threshold)
+    for p in problems:
+        print(f"Regression: {p}", file=sys.stderr)
+    if problems:
+        return 1
+    print(f"No regression beyond {threshold:g}% against {baseline_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
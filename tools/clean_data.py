@@ -1,25 +1,221 @@
 """
-Clean raw input: flatten metrics, drop invalid rows.
-Input: .tmp/raw_input.json. Output: .tmp/cleaned_data.json (Cleaned Data schema).
+Clean raw input: flatten metrics, drop rows that fail validation (tools/validation.py), drop duplicate records
+(same CLEAN_DEDUP_KEY, default id).
+Input: .tmp/raw_input.json. Output: .tmp/cleaned_data.col (columnar, see tools/columnar.py) and/or
+.tmp/cleaned_data.json (Cleaned Data schema), per CLEANED_DATA_FORMAT.
+Duplicates are found with a Bloom filter in front of an exact key store that spills to SQLite, so memory stays
+bounded at multi-million-record scale.
 Deterministic; atomic.
 """
 
-import json
+import math
+import os
+import sqlite3
+import struct
 import sys
+import uuid
+from array import array
 from datetime import datetime, timezone
+from hashlib import blake2b
+from itertools import islice
 from pathlib import Path
 
+# Allow running as a script (python tools/clean_data.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import metrics, query
+from tools.columnar import tee_columns
+from tools.jsonstream import open_records_file, tee_records
+from tools.validation import Validator
+
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 INPUT_FILE = TMP_DIR / "raw_input.json"
 OUTPUT_FILE = TMP_DIR / "cleaned_data.json"
+COLUMNS_FILE = TMP_DIR / "cleaned_data.col"
+OUTPUT_FORMATS = ("columnar", "json", "both")
 SCHEMA_VERSION = "1.0"
+DEDUP_FIELDS = ("id", "timestamp", "source", "visits", "conversions", "revenue")
+DEFAULT_DEDUP_CAPACITY = 10_000_000
+_SPILL_EVERY = 200_000
+_BATCH = 4096
+_key_row = struct.Struct(">qq").unpack  # digest → (hi, lo) SQLite integers; sorted digests insert near key order
+
+
+def dedup_key() -> tuple:
+    """
+    CLEAN_DEDUP_KEY: comma-separated cleaned-record fields that identify a record (default "id");
+    "none" turns de-duplication off. Unknown field names are ignored.
+    """
+    raw = (os.environ.get("CLEAN_DEDUP_KEY", "id") or "id").strip().lower()
+    if raw in ("none", "off", "0"):
+        return ()
+    return tuple(f for f in (p.strip() for p in raw.split(",")) if f in DEDUP_FIELDS)
 
 
-def _float(val, default=0.0):
+def _dedup_capacity() -> int:
     try:
-        return float(val) if val is not None else default
-    except (TypeError, ValueError):
-        return default
+        return max(1000, int(os.environ.get("CLEAN_DEDUP_CAPACITY", DEFAULT_DEDUP_CAPACITY) or DEFAULT_DEDUP_CAPACITY))
+    except ValueError:
+        return DEFAULT_DEDUP_CAPACITY
+
+
+class BloomFilter:
+    """
+    Blocked Bloom filter over 16-byte key digests: each key sets 6 bits inside one 64-bit word, so a lookup is a
+    single word read. About 10 bits per key of `capacity`, giving roughly 1% false positives at capacity.
+    """
+
+    def __init__(self, capacity: int):
+        self.words = 1 << max(6, math.ceil(math.log2(capacity * 10 / 64)))
+        self.array = array("Q", bytes(8 * self.words))
+
+    def add(self, digest: bytes) -> bool:
+        """Set the digest's bits; True if they were all set already (the key may have been added before)."""
+        h = int.from_bytes(digest, "little")
+        i = h & (self.words - 1)
+        h >>= 64
+        mask = (1 << (h & 63)) | (1 << (h >> 6 & 63)) | (1 << (h >> 12 & 63)) | (1 << (h >> 18 & 63)) | (1 << (h >> 24 & 63)) | (1 << (h >> 30 & 63))
+        word = self.array[i]
+        if word & mask == mask:
+            return True
+        self.array[i] = word | mask
+        return False
+
+
+class KeySet:
+    """
+    Exact set of key digests for one cleaning run. New keys are buffered in memory and spilled, sorted, to a
+    temporary SQLite table every _SPILL_EVERY keys; the Bloom filter answers most lookups, so only its hits
+    (repeats and false positives) are checked against the buffer and the table.
+    """
+
+    def __init__(self, capacity: int | None = None, spill_dir: Path | None = None):
+        self.bloom = BloomFilter(capacity or _dedup_capacity())
+        self.pending = set()
+        self.spill_dir = spill_dir
+        self.path = None
+        self._conn = None
+
+    def _spill(self) -> None:
+        if self._conn is None:
+            spill_dir = self.spill_dir or TMP_DIR
+            spill_dir.mkdir(parents=True, exist_ok=True)
+            self.path = spill_dir / f"dedup_keys.{uuid.uuid4().hex}.db"
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode = OFF")
+            self._conn.execute("PRAGMA synchronous = OFF")
+            self._conn.execute("CREATE TABLE keys (hi INTEGER, lo INTEGER, PRIMARY KEY (hi, lo)) WITHOUT ROWID")
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO keys (hi, lo) VALUES (?, ?)", map(_key_row, sorted(self.pending)))
+        self.pending.clear()
+
+    def add(self, digest: bytes) -> bool:
+        """Add the digest; True if it was already present."""
+        if self.bloom.add(digest):
+            if digest in self.pending:
+                return True
+            if self._conn is not None and self._conn.execute("SELECT 1 FROM keys WHERE hi = ? AND lo = ?", _key_row(digest)).fetchone():
+                return True
+        self.pending.add(digest)
+        if len(self.pending) >= _SPILL_EVERY:
+            self._spill()
+        return False
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self.path.unlink(missing_ok=True)
+        self.pending.clear()
+
+
+def dedup_records(cleaned, stats: dict, key: tuple | None = None, spill_dir: Path | None = None, capacity: int | None = None):
+    """
+    Yield cleaned records whose `key` fields (default dedup_key()) were not seen earlier in the stream; the first
+    occurrence wins. Records whose key fields are all empty are always kept. Drops are counted in
+    stats["duplicates_dropped_count"].
+    """
+    key = dedup_key() if key is None else key
+    stats.setdefault("duplicates_dropped_count", 0)
+    if not key:
+        yield from cleaned
+        return
+    seen = KeySet(capacity, spill_dir=spill_dir)
+    try:
+        single = key[0] if len(key) == 1 else None
+        for r in cleaned:
+            value = str(r[single]) if single else "\x1f".join(str(r[f]) for f in key)
+            if value.strip("\x1f"):
+                if seen.add(blake2b(value.encode("utf-8"), digest_size=16).digest()):
+                    stats["duplicates_dropped_count"] += 1
+                    continue
+            yield r
+    finally:
+        seen.close()
+
+
+def clean_records(records, stats: dict, spill_dir: Path | None = None, capacity: int | None = None):
+    """
+    Yield cleaned, validated, de-duplicated records from an iterable of raw records, validating batches of
+    _BATCH rows at a time (tools/validation.py).
+    Counts are kept in `stats`: record_count (yielded), validation_errors_count (rows rejected), rejections
+    ({field: {reason: count}}), rejected_samples, and duplicates_dropped_count (repeated CLEAN_DEDUP_KEY values).
+    The dedup spill goes to `spill_dir` (default .tmp); `capacity` sizes its Bloom filter (default CLEAN_DEDUP_CAPACITY).
+    """
+    stats.setdefault("record_count", 0)
+    validator = Validator()
+
+    def validated():
+        it = iter(records)
+        offset = 0
+        while batch := list(islice(it, _BATCH)):
+            yield from validator.clean_batch(batch, stats, offset)
+            offset += len(batch)
+
+    for r in dedup_records(validated(), stats, spill_dir=spill_dir, capacity=capacity):
+        stats["record_count"] += 1
+        yield r
+
+
+def cleaned_head() -> dict:
+    """Header fields of the Cleaned Data file that are known before any record is seen."""
+    return {"schema_version": SCHEMA_VERSION, "cleaned_at": datetime.now(timezone.utc).isoformat()}
+
+
+def cleaned_tail(stats: dict) -> dict:
+    """Trailing fields of the Cleaned Data file, filled once the record stream is exhausted."""
+    return {
+        "record_count": stats.get("record_count", 0),
+        "validation_errors_count": stats.get("validation_errors_count", 0),
+        "rejections": stats.get("rejections", {}),
+        "rejected_samples": stats.get("rejected_samples", []),
+        "duplicates_dropped_count": stats.get("duplicates_dropped_count", 0),
+    }
+
+
+def output_format() -> str:
+    fmt = (os.environ.get("CLEANED_DATA_FORMAT", "columnar") or "columnar").strip().lower()
+    return fmt if fmt in OUTPUT_FORMATS else "columnar"
+
+
+def tee_cleaned(cleaned, stats: dict, fmt: str | None = None):
+    """
+    Wrap a cleaned-record stream so it is written to cleaned_data.col and/or cleaned_data.json as it passes.
+    A file left over from a previous run in the other format is removed so readers never see stale data.
+    """
+    fmt = fmt or output_format()
+    head = cleaned_head()
+    tail = lambda: cleaned_tail(stats)
+    if fmt in ("json", "both"):
+        cleaned = tee_records(OUTPUT_FILE, head, cleaned, tail)
+    else:
+        OUTPUT_FILE.unlink(missing_ok=True)
+    if fmt in ("columnar", "both"):
+        cleaned = tee_columns(COLUMNS_FILE, head, cleaned, tail)
+    else:
+        COLUMNS_FILE.unlink(missing_ok=True)
+    return cleaned
 
 
 def clean() -> int:
@@ -27,34 +223,14 @@ def clean() -> int:
     if not INPUT_FILE.is_file():
         print("raw_input.json not found. Run ingest first.", file=sys.stderr)
         return 1
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-    records_in = raw.get("records", [])
-    records_out = []
-    validation_errors = 0
-    for r in records_in:
-        if not isinstance(r, dict):
-            validation_errors += 1
-            continue
-        metrics = r.get("metrics") if isinstance(r.get("metrics"), dict) else {}
-        rec = {
-            "id": str(r.get("id", "")),
-            "timestamp": str(r.get("timestamp", datetime.now(timezone.utc).isoformat())),
-            "source": str(r.get("source", "")),
-            "visits": _float(metrics.get("visits"), 0),
-            "conversions": _float(metrics.get("conversions"), 0),
-            "revenue": _float(metrics.get("revenue"), 0),
-        }
-        records_out.append(rec)
-    data = {
-        "schema_version": SCHEMA_VERSION,
-        "cleaned_at": datetime.now(timezone.utc).isoformat(),
-        "record_count": len(records_out),
-        "records": records_out,
-        "validation_errors_count": validation_errors,
-    }
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    metrics.note("clean", bytes_read=INPUT_FILE.stat().st_size)
+    _, records = open_records_file(INPUT_FILE)
+    stats = {}
+    for _ in tee_cleaned(clean_records(records, stats), stats):
+        pass
+    n_in = sum(stats.get(k, 0) for k in ("record_count", "validation_errors_count", "duplicates_dropped_count"))
+    metrics.note("clean", records_in=n_in, records_out=stats.get("record_count", 0))
+    query.refresh_in_background()
     return 0
 
 
@@ -0,0 +1,210 @@
+"""
+Columnar on-disk format for cleaned records (.tmp/cleaned_data.col).
+Layout: 8-byte magic, uint64 header length, JSON header, then 8-byte-aligned column blocks:
+visits/conversions/revenue as float64, source as uint32 codes into header["sources"],
+id/timestamp as uint64 offsets (record_count + 1) followed by UTF-8 bytes.
+Readers memory-map the file; numeric columns are memoryviews over the map (no copy, no per-row dicts).
+CLI: python tools/columnar.py [src.col] [dst.json] exports to the Cleaned Data JSON schema.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+
+# Allow running as a script (python tools/columnar.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.jsonstream import write_records
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+MAGIC = b"BLSTCOL1"
+NUMERIC = ("visits", "conversions", "revenue")
+STRINGS = ("id", "timestamp")
+# Column blocks in file order, with their array typecodes ("B" = raw UTF-8 bytes).
+BLOCKS = (
+    ("visits", "d"), ("conversions", "d"), ("revenue", "d"), ("source", "I"),
+    ("id.offsets", "Q"), ("id.data", "B"), ("timestamp.offsets", "Q"), ("timestamp.data", "B"),
+)
+_FLUSH_ROWS = 8192
+
+
+def _pad(n: int) -> int:
+    return -n % 8
+
+
+def tee_columns(path: Path, head: dict, records, tail=None):
+    """
+    Yield each cleaned record from `records` while writing them to `path` in columnar form.
+    Columns are spilled to a scratch directory during the stream and assembled at the end;
+    `tail` is a callable whose fields are merged into the header (e.g. record_count).
+    """
+    if sys.byteorder != "little":
+        raise RuntimeError("columnar format requires a little-endian host")
+    path = Path(path)
+    part = path.with_name(path.name + ".part")
+    done = False
+    spill = tempfile.TemporaryDirectory(dir=path.parent)
+    files = {name: open(Path(spill.name) / name, "wb") for name, _ in BLOCKS}
+    try:
+        codes = {}
+        n = 0
+        ts_min = ts_max = None
+        ends = {"id": 0, "timestamp": 0}
+        for name in STRINGS:
+            array("Q", [0]).tofile(files[f"{name}.offsets"])
+        buf = {name: array(code) for name, code in BLOCKS if code != "B"}
+        data = {name: bytearray() for name in STRINGS}
+        for rec in records:
+            for name in NUMERIC:
+                buf[name].append(rec[name])
+            src = rec["source"]
+            code = codes.get(src)
+            if code is None:
+                code = codes[src] = len(codes)
+            buf["source"].append(code)
+            ts = rec["timestamp"]
+            if ts:
+                if ts_min is None or ts < ts_min:
+                    ts_min = ts
+                if ts_max is None or ts > ts_max:
+                    ts_max = ts
+            for name in STRINGS:
+                raw = rec[name].encode("utf-8")
+                data[name] += raw
+                ends[name] += len(raw)
+                buf[f"{name}.offsets"].append(ends[name])
+            n += 1
+            if n % _FLUSH_ROWS == 0:
+                _flush(files, buf, data)
+            yield rec
+        _flush(files, buf, data)
+        for f in files.values():
+            f.close()
+
+        layout = {}
+        offset = 0
+        for name, code in BLOCKS:
+            size = os.path.getsize(files[name].name)
+            layout[name] = {"offset": offset, "length": size, "type": code}
+            offset += size + _pad(size)
+        header = {
+            **head,
+            **(tail() if tail else {}),
+            "record_count": n,
+            "sources": list(codes),
+            "stats": {"timestamp_min": ts_min, "timestamp_max": ts_max},
+            "columns": layout,
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+        with open(part, "wb") as out:
+            out.write(MAGIC)
+            out.write(struct.pack("<Q", len(header_bytes)))
+            out.write(header_bytes)
+            out.write(b"\0" * _pad(len(header_bytes)))
+            for name, _ in BLOCKS:
+                with open(files[name].name, "rb") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                out.write(b"\0" * _pad(layout[name]["length"]))
+        os.replace(part, path)
+        done = True
+    finally:
+        for f in files.values():
+            f.close()
+        spill.cleanup()
+        if not done:
+            part.unlink(missing_ok=True)
+
+
+def _flush(files: dict, buf: dict, data: dict) -> None:
+    for name, arr in buf.items():
+        arr.tofile(files[name])
+        del arr[:]
+    for name, raw in data.items():
+        files[f"{name}.data"].write(raw)
+        raw.clear()
+
+
+def write_columns(path: Path, head: dict, records, tail=None) -> int:
+    """Write a cleaned-record stream to `path` (see tee_columns). Returns the number of records written."""
+    n = 0
+    for _ in tee_columns(path, head, records, tail):
+        n += 1
+    return n
+
+
+def open_columns(path: Path) -> dict:
+    """
+    Memory-map a columnar file. Returns a dict with "header", "record_count", "sources", a memoryview per
+    numeric column ("visits", "conversions", "revenue" as float64; "source" as uint32 codes) and
+    (offsets, data) memoryview pairs for "id" and "timestamp". Views stay valid while the dict is referenced.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:8] != MAGIC:
+        raise ValueError(f"{path} is not a columnar cleaned_data file")
+    (header_len,) = struct.unpack("<Q", mm[8:16])
+    header = json.loads(mm[16:16 + header_len].decode("utf-8"))
+    data_start = 16 + header_len + _pad(header_len)
+    view = memoryview(mm)
+    blocks = {}
+    for name, spec in header["columns"].items():
+        start = data_start + spec["offset"]
+        blocks[name] = view[start:start + spec["length"]].cast(spec["type"])
+    cols = {"header": header, "record_count": header["record_count"], "sources": header["sources"]}
+    for name in NUMERIC + ("source",):
+        cols[name] = blocks[name]
+    for name in STRINGS:
+        cols[name] = (blocks[f"{name}.offsets"], blocks[f"{name}.data"])
+    return cols
+
+
+def iter_strings(cols: dict, name: str, start: int = 0, stop: int | None = None):
+    """Decode rows [start, stop) of a string column ("id" or "timestamp")."""
+    offsets, data = cols[name]
+    stop = cols["record_count"] if stop is None else stop
+    for i in range(start, stop):
+        yield str(data[offsets[i]:offsets[i + 1]], "utf-8")
+
+
+def iter_bytes(cols: dict, name: str, start: int = 0, stop: int | None = None):
+    """Rows [start, stop) of a string column as undecoded memoryview slices (for hashing)."""
+    offsets, data = cols[name]
+    stop = cols["record_count"] if stop is None else stop
+    for i in range(start, stop):
+        yield data[offsets[i]:offsets[i + 1]]
+
+
+def iter_records(cols: dict):
+    """Rebuild Cleaned Data record dicts, in file order (for JSON export and row-oriented readers)."""
+    sources = cols["sources"]
+    for rid, ts, code, v, c, r in zip(
+        iter_strings(cols, "id"), iter_strings(cols, "timestamp"),
+        cols["source"], cols["visits"], cols["conversions"], cols["revenue"],
+    ):
+        yield {"id": rid, "timestamp": ts, "source": sources[code], "visits": v, "conversions": c, "revenue": r}
+
+
+def export_json(src: Path, dst: Path) -> int:
+    """Export a columnar file to the Cleaned Data JSON schema (gemini.md 1.2). Returns the record count."""
+    cols = open_columns(src)
+    header = cols["header"]
+    head = {k: header[k] for k in ("schema_version", "cleaned_at") if k in header}
+    tail = {k: header[k] for k in header if k not in head and k not in ("sources", "stats", "columns")}
+    return write_records(dst, head, iter_records(cols), lambda: tail)
+
+
+if __name__ == "__main__":
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else TMP_DIR / "cleaned_data.col"
+    dst = Path(sys.argv[2]) if len(sys.argv) > 2 else TMP_DIR / "cleaned_data.json"
+    if not src.is_file():
+        print(f"{src.name} not found. Run clean_data first.", file=sys.stderr)
+        sys.exit(1)
+    export_json(src, dst)
+    sys.exit(0)
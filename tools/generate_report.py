@@ -1,6 +1,7 @@
 """
 Generate marketing-ready report from analytics result.
-Input: .tmp/analytics_result.json. Output: .tmp/report_output.json (Report Payload schema).
+Input: .tmp/analytics_result.json. Output: .tmp/report_output.json (Report Payload schema), plus the
+REPORT_FORMATS renderings (.tmp/report_output.csv/.html/.md) from tools/render.py's cache.
 Narrative from template; no LLM calculations.
 """
 
@@ -9,19 +10,20 @@ import sys
 from datetime import datetime, timezone
 from pathlib import Path
 
+# Allow running as a script (python tools/generate_report.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import metrics, render
+
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 INPUT_FILE = TMP_DIR / "analytics_result.json"
 OUTPUT_FILE = TMP_DIR / "report_output.json"
 SCHEMA_VERSION = "1.0"
 
 
-def generate_report(title: str = "", period: str = "") -> int:
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
-    if not INPUT_FILE.is_file():
-        print("analytics_result.json not found. Run analyze first.", file=sys.stderr)
-        return 1
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+def build_report(data: dict, title: str = "", period: str = "") -> dict:
+    """Build the Report Payload dict from an Analytics Result dict."""
     totals = data.get("totals", {})
     by_source = data.get("by_source", [])
     summary = data.get("summary", "")
@@ -32,6 +34,9 @@ def generate_report(title: str = "", period: str = "") -> int:
     if not period:
         period = f"{period_start} to {period_end}" if period_start and period_end else datetime.now(timezone.utc).strftime("%Y-%m-%d")
     narrative = summary or f"Visits: {totals.get('visits', 0):.0f}, Conversions: {totals.get('conversions', 0):.0f}, Revenue: ${totals.get('revenue', 0):.2f}."
+    named = [s for s in by_source if "folded_sources" not in s]
+    if named and len(named) < len(by_source):
+        narrative += f" Top source: {named[0]['source']} (of {data.get('source_count', len(by_source))})."
     out = {
         "schema_version": SCHEMA_VERSION,
         "generated_at": datetime.now(timezone.utc).isoformat(),
@@ -42,8 +47,29 @@ def generate_report(title: str = "", period: str = "") -> int:
         "narrative": narrative,
         "format": "json",
     }
+    for key in ("distinct_ids", "revenue_percentiles"):
+        if key in data:
+            out[key] = data[key]
+    return out
+
+
+def write_report(out: dict) -> None:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
     with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
         json.dump(out, f, indent=2)
+
+
+def generate_report(title: str = "", period: str = "") -> int:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    if not INPUT_FILE.is_file():
+        print("analytics_result.json not found. Run analyze first.", file=sys.stderr)
+        return 1
+    metrics.note("report", bytes_read=INPUT_FILE.stat().st_size)
+    with open(INPUT_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    report = build_report(data, title=title, period=period)
+    write_report(report)
+    render.render_all(data, report)
     return 0
 
 
@@ -11,7 +11,7 @@ from urllib.error import HTTPError, URLError
 
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 REQUIRED_FOR_PIPELINE = []  # None required for minimal run; DATA_SOURCE_PATH or DATA_SOURCE_URL recommended
-OPTIONAL = ["GEMINI_API_KEY", "DATA_SOURCE_PATH", "DATA_SOURCE_URL", "DELIVERY_WEBHOOK_URL"]
+OPTIONAL = ["GEMINI_API_KEY", "DATA_SOURCE_PATH", "DATA_SOURCE_URL", "DATA_SOURCE_URLS", "DELIVERY_WEBHOOK_URL", "DELIVERY_WEBHOOK_URLS"]
 
 
 def health_check() -> int:
@@ -21,18 +21,19 @@ def health_check() -> int:
         if not (os.environ.get(key) or "").strip():
             errors.append(f"Missing required env: {key}")
     path = (os.environ.get("DATA_SOURCE_PATH") or "").strip()
-    url = (os.environ.get("DATA_SOURCE_URL") or "").strip()
-    if not path and not url:
+    urls = (os.environ.get("DATA_SOURCE_URLS") or "").replace(",", " ").split() or [(os.environ.get("DATA_SOURCE_URL") or "").strip()]
+    urls = [u for u in urls if u]
+    if not path and not urls:
         pass  # Allow demo mode with no source
     if path and not Path(path).is_file():
         errors.append(f"DATA_SOURCE_PATH file not found: {path}")
-    if url:
+    for url in urls:
         try:
             req = Request(url, headers={"User-Agent": "BLAST-Analytics-Health/1.0"})
             with urlopen(req, timeout=5) as _:
                 pass
         except (HTTPError, URLError) as e:
-            errors.append(f"DATA_SOURCE_URL unreachable: {e}")
+            errors.append(f"{'DATA_SOURCE_URL' if len(urls) == 1 else url} unreachable: {e}")
     if errors:
         for e in errors:
             print(e, file=sys.stderr)
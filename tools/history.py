@@ -0,0 +1,200 @@
+"""
+History of Analytics Results: every result analyze writes is also stored in .tmp/analytics_history.db (SQLite),
+one row per kind and period (kind "run" for analyze, "backfill" for tools/backfill.py; a re-run over the same period
+replaces its row), with the totals as columns and the whole result as JSON. Queried by /api/analytics/history
+(range + period-over-period comparison). latest() keeps the newest run result in memory and reloads it only when the
+database file changes.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+# Allow running as a script (python tools/history.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.rollup import utc_bound
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+HISTORY_DB = TMP_DIR / "analytics_history.db"
+METRICS = ("visits", "conversions", "revenue")
+COMPARED = ("record_count", *METRICS, "distinct_ids")
+KINDS = ("run", "backfill")
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+_latest = {"key": None, "result": None}
+_latest_lock = threading.Lock()
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or HISTORY_DB)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL DEFAULT 'run',
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            computed_at TEXT NOT NULL,
+            record_count INTEGER,
+            visits REAL NOT NULL,
+            conversions REAL NOT NULL,
+            revenue REAL NOT NULL,
+            distinct_ids INTEGER,
+            source_count INTEGER,
+            result TEXT NOT NULL,
+            UNIQUE (kind, period_start, period_end)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_end ON results (period_end, period_start)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_computed ON results (kind, computed_at)")
+    return conn
+
+
+def _period(value: str) -> str:
+    """Period bound as a UTC "YYYY-MM-DDTHH:MM:SSZ" string, so rows sort and compare as text; kept as-is if unparseable."""
+    try:
+        return utc_bound(value) or ""
+    except ValueError:
+        return str(value)
+
+
+def record(result: dict, kind: str = "run") -> None:
+    """Store an Analytics Result, replacing an earlier one of the same kind and period, and drop the cached latest result."""
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    totals = result.get("totals", {})
+    row = (
+        kind, _period(result.get("period_start", "")), _period(result.get("period_end", "")), result.get("computed_at", ""),
+        result.get("record_count"), *(float(totals.get(m, 0) or 0) for m in METRICS),
+        result.get("distinct_ids"), result.get("source_count"), json.dumps(result),
+    )
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO results (kind, period_start, period_end, computed_at, record_count, visits, conversions, revenue,
+                                     distinct_ids, source_count, result)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, period_start, period_end) DO UPDATE SET
+                    computed_at = excluded.computed_at,
+                    record_count = excluded.record_count,
+                    visits = excluded.visits,
+                    conversions = excluded.conversions,
+                    revenue = excluded.revenue,
+                    distinct_ids = excluded.distinct_ids,
+                    source_count = excluded.source_count,
+                    result = excluded.result
+            """, row)
+    finally:
+        conn.close()
+    with _latest_lock:
+        _latest["key"] = None
+
+
+def _file_key():
+    try:
+        st = HISTORY_DB.stat()
+    except OSError:
+        return None
+    return HISTORY_DB, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def latest() -> dict | None:
+    """
+    The most recently computed run result (backfills excluded), or None if none is stored. Served from memory while the database file is
+    unchanged (a stat per call), so results recorded by other processes are picked up too. Do not mutate it.
+    """
+    key = _file_key()
+    with _latest_lock:
+        if key is not None and key == _latest["key"]:
+            return _latest["result"]
+    result = None
+    if key is not None:
+        conn = connect()
+        try:
+            row = conn.execute("SELECT result FROM results WHERE kind = 'run' ORDER BY computed_at DESC, id DESC LIMIT 1").fetchone()
+        finally:
+            conn.close()
+        result = json.loads(row["result"]) if row else None
+    with _latest_lock:
+        _latest.update(key=key, result=result)
+    return result
+
+
+def _entry(row: sqlite3.Row) -> dict:
+    result = json.loads(row["result"])
+    return {
+        "kind": row["kind"],
+        "period_start": result.get("period_start", row["period_start"]),
+        "period_end": result.get("period_end", row["period_end"]),
+        "computed_at": row["computed_at"],
+        "record_count": row["record_count"],
+        "totals": {m: row[m] for m in METRICS},
+        "distinct_ids": row["distinct_ids"],
+        "source_count": row["source_count"],
+        "by_source": result.get("by_source", []),
+    }
+
+
+def _change(current: dict, previous: dict) -> dict:
+    """Absolute and relative change of each compared figure; pct is None when the previous value is 0 or missing."""
+    out = {}
+    for name in COMPARED:
+        cur = current["totals"][name] if name in METRICS else current[name]
+        prev = previous["totals"][name] if name in METRICS else previous[name]
+        if cur is None or prev is None:
+            out[name] = {"delta": None, "pct": None}
+            continue
+        out[name] = {"delta": cur - prev, "pct": round((cur - prev) / prev * 100, 2) if prev else None}
+    return out
+
+
+def query(start: str | None = None, end: str | None = None, limit: int = DEFAULT_LIMIT, compare: bool = False, kind: str | None = None) -> list:
+    """
+    Stored results whose period overlaps [start, end) (ISO-8601), oldest period first, at most `limit` (the newest
+    ones), of `kind` or of every kind. compare=True adds "previous" (the period before, of the same kind filter,
+    which may lie before `start`) and "change" per row. Raises ValueError on an invalid bound, limit or kind.
+    """
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    kinds, kind_params = ("kind = ?", [kind]) if kind else ("1", [])
+    where, params = [kinds], list(kind_params)
+    lo, hi = utc_bound(start), utc_bound(end)
+    if lo is not None:
+        where.append("period_end >= ?")
+        params.append(lo)
+    if hi is not None:
+        where.append("period_start < ?")
+        params.append(hi)
+    if not HISTORY_DB.is_file():
+        return []
+    sql = f"SELECT * FROM results WHERE {' AND '.join(where)} ORDER BY period_end DESC, period_start DESC LIMIT ?"
+    before = None
+    conn = connect()
+    try:
+        rows = conn.execute(sql, [*params, limit]).fetchall()
+        if compare and rows:
+            oldest = rows[-1]
+            before = conn.execute(
+                f"SELECT * FROM results WHERE {kinds} AND (period_end < ? OR (period_end = ? AND period_start < ?)) "
+                "ORDER BY period_end DESC, period_start DESC LIMIT 1",
+                (*kind_params, oldest["period_end"], oldest["period_end"], oldest["period_start"]),
+            ).fetchone()
+    finally:
+        conn.close()
+    entries = [_entry(r) for r in reversed(rows)]
+    if compare:
+        prev = before and _entry(before)
+        for cur in entries:
+            cur["previous"] = prev and {"period_start": prev["period_start"], "period_end": prev["period_end"]}
+            cur["change"] = prev and _change(cur, prev)
+            prev = cur
+    return entries
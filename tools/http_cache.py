@@ -0,0 +1,180 @@
+"""
+On-disk cache of URL source bodies and their validators (.tmp/http_cache/).
+Each fetch sends If-None-Match / If-Modified-Since from the stored ETag / Last-Modified; on 304 the cached body is
+reused. Responses are requested with gzip/deflate encoding, decompressed incrementally, and streamed to disk
+and hashed as they arrive, so ingest parses them from the file and the pipeline can tell an unchanged feed from
+its content hash without parsing it. Peak memory is one chunk, whatever the feed size.
+CLI: python tools/http_cache.py prunes entries unused for HTTP_CACHE_MAX_AGE_DAYS.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.error import URLError
+
+# Allow running as a script (python tools/http_cache.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import http_pool
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+CACHE_DIR = TMP_DIR / "http_cache"
+DEFAULT_MAX_AGE_DAYS = 7
+_CHUNK = 1 << 16
+
+
+def _max_age_days() -> float:
+    try:
+        return float(os.environ.get("HTTP_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS) or DEFAULT_MAX_AGE_DAYS)
+    except ValueError:
+        return DEFAULT_MAX_AGE_DAYS
+
+
+class _Decoder:
+    """
+    Incremental Content-Encoding decoder: identity, gzip (including multi-member) and deflate (zlib or raw).
+    feed() yields the decoded data in pieces of at most _CHUNK bytes, so a small compressed chunk that expands
+    a lot never has to be held whole.
+    """
+
+    def __init__(self, encoding: str | None):
+        encoding = (encoding or "identity").strip().lower()
+        if encoding not in ("identity", "gzip", "x-gzip", "deflate"):
+            raise URLError(f"unsupported Content-Encoding: {encoding}")
+        self.encoding = encoding
+        self._wbits = 16 + zlib.MAX_WBITS if encoding in ("gzip", "x-gzip") else zlib.MAX_WBITS
+        self._d = None if encoding == "identity" else zlib.decompressobj(self._wbits)
+        self._sniff = encoding == "deflate"
+
+    def feed(self, data: bytes):
+        if self._d is None:
+            if data:
+                yield data
+            return
+        if self._sniff and data:
+            self._sniff = False
+            try:
+                zlib.decompressobj(zlib.MAX_WBITS).decompress(data[:64], 1)
+            except zlib.error:
+                self._wbits = -zlib.MAX_WBITS  # servers that send raw deflate without the zlib header
+                self._d = zlib.decompressobj(self._wbits)
+        while data:
+            out = self._d.decompress(data, _CHUNK)
+            data = self._d.unconsumed_tail
+            if self._d.eof and self._d.unused_data:
+                data = self._d.unused_data  # next gzip member
+                self._d = zlib.decompressobj(self._wbits)
+            if out:
+                yield out
+
+    def flush(self):
+        if self._d is not None and (tail := self._d.flush()):
+            yield tail
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def load_entry(url: str) -> dict | None:
+    """Stored entry for `url` (url, etag, last_modified, sha256, size, path, stored_at) if its body is present."""
+    key = _key(url)
+    try:
+        with open(CACHE_DIR / f"{key}.json", "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    entry["path"] = str(CACHE_DIR / f"{key}.body")
+    return entry if Path(entry["path"]).is_file() and entry.get("url") == url else None
+
+
+def _save_meta(key: str, entry: dict) -> None:
+    meta = {k: v for k, v in entry.items() if k not in ("path", "not_modified")}
+    part = CACHE_DIR / f"{key}.{uuid.uuid4().hex}.json.part"
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(part, CACHE_DIR / f"{key}.json")
+
+
+def fetch(url: str, timeout: float = 30, headers: dict | None = None) -> dict:
+    """
+    Conditional GET of `url` into the cache. Returns the entry with "path" (cached body) and "not_modified"
+    (True when the server answered 304). Raises HTTPError/URLError/TimeoutError like http_pool.fetch.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    key = _key(url)
+    cached = load_entry(url)
+    hdrs = {"Accept-Encoding": "gzip, deflate", **(headers or {})}
+    if cached is not None:
+        if cached.get("etag"):
+            hdrs["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            hdrs["If-Modified-Since"] = cached["last_modified"]
+    with http_pool.default_pool().open(url, hdrs, timeout) as (resp, reader):
+        if resp.status == 304 and cached is not None:
+            reader.read_all()
+            os.utime(cached["path"])  # keeps the entry from being pruned while the feed is in use
+            return {**cached, "not_modified": True}
+        decoder = _Decoder(resp.getheader("Content-Encoding"))
+        h = hashlib.sha256()
+        size = wire = 0
+        part = CACHE_DIR / f"{key}.{uuid.uuid4().hex}.body.part"
+        try:
+            with open(part, "wb") as f:
+                while True:
+                    chunk = reader.read1(_CHUNK)
+                    wire += len(chunk)
+                    try:
+                        for data in decoder.feed(chunk) if chunk else decoder.flush():
+                            h.update(data)
+                            f.write(data)
+                            size += len(data)
+                    except zlib.error as e:
+                        raise URLError(f"corrupt {decoder.encoding} body: {e}")
+                    if not chunk:
+                        break
+            (CACHE_DIR / f"{key}.json").unlink(missing_ok=True)  # never pair old validators with a new body
+            os.replace(part, CACHE_DIR / f"{key}.body")
+        finally:
+            part.unlink(missing_ok=True)
+        entry = {
+            "url": url,
+            "etag": resp.getheader("ETag"),
+            "last_modified": resp.getheader("Last-Modified"),
+            "sha256": h.hexdigest(),
+            "size": size,
+            "content_encoding": decoder.encoding,
+            "wire_bytes": wire,
+            "stored_at": datetime.now(timezone.utc).isoformat(),
+        }
+    _save_meta(key, entry)
+    return {**entry, "path": str(CACHE_DIR / f"{key}.body"), "not_modified": False}
+
+
+def prune(max_age_days: float | None = None) -> int:
+    """Delete entries not fetched or revalidated for max_age_days (HTTP_CACHE_MAX_AGE_DAYS, default 7). Returns count."""
+    if not CACHE_DIR.is_dir():
+        return 0
+    cutoff = time.time() - 86400 * (_max_age_days() if max_age_days is None else max_age_days)
+    removed = 0
+    for body in CACHE_DIR.glob("*.body"):
+        try:
+            if body.stat().st_mtime < cutoff:
+                body.unlink()
+                body.with_suffix(".json").unlink(missing_ok=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+if __name__ == "__main__":
+    print(f"Pruned {prune()} cached responses.")
+    sys.exit(0)
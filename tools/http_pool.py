@@ -0,0 +1,185 @@
+"""
+Keep-alive HTTP(S) connections pooled per host, for ingest_data's URL sources and send_payload's webhooks.
+Requests to the same scheme/host/port reuse an idle connection instead of opening a new one; redirects are
+followed; 4xx/5xx raise urllib's HTTPError and connection failures URLError, like urlopen.
+Each request has a deadline covering connect, headers and body, so one slow source cannot hold a worker forever.
+"""
+
+import http.client
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit, urlunsplit
+
+USER_AGENT = "BLAST-Analytics/1.0"
+MAX_IDLE_PER_HOST = 4
+MAX_REDIRECTS = 5
+_READ_CHUNK = 1 << 16
+
+
+def with_query(url: str, params: dict) -> str:
+    """`url` with `params` appended to its query string."""
+    parts = urlsplit(url)
+    query = "&".join(q for q in (parts.query, urlencode(params)) if q)
+    return urlunsplit(parts._replace(query=query))
+
+
+class DeadlineReader:
+    """File-like wrapper over a response that raises TimeoutError once the request deadline has passed."""
+
+    def __init__(self, resp, deadline: float, sock_timeout=None):
+        self.resp = resp
+        self.deadline = deadline
+        self._sock_timeout = sock_timeout
+
+    def _check(self) -> None:
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("source deadline exceeded")
+        if self._sock_timeout is not None:
+            self._sock_timeout(remaining)
+
+    def read(self, n: int = -1) -> bytes:
+        self._check()
+        return self.resp.read(n) if n is not None and n >= 0 else self.read_all()
+
+    def read1(self, n: int = _READ_CHUNK) -> bytes:
+        self._check()
+        data = self.resp.read1(n)
+        if not data:
+            self.resp.read()  # read1 alone never marks a Content-Length body complete, which keeps it out of the pool
+        return data
+
+    def read_all(self) -> bytes:
+        chunks = []
+        while chunk := self.read(_READ_CHUNK):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class HostPool:
+    """Thread-safe pool of idle keep-alive connections keyed by (scheme, host, port)."""
+
+    def __init__(self, max_idle_per_host: int = MAX_IDLE_PER_HOST):
+        self.max_idle = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.opened = 0  # connections created, for tests and diagnostics
+
+    def _key(self, url: str) -> tuple:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise URLError(f"unsupported URL scheme: {parts.scheme!r}")
+        return parts.scheme, parts.hostname or "", parts.port or (443 if parts.scheme == "https" else 80)
+
+    def _acquire(self, key: tuple, timeout: float):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.opened += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout), False
+
+    def _release(self, key: tuple, conn) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for c in conns:
+            c.close()
+
+    @contextmanager
+    def open(self, url: str, headers: dict | None = None, timeout: float = 30, method: str = "GET", body: bytes | None = None):
+        """
+        Send `method` (GET by default, with `body` if given) to `url` and yield (response, reader): the http.client
+        response (status, headers) and a DeadlineReader for its body. The connection goes back to the pool if the
+        body was read to the end. Redirects keep the method and body on 307/308 and turn into a GET otherwise.
+        """
+        deadline = time.monotonic() + timeout
+        hdrs = {"User-Agent": USER_AGENT, **(headers or {})}
+        for _ in range(MAX_REDIRECTS + 1):
+            key = self._key(url)
+            parts = urlsplit(url)
+            target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            resp, conn = self._send(key, target, hdrs, deadline, url, method, body)
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                resp.read()
+                self._finish(key, conn, resp)
+                url = urljoin(url, resp.getheader("Location"))
+                if resp.status not in (307, 308):
+                    method, body = "GET", None
+                continue
+            if resp.status >= 400:
+                resp.read()
+                self._finish(key, conn, resp)
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            break
+        else:
+            raise URLError(f"too many redirects: {url}")
+
+        def set_timeout(remaining: float) -> None:
+            if conn.sock is not None:
+                conn.sock.settimeout(remaining)
+
+        try:
+            yield resp, DeadlineReader(resp, deadline, set_timeout)
+        except BaseException:
+            conn.close()
+            raise
+        self._finish(key, conn, resp)
+
+    def _send(self, key: tuple, target: str, headers: dict, deadline: float, url: str, method: str = "GET", body: bytes | None = None):
+        """Send the request, retrying once on a fresh connection if a reused one turned out to be closed."""
+        for attempt in range(2):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"source deadline exceeded: {url}")
+            conn, reused = self._acquire(key, remaining)
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                return conn.getresponse(), conn
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                conn.close()
+                if not reused or attempt:
+                    raise URLError(e)
+            except (socket.timeout, TimeoutError):
+                conn.close()
+                raise TimeoutError(f"source deadline exceeded: {url}")
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise URLError(e)
+
+    def _finish(self, key: tuple, conn, resp) -> None:
+        if resp.isclosed() and not resp.will_close:
+            self._release(key, conn)
+        else:
+            conn.close()
+
+
+_default = HostPool()
+
+
+def default_pool() -> HostPool:
+    """Process-wide pool shared by ingest runs, so schedules against the same hosts keep their connections."""
+    return _default
+
+
+def fetch(url: str, headers: dict | None = None, timeout: float = 30, pool: HostPool | None = None) -> bytes:
+    """GET `url` and return the whole body (urlopen(...).read() over a pooled connection)."""
+    with (pool or _default).open(url, headers, timeout) as (_, reader):
+        return reader.read_all()
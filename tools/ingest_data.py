@@ -1,112 +1,414 @@
 """
-Ingest raw data from DATA_SOURCE_PATH or DATA_SOURCE_URL.
+Ingest raw data from DATA_SOURCE_PATH, DATA_SOURCE_URL, or several feeds in DATA_SOURCE_URLS.
 Output: .tmp/raw_input.json (Raw Input schema).
+File sources (CSV, NDJSON, JSON) are read as a stream of bounded-size batches; peak memory does not grow with file size.
+URL sources are fetched concurrently over pooled keep-alive connections (tools/http_pool.py), each with its own
+timeout, revalidated against the local response cache (tools/http_cache.py), and merged in the configured order.
+Paginated API sources (DATA_SOURCE_PAGINATION) are streamed page by page with prefetching (tools/pagination.py).
 Deterministic; no calculations.
 """
 
 import os
+import io
 import sys
 import json
 import csv
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
+from itertools import chain, islice
 from pathlib import Path
-from urllib.request import urlopen, Request
 from urllib.error import HTTPError, URLError
 
+# Allow running as a script (python tools/ingest_data.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import http_cache, http_pool, metrics, pagination
+from tools.jsonstream import open_records_file, write_records
+
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 OUTPUT_FILE = TMP_DIR / "raw_input.json"
 SCHEMA_VERSION = "1.0"
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_RANGE_MB = 32
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_SOURCE_TIMEOUT_SEC = 30
 
 
-def _load_json(path: Path) -> dict:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _batch_size() -> int:
+    try:
+        return max(1, int(os.environ.get("INGEST_BATCH_SIZE", DEFAULT_BATCH_SIZE) or DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return DEFAULT_BATCH_SIZE
 
 
-def _load_csv(path: Path) -> dict:
-    records = []
-    with open(path, "r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        headers = [h.strip().lower() for h in (reader.fieldnames or [])]
-        for row in reader:
-            r = {}
-            for k, v in row.items():
-                key = k.strip().lower().replace(" ", "_")
-                r[key] = v.strip() if isinstance(v, str) else v
-            records.append(r)
-    return _csv_rows_to_raw(records)
-
-
-def _csv_rows_to_raw(rows: list) -> dict:
-    records = []
-    for i, row in enumerate(rows):
-        rec = {
-            "id": str(row.get("id", str(i))),
-            "timestamp": str(row.get("timestamp", datetime.now(timezone.utc).isoformat())),
-            "source": str(row.get("source", row.get("source", ""))),
-            "metrics": {
-                "visits": float(row.get("visits", row.get("visits", 0)) or 0),
-                "conversions": float(row.get("conversions", row.get("conversions", 0)) or 0),
-                "revenue": float(row.get("revenue", row.get("revenue", 0)) or 0),
-            },
-            "meta": {},
-        }
-        records.append(rec)
+def _workers() -> int:
+    try:
+        return max(1, int(os.environ.get("INGEST_WORKERS", "1") or "1"))
+    except ValueError:
+        return 1
+
+
+def _range_bytes() -> int:
+    try:
+        mb = float(os.environ.get("INGEST_RANGE_MB", DEFAULT_RANGE_MB) or DEFAULT_RANGE_MB)
+    except ValueError:
+        mb = DEFAULT_RANGE_MB
+    return max(1, int(mb * (1 << 20)))
+
+
+def _fetch_concurrency() -> int:
+    try:
+        return max(1, int(os.environ.get("INGEST_FETCH_CONCURRENCY", DEFAULT_FETCH_CONCURRENCY) or DEFAULT_FETCH_CONCURRENCY))
+    except ValueError:
+        return DEFAULT_FETCH_CONCURRENCY
+
+
+def _source_timeout() -> float:
+    try:
+        return max(0.1, float(os.environ.get("INGEST_SOURCE_TIMEOUT_SEC", DEFAULT_SOURCE_TIMEOUT_SEC) or DEFAULT_SOURCE_TIMEOUT_SEC))
+    except ValueError:
+        return DEFAULT_SOURCE_TIMEOUT_SEC
+
+
+def source_urls() -> list:
+    """Configured URL sources: DATA_SOURCE_URLS (comma- or whitespace-separated), else DATA_SOURCE_URL."""
+    many = (os.environ.get("DATA_SOURCE_URLS") or "").replace(",", " ").split()
+    if many:
+        return many
+    url = (os.environ.get("DATA_SOURCE_URL") or "").strip()
+    return [url] if url else []
+
+
+def watermark_field() -> str:
+    """Record field used for incremental watermarks: "timestamp" (default) or "id"."""
+    field = (os.environ.get("PIPELINE_WATERMARK_FIELD", "timestamp") or "timestamp").strip().lower()
+    return field if field in ("timestamp", "id") else "timestamp"
+
+
+def _watermark_key(value) -> tuple:
+    """Order numeric ids numerically; everything else (ISO-8601 timestamps, string ids) lexicographically."""
+    s = str(value)
+    return (0, int(s), "") if s.isdigit() else (1, 0, s)
+
+
+def filter_since(records, field: str, since, mark: dict):
+    """
+    Yield records whose `field` is strictly past `since` and keep the largest value seen in mark["value"].
+    since=None passes every record through (full run). In incremental runs, records without the field and
+    non-dict rows are skipped, since they cannot be placed relative to the watermark.
+    """
+    since_key = None if since is None else _watermark_key(since)
+    best = mark.get("value")
+    best_key = None if best is None else _watermark_key(best)
+    for r in records:
+        value = r.get(field) if isinstance(r, dict) else None
+        if value is None or value == "":
+            if since is None:
+                yield r
+            continue
+        key = _watermark_key(value)
+        if since_key is not None and key <= since_key:
+            continue
+        if best_key is None or key > best_key:
+            best_key = key
+            mark["value"] = str(value)
+        yield r
+
+
+def iter_batches(records, batch_size: int):
+    """Group a record iterator into lists of at most batch_size records."""
+    it = iter(records)
+    while batch := list(islice(it, batch_size)):
+        yield batch
+
+
+def _csv_row_to_record(row: dict, index: int, now: str) -> dict:
     return {
-        "schema_version": SCHEMA_VERSION,
-        "records": records,
-        "metadata": {
-            "generated_at": datetime.now(timezone.utc).isoformat(),
-            "source_label": "csv",
+        "id": str(row.get("id", str(index))),
+        "timestamp": str(row.get("timestamp", now)),
+        "source": str(row.get("source", "")),
+        "metrics": {
+            "visits": float(row.get("visits", 0) or 0),
+            "conversions": float(row.get("conversions", 0) or 0),
+            "revenue": float(row.get("revenue", 0) or 0),
         },
+        "meta": {},
     }
 
 
-def _fetch_url(url: str) -> bytes:
-    req = Request(url, headers={"User-Agent": "BLAST-Analytics/1.0"})
-    with urlopen(req, timeout=30) as resp:
-        return resp.read()
+def _csv_headers(header_row: list) -> list:
+    return [h.strip().lower().replace(" ", "_") for h in header_row]
 
 
-def ingest() -> int:
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
+def _csv_values(headers: list, values: list) -> dict:
+    return {k: v.strip() for k, v in zip(headers, values)}
+
+
+def _iter_csv(path: Path, now: str):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        headers = _csv_headers(next(reader, []))
+        i = 0
+        for values in reader:
+            if values:
+                yield _csv_row_to_record(_csv_values(headers, values), i, now)
+                i += 1
+
+
+def _iter_ndjson(path: Path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# — Parallel byte-range parsing (INGEST_WORKERS > 1; CSV and NDJSON only)
+
+
+def _newline_ranges(mm, start: int, range_bytes: int) -> list:
+    """Split mm[start:] into consecutive (start, end) ranges that each end just after a newline (or at EOF)."""
+    size = len(mm)
+    ranges = []
+    pos = start
+    while pos < size:
+        end = min(pos + range_bytes, size)
+        if end < size:
+            nl = mm.find(b"\n", end - 1)
+            end = size if nl == -1 else nl + 1
+        ranges.append((pos, end))
+        pos = end
+    return ranges
+
+
+def _parse_range(path: str, fmt: str, start: int, end: int, headers: list | None, now: str) -> tuple[list, list]:
+    """
+    Worker: parse one newline-aligned byte range. Returns (records, defaulted) where defaulted lists the
+    positions of CSV rows without an id; the parent assigns those their global row index.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8")
+    if fmt != "csv":
+        return [json.loads(line) for line in text.split("\n") if line.strip()], []
+    records, defaulted = [], []
+    for values in csv.reader(io.StringIO(text, newline="")):
+        if values:
+            row = _csv_values(headers, values)
+            if "id" not in row:
+                defaulted.append(len(records))
+            records.append(_csv_row_to_record(row, 0, now))
+    return records, defaulted
+
+
+def _iter_parallel(path: Path, fmt: str, now: str, workers: int):
+    """
+    Memory-map the file, split it into newline-aligned byte ranges and parse them in a process pool.
+    Results are yielded in file order; at most 2 * workers ranges are in flight at once.
+    Quoted CSV fields must not contain newlines in this mode.
+    """
+    headers = None
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            if fmt == "csv":
+                nl = mm.find(b"\n")
+                start = len(mm) if nl == -1 else nl + 1
+                header_text = mm[:start].decode("utf-8")
+                headers = _csv_headers(next(csv.reader(io.StringIO(header_text, newline="")), []))
+            ranges = _newline_ranges(mm, start, _range_bytes())
+    offset = 0
+    todo = iter(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(_parse_range, str(path), fmt, a, b, headers, now) for a, b in islice(todo, workers * 2))
+        while pending:
+            records, defaulted = pending.popleft().result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append(pool.submit(_parse_range, str(path), fmt, nxt[0], nxt[1], headers, now))
+            for i in defaulted:
+                records[i]["id"] = str(offset + i)
+            offset += len(records)
+            yield from records
+
+
+def _open_path(p: Path, fmt: str, now: str, workers: int) -> tuple[dict, object]:
+    """Stream a local file (a DATA_SOURCE_PATH or a cached URL body) in DATA_SOURCE_FORMAT as (head, records)."""
+    if fmt == "csv":
+        head = {"schema_version": SCHEMA_VERSION, "metadata": {"generated_at": now, "source_label": "csv"}}
+        return head, _iter_parallel(p, fmt, now, workers) if workers > 1 else _iter_csv(p, now)
+    if fmt in ("ndjson", "jsonl"):
+        head = {"schema_version": SCHEMA_VERSION, "metadata": {"generated_at": now, "source_label": fmt}}
+        return head, _iter_parallel(p, fmt, now, workers) if workers > 1 else _iter_ndjson(p)
+    head, records = open_records_file(p)
+    head.pop("records", None)
+    head.setdefault("schema_version", SCHEMA_VERSION)
+    return head, records
+
+
+def read_batches(batch_size: int | None = None, since=None, mark: dict | None = None, fetched: list | None = None) -> tuple[dict, object] | None:
+    """
+    Open the configured source as (head, batches): head holds schema_version/metadata, batches yields
+    lists of at most batch_size records (default INGEST_BATCH_SIZE). Prints the error and returns None on failure.
+    With INGEST_WORKERS > 1, CSV and NDJSON files are parsed in parallel byte ranges (same records, same order).
+    For JSON objects, members that follow "records" are added to head once batches is exhausted.
+    since: only records past this watermark (see filter_since); URL sources also get it as the
+    DATA_SOURCE_SINCE_PARAM query parameter when set. mark["value"] tracks the new watermark.
+    fetched: result of fetch_sources() for the same URLs, so a caller that already revalidated them does not
+    request them again.
+    """
+    batch_size = batch_size or _batch_size()
+    workers = _workers()
     path = os.environ.get("DATA_SOURCE_PATH", "").strip()
-    url = os.environ.get("DATA_SOURCE_URL", "").strip()
+    urls = source_urls()
     fmt = (os.environ.get("DATA_SOURCE_FORMAT", "json") or "json").strip().lower()
+    now = datetime.now(timezone.utc).isoformat()
 
     if path:
         p = Path(path)
         if not p.is_file():
             print("DATA_SOURCE_PATH file not found.", file=sys.stderr)
-            return 1
-        if fmt == "csv":
-            data = _load_csv(p)
-        else:
-            raw = _load_json(p)
-            data = raw if "records" in raw else {"schema_version": SCHEMA_VERSION, "records": raw.get("records", []), "metadata": raw.get("metadata", {})}
-    elif url:
-        try:
-            body = _fetch_url(url)
-        except (HTTPError, URLError) as e:
-            print(f"DATA_SOURCE_URL unreachable: {e}", file=sys.stderr)
-            return 1
-        raw = json.loads(body.decode("utf-8"))
-        if isinstance(raw, list):
-            raw = {"schema_version": SCHEMA_VERSION, "records": raw, "metadata": {}}
-        elif isinstance(raw, dict) and "records" not in raw:
-            raw = {"schema_version": SCHEMA_VERSION, "records": [], "metadata": raw.get("metadata", {})}
-        data = raw
+            return None
+        metrics.note("ingest", bytes_read=p.stat().st_size)
+        head, records = _open_path(p, fmt, now, workers)
+    elif urls:
+        opened = _open_urls(urls, since, fmt, now, workers, fetched)
+        if opened is None:
+            return None
+        head, records = opened
     else:
-        data = {
-            "schema_version": SCHEMA_VERSION,
-            "records": [],
-            "metadata": {"generated_at": datetime.now(timezone.utc).isoformat(), "source_label": "none"},
-        }
-
-    if "metadata" not in data:
-        data["metadata"] = {"generated_at": datetime.now(timezone.utc).isoformat(), "source_label": "unknown"}
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+        head = {"schema_version": SCHEMA_VERSION, "metadata": {"generated_at": now, "source_label": "none"}}
+        records = []
+
+    if "metadata" not in head:
+        head["metadata"] = {"generated_at": now, "source_label": "unknown"}
+    if since is not None or mark is not None:
+        records = filter_since(records, watermark_field(), since, mark if mark is not None else {})
+    return head, iter_batches(records, batch_size)
+
+
+def read_raw(since=None, mark: dict | None = None, fetched: list | None = None) -> dict | None:
+    """Load the configured source into a Raw Input dict whose "records" is an iterator. None on failure."""
+    opened = read_batches(since=since, mark=mark, fetched=fetched)
+    if opened is None:
+        return None
+    head, batches = opened
+    head["records"] = chain.from_iterable(batches)
+    return head
+
+
+def raw_parts(data: dict) -> tuple[dict, object, object]:
+    """Split a Raw Input dict into (head, records, tail) for jsonstream.tee_records."""
+    head = {k: v for k, v in data.items() if k != "records"}
+    tail = lambda: {k: v for k, v in data.items() if k != "records" and head.get(k) is not v}
+    return head, data.get("records", []), tail
+
+
+def request_urls(urls: list, since=None) -> list:
+    """The URLs actually requested: with the watermark as DATA_SOURCE_SINCE_PARAM when set."""
+    since_param = (os.environ.get("DATA_SOURCE_SINCE_PARAM") or "").strip()
+    if since is not None and since_param:
+        return [http_pool.with_query(u, {since_param: since}) for u in urls]
+    return list(urls)
+
+
+def fetch_sources(urls: list) -> list:
+    """
+    Conditional GET of every URL into the response cache (tools/http_cache.py), concurrently
+    (INGEST_FETCH_CONCURRENCY threads, INGEST_SOURCE_TIMEOUT_SEC each). Returns [(url, entry, error)] in order;
+    entry is None and error the exception when a fetch failed.
+    """
+    timeout = _source_timeout()
+    with ThreadPoolExecutor(max_workers=max(1, min(_fetch_concurrency(), len(urls)))) as pool:
+        futures = [pool.submit(http_cache.fetch, u, timeout) for u in urls]
+        fetched = []
+        for u, fut in zip(urls, futures):
+            try:
+                fetched.append((u, fut.result(), None))
+            except (HTTPError, URLError, TimeoutError, OSError) as e:
+                fetched.append((u, None, e))
+    http_cache.prune()
+    return fetched
+
+
+def _skip_failed() -> bool:
+    return (os.environ.get("DATA_SOURCE_SKIP_FAILED") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _open_urls(urls: list, since, fmt: str, now: str, workers: int, fetched: list | None = None) -> tuple[dict, object] | None:
+    """
+    Fetch the URL sources (see fetch_sources; `fetched` reuses a result for the same URLs) and stream their
+    records from the decoded, cached bodies with the same readers as file sources, merged in the configured order. A single URL keeps its own top-level fields
+    as the head. Any failed source fails the ingest unless DATA_SOURCE_SKIP_FAILED is set. Prints errors; None on failure.
+    """
+    urls = request_urls(urls, since)
+    if pagination.mode() != "none":
+        return _open_paginated(urls, now)
+    if fetched is None or [u for u, _, _ in fetched] != urls:
+        fetched = fetch_sources(urls)
+    skip_failed = _skip_failed()
+    ok, failed = [], []
+    for u, entry, error in fetched:
+        if entry is None:
+            print(f"{'DATA_SOURCE_URL' if len(urls) == 1 else f'Source {u}'} unreachable: {error}", file=sys.stderr)
+            failed.append({"url": u, "error": str(error)})
+        else:
+            ok.append(entry)
+    if failed and (not skip_failed or not ok):
+        return None
+    metrics.note("ingest", bytes_read=sum(Path(e["path"]).stat().st_size for e in ok))
+    if len(urls) == 1:
+        return _open_path(Path(ok[0]["path"]), fmt, now, workers)
+    metadata = {
+        "generated_at": now,
+        "source_label": "urls",
+        "sources": [{"url": e["url"], "sha256": e["sha256"], "not_modified": e["not_modified"]} for e in ok],
+    }
+    if failed:
+        metadata["failed_sources"] = failed
+    head = {"schema_version": SCHEMA_VERSION, "metadata": metadata}
+    return head, chain.from_iterable(_open_path(Path(e["path"]), fmt, now, workers)[1] for e in ok)
+
+
+def _open_paginated(urls: list, now: str) -> tuple[dict, object] | None:
+    """
+    Stream paginated feeds (tools/pagination.py) in order. Waits for the first page of every feed so an unreachable
+    feed fails the ingest up front (or is skipped with DATA_SOURCE_SKIP_FAILED); later pages are fetched while
+    earlier ones are consumed, and a failure there raises from the record iterator. Prints errors; None on failure.
+    """
+    pager = pagination.Pager(pagination.mode(), _fetch_concurrency(), _source_timeout())
+    feeds = pager.open(urls)
+    ok, failed = [], []
+    for f in feeds:
+        first = f.first()
+        if isinstance(first, Exception):
+            print(f"{'DATA_SOURCE_URL' if len(urls) == 1 else f'Source {f.url}'} unreachable: {first}", file=sys.stderr)
+            failed.append({"url": f.url, "error": str(first)})
+        else:
+            ok.append(f)
+    if failed and (not _skip_failed() or not ok):
+        pager.close()
+        return None
+    metadata = {"generated_at": now, "source_label": "paginated", "sources": [{"url": f.url} for f in ok]}
+    if failed:
+        metadata["failed_sources"] = failed
+    return {"schema_version": SCHEMA_VERSION, "metadata": metadata}, pagination.iter_feeds(pager, ok)
+
+
+def ingest() -> int:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    data = read_raw()
+    if data is None:
+        return 1
+    try:
+        n = write_records(OUTPUT_FILE, *raw_parts(data))
+        metrics.note("ingest", records_in=n, records_out=n)
+    except (HTTPError, URLError, TimeoutError) as e:
+        print(f"Paginated source failed mid-stream: {e}", file=sys.stderr)
+        return 1
     return 0
 
 
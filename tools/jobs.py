@@ -0,0 +1,307 @@
+"""
+Background jobs for /trigger: each request is recorded in .tmp/jobs.db and executed by a thread pool in the
+web process (JOB_WORKERS, default 2), so the request returns immediately with a job id.
+Every job except a preview holds the single-flight lock (.tmp/pipeline.lock, an exclusive flock shared by all
+processes) while it runs, so two pipelines never overlap. A full_pipeline submitted while another one is queued in
+this process or running anywhere returns that job instead of starting a second one.
+Each job is recorded as a metrics run (tools/metrics.py) under its job id; its per-stage metrics are stored with
+the job when it finishes.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Allow running as a script (python tools/jobs.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import metrics
+
+# Optional: fcntl for the cross-process lock. Without it (non-POSIX) the lock only serializes jobs within one process.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+JOBS_DB = TMP_DIR / "jobs.db"
+LOCK_FILE = TMP_DIR / "pipeline.lock"
+# Job kind → pipeline stage it reports progress under (single-tool jobs) or None (full pipeline, backfill, preview).
+JOB_KINDS = {
+    "full_pipeline": None,
+    "ingest_data": "ingest",
+    "clean_data": "clean",
+    "analyze": "analyze",
+    "generate_report": "report",
+    "send_payload": "deliver",
+    "backfill": None,
+    "preview": None,
+}
+# Kinds that only read the source and write their own output run without the single-flight lock.
+LOCK_FREE = ("preview",)
+ACTIVE = ("queued", "running")
+
+_pool = None
+_pool_lock = threading.Lock()
+_submit_lock = threading.Lock()
+_local_lock = threading.Lock()
+_queued_here = set()
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.environ.get("JOB_WORKERS", "2") or "2"))
+    except ValueError:
+        return 2
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix="job")
+        return _pool
+
+
+# — Store
+
+
+def _connect() -> sqlite3.Connection:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stages TEXT NOT NULL,
+            exit_code INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            metrics TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+    return conn
+
+
+def _row_to_job(r) -> dict:
+    job = dict(r)
+    job["params"] = json.loads(job["params"])
+    job["stages"] = json.loads(job["stages"])
+    job["metrics"] = json.loads(job["metrics"]) if job.get("metrics") else None
+    return job
+
+
+def get_job(job_id: str) -> dict | None:
+    conn = _connect()
+    try:
+        r = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _row_to_job(r) if r else None
+
+
+def list_jobs(limit: int = 20) -> list:
+    """Most recent jobs first."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_job(r) for r in rows]
+
+
+def _update(job_id: str, **fields) -> None:
+    for key in ("stages", "metrics"):
+        if key in fields:
+            fields[key] = json.dumps(fields[key])
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+    finally:
+        conn.close()
+
+
+# — Single-flight lock
+
+
+@contextmanager
+def single_flight():
+    """Hold the pipeline lock for the duration of the block, waiting for any running job to release it."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a") as f:
+        if fcntl is None:
+            _local_lock.acquire()
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is None:
+                _local_lock.release()
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def is_locked() -> bool:
+    """True if some job (in any process) currently holds the pipeline lock."""
+    if fcntl is None:
+        return _local_lock.locked()
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+
+def _active_pipeline(conn) -> dict | None:
+    """A full_pipeline job that is queued in this process or running; marks running jobs of dead processes failed."""
+    rows = conn.execute(
+        "SELECT * FROM jobs WHERE kind = 'full_pipeline' AND status IN (?, ?) ORDER BY created_at DESC", ACTIVE,
+    ).fetchall()
+    for r in rows:
+        if r["status"] == "queued" and r["id"] in _queued_here:
+            return _row_to_job(r)
+        if r["status"] == "running":
+            if is_locked():
+                return _row_to_job(r)
+            # Running jobs always hold the lock, so this one's process died mid-run.
+            with conn:
+                conn.execute("UPDATE jobs SET status = 'failed', error = 'interrupted', finished_at = ? WHERE id = ?", (_now(), r["id"]))
+    return None
+
+
+# — Submit and execute
+
+
+def submit(kind: str, params: dict | None = None) -> tuple[dict, bool]:
+    """
+    Queue a job of `kind` (see JOB_KINDS; unknown kinds run the full pipeline). Returns (job, created);
+    created is False when an active full_pipeline job was returned instead of queueing a new one.
+    """
+    kind = kind if kind in JOB_KINDS else "full_pipeline"
+    with _submit_lock:
+        conn = _connect()
+        try:
+            if kind == "full_pipeline":
+                active = _active_pipeline(conn)
+                if active is not None:
+                    return active, False
+            job_id = uuid.uuid4().hex
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, params, status, stages, created_at) VALUES (?, ?, ?, 'queued', '{}', ?)",
+                    (job_id, kind, json.dumps(params or {}), _now()),
+                )
+            _queued_here.add(job_id)
+            job = _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        finally:
+            conn.close()
+    _executor().submit(_execute, job_id)
+    return job, True
+
+
+def _execute(job_id: str) -> None:
+    """Worker: run one job (under the single-flight lock unless LOCK_FREE), recording stage progress and the exit code."""
+    job = get_job(job_id)
+    stages = {}
+
+    def on_stage(stage: str, status: str, **info) -> None:
+        entry = stages.setdefault(stage, {})
+        if status == "running" and "started_at" not in entry:
+            entry["started_at"] = _now()
+        if status in ("done", "failed", "skipped"):
+            entry["finished_at"] = _now()
+        entry["status"] = status
+        entry.update(info)
+        _update(job_id, stages=stages)
+
+    rec = None
+
+    def fail(e: Exception) -> None:
+        for entry in stages.values():
+            if entry.get("status") == "running":
+                entry["status"] = "failed"
+        failed = {"status": "failed", "error": str(e) or type(e).__name__, "stages": stages, "finished_at": _now()}
+        if rec is not None:
+            failed["metrics"] = rec.to_dict()["stages"]
+        _update(job_id, **failed)
+
+    try:
+        with single_flight() if job["kind"] not in LOCK_FREE else nullcontext():
+            # The final status is written while the lock is still held: a running job without a lock holder is
+            # taken for one whose process died (_active_pipeline).
+            _queued_here.discard(job_id)
+            _update(job_id, status="running", started_at=_now())
+            try:
+                with metrics.recording(job["kind"], job_id) as rec:
+                    rec.exit_code = code = _run(job, on_stage, rec)
+                _update(job_id, status="succeeded" if code == 0 else "failed", exit_code=code, finished_at=_now(), metrics=rec.to_dict()["stages"])
+            except Exception as e:
+                fail(e)
+    except Exception as e:
+        fail(e)
+    finally:
+        _queued_here.discard(job_id)
+
+
+def _run(job: dict, on_stage, rec) -> int:
+    kind = job["kind"]
+    if kind == "full_pipeline":
+        from tools import pipeline
+        p = job["params"]
+        return pipeline.run(
+            checkpoint=p.get("checkpoint"), incremental=p.get("incremental"),
+            full_rebuild=bool(p.get("full_rebuild")), on_stage=on_stage,
+        )
+    if kind == "backfill":
+        from tools import backfill
+        p = job["params"]
+        return backfill.backfill(p.get("start", ""), p.get("end", ""), p.get("slice"), p.get("workers"), on_stage=on_stage)
+    if kind == "preview":
+        from tools import preview
+        p = job["params"]
+        on_stage("preview", "running")
+        out = preview.preview(p.get("sample"), p.get("stratify"), p.get("confidence"), p.get("seed", 0))
+        on_stage("preview", "failed" if out is None else "done", **({"sample_size": out["sample_size"]} if out else {}))
+        return 0 if out is not None else 1
+    from tools import ingest_data, clean_data, analyze, generate_report, send_payload
+    tool = {
+        "ingest_data": ingest_data.ingest,
+        "clean_data": clean_data.clean,
+        "analyze": analyze.analyze,
+        "generate_report": generate_report.generate_report,
+        "send_payload": send_payload.send_payload,
+    }[kind]
+    from tools.pipeline import stage_outputs
+    stage = JOB_KINDS[kind]
+    on_stage(stage, "running")
+    with rec.measure(stage):
+        code = tool()
+    rec.written_since_start(stage, stage_outputs(stage))
+    on_stage(stage, "failed" if code else "done")
+    return code
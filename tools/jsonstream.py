@@ -0,0 +1,177 @@
+"""
+Streaming JSON reader/writer for record-level intermediates (.tmp/raw_input.json, .tmp/cleaned_data.json)
+and large JSON sources. Records are written one per line as they pass through and read back one at a
+time, so no stage holds the whole dataset to serialize or parse it.
+Output goes to a .part file and is renamed into place only when the stream completes.
+"""
+
+import json
+import os
+from pathlib import Path
+
+_BUFFER_SIZE = 1 << 20
+
+
+def tee_records(path: Path, head: dict, records, tail=None):
+    """
+    Yield each record from `records` while writing {**head, "records": [...], **tail()} to `path`.
+    `tail` is a callable evaluated after the last record (for counts only known at the end).
+    If the consumer stops early or raises, the partial file is removed.
+    """
+    path = Path(path)
+    part = path.with_name(path.name + ".part")
+    done = False
+    f = open(part, "w", encoding="utf-8", buffering=_BUFFER_SIZE)
+    try:
+        f.write("{")
+        for k, v in head.items():
+            f.write(f"{json.dumps(k)}: {json.dumps(v)}, ")
+        f.write('"records": [')
+        sep = "\n"
+        for rec in records:
+            f.write(sep)
+            f.write(json.dumps(rec))
+            sep = ",\n"
+            yield rec
+        f.write("\n]")
+        for k, v in (tail() if tail else {}).items():
+            f.write(f", {json.dumps(k)}: {json.dumps(v)}")
+        f.write("}\n")
+        f.close()
+        os.replace(part, path)
+        done = True
+    finally:
+        if not done:
+            f.close()
+            part.unlink(missing_ok=True)
+
+
+def write_records(path: Path, head: dict, records, tail=None) -> int:
+    """Write a record stream to `path` (see tee_records). Returns the number of records written."""
+    n = 0
+    for _ in tee_records(path, head, records, tail):
+        n += 1
+    return n
+
+
+# — Streaming reader
+
+CHUNK_SIZE = 1 << 16
+_WS = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Incremental JSON tokenizer over an iterator of text chunks. Holds at most one value plus one chunk."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        for chunk in self._chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ("" at end of input)."""
+        while True:
+            buf, pos, n = self.buf, self.pos, len(self.buf)
+            while pos < n and buf[pos] in _WS:
+                pos += 1
+            self.pos = pos
+            if pos < n:
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        if self.peek() != ch:
+            raise ValueError(f"Malformed JSON: expected {ch!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number or literal ending exactly at the buffer edge may continue in the next chunk.
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return val
+
+    def next_member(self, close: str) -> bool:
+        """Consume "," (True: another member follows) or the closing bracket (False)."""
+        ch = self.peek()
+        if ch == ",":
+            self.pos += 1
+            return True
+        if ch == close:
+            self.pos += 1
+            return False
+        raise ValueError(f"Malformed JSON: expected ',' or {close!r}")
+
+
+def _iter_array(r: _Reader):
+    r.expect("[")
+    if r.peek() == "]":
+        r.pos += 1
+        return
+    while True:
+        yield r.value()
+        if not r.next_member("]"):
+            return
+
+
+def _iter_records_then_members(r: _Reader, header: dict):
+    yield from _iter_array(r)
+    while r.next_member("}"):
+        key = r.value()
+        r.expect(":")
+        header[key] = r.value()
+
+
+def open_records(chunks) -> tuple[dict, object]:
+    """
+    Parse a top-level JSON array, or an object with a "records" array, from an iterator of text chunks.
+    Returns (header, records): header holds the object's other members (members after "records"
+    are added once the records iterator is exhausted); records yields array elements one at a time.
+    """
+    r = _Reader(chunks)
+    header = {}
+    ch = r.peek()
+    if ch == "[":
+        return header, _iter_array(r)
+    r.expect("{")
+    if r.peek() == "}":
+        return header, iter(())
+    while True:
+        key = r.value()
+        r.expect(":")
+        if key == "records" and r.peek() == "[":
+            return header, _iter_records_then_members(r, header)
+        header[key] = r.value()
+        if not r.next_member("}"):
+            return header, iter(())
+
+
+def read_chunks(path: Path, size: int = CHUNK_SIZE):
+    """Yield text chunks of a UTF-8 file; the file is closed when the generator finishes."""
+    with open(path, "r", encoding="utf-8") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+def open_records_file(path: Path) -> tuple[dict, object]:
+    """open_records() over a file on disk."""
+    return open_records(read_chunks(path))
@@ -0,0 +1,356 @@
+"""
+Per-stage pipeline metrics: wall time, CPU time, records in and out, bytes read and written, and peak memory for
+every stage of a run (a pipeline.run() or a single-tool job). Tools report what only they know (bytes of a source,
+record counts) with note(); it does nothing outside a recorded run, so the CLIs are unaffected.
+Finished runs go into an in-process ring buffer of the last PIPELINE_METRICS_RUNS runs (default 50) and into
+cumulative per-stage counters; render_prometheus() formats both for /metrics, and jobs.py stores each job's stage
+metrics with the job for /api/jobs.
+CPU time is the running thread's (time.thread_time), so other requests served by the same process are not
+counted; neither is work in INGEST_WORKERS / ANALYZE_WORKERS process pools or pagination prefetch threads.
+The run being recorded is per thread (a context variable), so runs in concurrent threads (a job and a preview
+request) never share one; tools hand it to their own worker threads with in_run().
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Optional: peak RSS fallback via getrusage where /proc is unavailable (non-Linux).
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FIELDS = ("wall_seconds", "cpu_seconds", "records_in", "records_out", "bytes_read", "bytes_written", "peak_rss_bytes")
+COUNTERS = FIELDS[:-1]  # summed across runs; peak_rss_bytes is only reported per run
+DEFAULT_RUNS = 50
+_SAMPLE_EVERY = 4096  # items between RSS samples in timed record streams
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_lock = threading.Lock()
+_active = contextvars.ContextVar("metrics_run", default=None)
+_recent = None
+_totals = {}  # stage → {field: sum}
+_runs_total = {}  # (kind, status) → count
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _max_runs() -> int:
+    try:
+        return max(1, int(os.environ.get("PIPELINE_METRICS_RUNS", DEFAULT_RUNS) or DEFAULT_RUNS))
+    except ValueError:
+        return DEFAULT_RUNS
+
+
+def rss_bytes() -> int | None:
+    """Current resident set size (Linux /proc), else the process's peak so far (getrusage), else None."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+class _Timed:
+    """
+    Iterator wrapper that counts items into a stage field and, with timing on, adds the wall and CPU time spent
+    producing them (inclusive of everything upstream) to that stage. RSS is sampled every `sample_every` items.
+    """
+
+    def __init__(self, run: "RunMetrics", iterable, stage: str, fields: tuple, size, timing: bool, sample_every: int):
+        self.run, self.it, self.stage, self.fields, self.size = run, iter(iterable), stage, fields, size
+        self.timing, self.sample_every = timing, sample_every
+        self.wall = self.cpu = 0.0
+        self.n = self.calls = 0
+        self.peak = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.timing:
+            w, c = time.perf_counter(), time.thread_time()
+            try:
+                item = next(self.it)
+            finally:
+                self.wall += time.perf_counter() - w
+                self.cpu += time.thread_time() - c
+        else:
+            item = next(self.it)
+        self.n += self.size(item) if self.size else 1
+        self.calls += 1
+        if self.calls % self.sample_every == 0:
+            self.peak = _max(self.peak, rss_bytes())
+        return item
+
+    def settle(self) -> None:
+        """Move the totals so far into the run's stage entry."""
+        self.run.add(self.stage, **{f: self.n for f in self.fields}, **({"wall_seconds": self.wall, "cpu_seconds": self.cpu} if self.timing else {}))
+        self.run.add(self.stage, peak_rss_bytes=self.peak)
+        self.wall = self.cpu = 0.0
+        self.n = 0
+
+
+class RunMetrics:
+    """Stage metrics of one run; see recording()."""
+
+    def __init__(self, kind: str, run_id: str | None = None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.kind = kind
+        self.started_at = _now()
+        self.started_ns = time.time_ns()
+        self.exit_code = None
+        self.stages = {}
+        self._timers = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def entry(self, stage: str) -> dict:
+        with self._lock:
+            return self.stages.setdefault(stage, {f: (None if f == "peak_rss_bytes" else 0) for f in FIELDS})
+
+    def add(self, stage: str, **values) -> None:
+        """Add to a stage's fields (peak_rss_bytes keeps the maximum; None values are ignored). Thread-safe."""
+        entry = self.entry(stage)
+        with self._lock:
+            for k, v in values.items():
+                if v is None:
+                    continue
+                entry[k] = _max(entry[k], v) if k == "peak_rss_bytes" else entry[k] + v
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Add the wall and CPU time of the block to `stage`, with RSS sampled at both ends."""
+        self.add(stage, peak_rss_bytes=rss_bytes())
+        w, c = time.perf_counter(), time.thread_time()
+        try:
+            yield self
+        finally:
+            self.add(stage, wall_seconds=time.perf_counter() - w, cpu_seconds=time.thread_time() - c, peak_rss_bytes=rss_bytes())
+
+    def timed(self, iterable, stage: str, fields: tuple = ("records_out",), size=None, timing: bool = True, sample_every: int = _SAMPLE_EVERY):
+        """
+        Wrap an iterator so its items are counted into each of stage[fields] (size(item) each, default 1) and, with timing,
+        the time spent inside it is added to `stage`. Wrappers nest: a downstream stage's time includes its
+        upstream's until exclusive() subtracts it.
+        """
+        timer = _Timed(self, iterable, stage, fields, size, timing, sample_every)
+        self._timers.append(timer)
+        return timer
+
+    def settle(self) -> None:
+        for timer in self._timers:
+            timer.settle()
+
+    def exclusive(self, outer: str, inner: str) -> None:
+        """Subtract `inner`'s time from `outer`'s, for an outer stage that pulled from the inner one."""
+        self.settle()
+        o, i = self.entry(outer), self.entry(inner)
+        with self._lock:
+            for k in ("wall_seconds", "cpu_seconds"):
+                o[k] = max(0.0, o[k] - i[k])
+
+    def written_since_start(self, stage: str, paths) -> None:
+        """Add the sizes of the files in `paths` that this run created or rewrote to stage.bytes_written."""
+        total = 0
+        for p in paths:
+            try:
+                st = Path(p).stat()
+            except OSError:
+                continue
+            if st.st_mtime_ns >= self.started_ns:
+                total += st.st_size
+        self.add(stage, bytes_written=total)
+
+    def to_dict(self) -> dict:
+        self.settle()
+        with self._lock:
+            stages = {name: {k: (round(v, 6) if isinstance(v, float) else v) for k, v in entry.items()} for name, entry in self.stages.items()}
+        return {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "exit_code": self.exit_code,
+            "status": "succeeded" if self.exit_code == 0 else "failed",
+            "stages": stages,
+        }
+
+    def _finish(self) -> dict:
+        self.finished_at = _now()
+        self.wall_seconds = time.perf_counter() - self._t0
+        return self.to_dict()
+
+
+def current() -> RunMetrics | None:
+    """The run being recorded in this thread, if any."""
+    return _active.get()
+
+
+def in_run(fn):
+    """`fn` bound to the current run, for a worker thread whose note() calls belong to it; `fn` itself outside a run."""
+    run = _active.get()
+    if run is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        token = _active.set(run)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _active.reset(token)
+    return bound
+
+
+def note(stage: str, **values) -> None:
+    """Add values to `stage` of the current run (see RunMetrics.add); no-op when nothing is being recorded."""
+    run = _active.get()
+    if run is not None:
+        run.add(stage, **values)
+
+
+def counted(iterable, stage: str, *fields: str):
+    """`iterable`, with its items counted into `fields` of `stage` of the current run (untimed); unchanged outside a run."""
+    run = _active.get()
+    return iterable if run is None else run.timed(iterable, stage, fields, timing=False)
+
+
+@contextmanager
+def recording(kind: str, run_id: str | None = None):
+    """
+    Record a run: yields its RunMetrics and, on exit, stores it in the ring buffer and the counters. Set
+    run.exit_code before leaving the block (an exception leaves it None, counted as failed). Inside an active
+    recording in the same thread this yields the active run instead, so a pipeline started by a job is one run.
+    """
+    active = _active.get()
+    if active is not None:
+        yield active
+        return
+    run = RunMetrics(kind, run_id)
+    token = _active.set(run)
+    try:
+        yield run
+    finally:
+        _active.reset(token)
+        _store(run._finish())
+
+
+def _store(record: dict) -> None:
+    global _recent
+    with _lock:
+        if _recent is None or _recent.maxlen != _max_runs():
+            _recent = deque(_recent or (), maxlen=_max_runs())
+        _recent.append(record)
+        key = (record["kind"], record["status"])
+        _runs_total[key] = _runs_total.get(key, 0) + 1
+        for stage, values in record["stages"].items():
+            totals = _totals.setdefault(stage, {f: 0 for f in COUNTERS})
+            totals["runs"] = totals.get("runs", 0) + 1
+            for f in COUNTERS:
+                totals[f] += values[f] or 0
+
+
+def recent(limit: int | None = None) -> list:
+    """Recorded runs in this process, newest first."""
+    with _lock:
+        runs = list(_recent or ())[::-1]
+    return runs[:limit] if limit else runs
+
+
+def reset() -> None:
+    """Forget the ring buffer and counters (tests)."""
+    global _recent
+    with _lock:
+        _recent = None
+        _totals.clear()
+        _runs_total.clear()
+
+
+# — Prometheus text exposition
+
+
+def _labels(**labels) -> str:
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _value(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(int(v))
+
+
+_COUNTER_HELP = {
+    "wall_seconds": "Wall-clock seconds spent in the stage",
+    "cpu_seconds": "CPU seconds of the running thread spent in the stage",
+    "records_in": "Records read by the stage",
+    "records_out": "Records produced by the stage",
+    "bytes_read": "Bytes the stage read from sources or files",
+    "bytes_written": "Bytes of files the stage wrote (plus webhook bodies for deliver)",
+}
+
+
+def render_prometheus() -> str:
+    """Counters since process start and gauges of the latest run, in Prometheus text format 0.0.4."""
+    with _lock:
+        runs_total = dict(_runs_total)
+        totals = {s: dict(v) for s, v in _totals.items()}
+        last = _recent[-1] if _recent else None
+        buffered = len(_recent or ())
+    out = [
+        "# HELP pipeline_runs_total Pipeline runs recorded by this process.",
+        "# TYPE pipeline_runs_total counter",
+    ]
+    out += [f"pipeline_runs_total{_labels(kind=k, status=s)} {n}" for (k, s), n in sorted(runs_total.items())]
+    out += [
+        "# HELP pipeline_stage_runs_total Runs in which the stage ran.",
+        "# TYPE pipeline_stage_runs_total counter",
+    ]
+    out += [f"pipeline_stage_runs_total{_labels(stage=s)} {totals[s]['runs']}" for s in sorted(totals)]
+    for f in COUNTERS:
+        name = f"pipeline_stage_{f}_total"
+        out += [f"# HELP {name} {_COUNTER_HELP[f]}, summed over runs.", f"# TYPE {name} counter"]
+        out += [f"{name}{_labels(stage=s)} {_value(totals[s][f])}" for s in sorted(totals)]
+    out += [
+        "# HELP pipeline_metrics_runs_buffered Runs held in the recent-runs ring buffer.",
+        "# TYPE pipeline_metrics_runs_buffered gauge",
+        f"pipeline_metrics_runs_buffered {buffered}",
+    ]
+    if last is not None:
+        finished = datetime.fromisoformat(last["finished_at"]).timestamp()
+        out += [
+            "# HELP pipeline_last_run_timestamp_seconds When the latest recorded run finished (Unix time).",
+            "# TYPE pipeline_last_run_timestamp_seconds gauge",
+            f"pipeline_last_run_timestamp_seconds{_labels(kind=last['kind'])} {finished!r}",
+            "# HELP pipeline_last_run_exit_code Exit code of the latest recorded run (-1 if it raised).",
+            "# TYPE pipeline_last_run_exit_code gauge",
+            f"pipeline_last_run_exit_code{_labels(kind=last['kind'])} {last['exit_code'] if last['exit_code'] is not None else -1}",
+            "# HELP pipeline_last_run_wall_seconds Wall-clock seconds of the latest recorded run.",
+            "# TYPE pipeline_last_run_wall_seconds gauge",
+            f"pipeline_last_run_wall_seconds{_labels(kind=last['kind'])} {last['wall_seconds']!r}",
+        ]
+        for f in FIELDS:
+            name = f"pipeline_stage_last_{f}"
+            out += [f"# HELP {name} {f} of the stage in the latest recorded run.", f"# TYPE {name} gauge"]
+            out += [f"{name}{_labels(stage=s)} {_value(v[f])}" for s, v in sorted(last["stages"].items()) if v[f] is not None]
+    return "\n".join(out) + "\n"
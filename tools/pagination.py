@@ -0,0 +1,223 @@
+"""
+Paginated URL sources for ingest_data (DATA_SOURCE_PAGINATION): REST APIs that return records a page at a time.
+Modes: "next" follows a next-page URL (the Link rel="next" header, else a body field), "cursor" resends the first
+URL with a cursor taken from the body, "page" requests page=1, 2, ... until an empty page.
+Each feed is fetched by a background thread that keeps up to INGEST_PREFETCH_PAGES parsed pages ready, so the
+next page downloads while the current one is cleaned and analyzed. Requests share one concurrency cap
+(INGEST_FETCH_CONCURRENCY) and one rate cap (INGEST_MAX_RPS) across all feeds, over pooled keep-alive connections.
+"""
+
+import json
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.parse import urljoin
+
+from tools import http_pool, metrics
+
+MODES = ("none", "next", "cursor", "page")
+DEFAULT_PREFETCH_PAGES = 2
+_LINK_NEXT = re.compile(r'<([^>]*)>[^,]*;\s*rel="?([^",]*\s)?next[\s"]', re.IGNORECASE)
+_DONE = object()
+
+
+def mode() -> str:
+    """DATA_SOURCE_PAGINATION: "none" (default), "next", "cursor" or "page"."""
+    value = (os.environ.get("DATA_SOURCE_PAGINATION") or "none").strip().lower()
+    return value if value in MODES else "none"
+
+
+def _prefetch_pages() -> int:
+    try:
+        return max(1, int(os.environ.get("INGEST_PREFETCH_PAGES", DEFAULT_PREFETCH_PAGES) or DEFAULT_PREFETCH_PAGES))
+    except ValueError:
+        return DEFAULT_PREFETCH_PAGES
+
+
+def _max_rps() -> float:
+    try:
+        return max(0.0, float(os.environ.get("INGEST_MAX_RPS", "0") or "0"))
+    except ValueError:
+        return 0.0
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart across threads; rate <= 0 means unlimited."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def _dig(obj, path: str):
+    """Value at a dotted path ("paging.next") in nested dicts, or None."""
+    for part in path.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(part)
+    return obj
+
+
+def link_next(header: str | None) -> str | None:
+    """The rel="next" target of an RFC 8288 Link header, or None."""
+    m = _LINK_NEXT.search(header or "")
+    return m.group(1) if m else None
+
+
+def parse_page(body: bytes, link: str | None, records_field: str, next_field: str) -> tuple[list, object]:
+    """
+    (records, next) for one page: a JSON array, or an object with the records at `records_field`.
+    next is the Link header's rel="next" target, else the value at `next_field` (None on the last page).
+    Raises ValueError if the page has no record list.
+    """
+    data = json.loads(body)
+    if isinstance(data, list):
+        return data, link_next(link)
+    records = _dig(data, records_field)
+    if not isinstance(records, list):
+        raise ValueError(f"page has no {records_field!r} list")
+    return records, link_next(link) or _dig(data, next_field)
+
+
+class _Feed:
+    """One paginated feed: a producer thread filling a bounded queue of pages (lists of records)."""
+
+    def __init__(self, url: str, pager: "Pager"):
+        self.url = url
+        self.pager = pager
+        self.pages = queue.Queue(maxsize=pager.prefetch)
+        self._first = None
+        self.thread = threading.Thread(target=metrics.in_run(self._produce), name="page-feed", daemon=True)
+
+    def _put(self, item) -> bool:
+        while not self.pager.stopped.is_set():
+            try:
+                self.pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self) -> None:
+        try:
+            pages = self.pager.numbered(self.url) if self.pager.mode == "page" else self.pager.linked(self.url)
+            for records in pages:
+                if not self._put(records):
+                    pages.close()
+                    return
+            self._put(_DONE)
+        except Exception as e:
+            self._put(e)
+
+    def first(self):
+        """Block until the first page (or the error that prevented it) is available, without consuming it."""
+        if self._first is None:
+            self._first = self.pages.get()
+        return self._first
+
+    def __iter__(self):
+        item, self._first = self.first(), None
+        while item is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+            item = self.pages.get()
+
+
+class Pager:
+    """
+    Shared settings and limits for the feeds of one ingest: a semaphore of `concurrency` in-flight requests,
+    a RateLimiter of `max_rps`, and `prefetch` pages buffered (or requested ahead, in "page" mode) per feed.
+    """
+
+    def __init__(self, mode: str, concurrency: int, timeout: float, prefetch: int | None = None, max_rps: float | None = None):
+        self.mode = mode
+        self.timeout = timeout
+        self.prefetch = prefetch or _prefetch_pages()
+        self.records_field = (os.environ.get("DATA_SOURCE_RECORDS_FIELD") or "records").strip()
+        self.next_field = (os.environ.get("DATA_SOURCE_NEXT_FIELD") or "next").strip()
+        self.cursor_param = (os.environ.get("DATA_SOURCE_CURSOR_PARAM") or "cursor").strip()
+        self.page_param = (os.environ.get("DATA_SOURCE_PAGE_PARAM") or "page").strip()
+        self.slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.limiter = RateLimiter(_max_rps() if max_rps is None else max_rps)
+        self.stopped = threading.Event()
+
+    def get(self, url: str) -> tuple[list, object]:
+        """Fetch and parse one page within the concurrency and rate caps. Raises HTTPError/URLError/TimeoutError."""
+        with self.slots:
+            self.limiter.wait()
+            with http_pool.default_pool().open(url, {"Accept": "application/json"}, self.timeout) as (resp, reader):
+                body = reader.read_all()
+                link = resp.getheader("Link")
+        metrics.note("ingest", bytes_read=len(body))
+        try:
+            return parse_page(body, link, self.records_field, self.next_field)
+        except ValueError as e:
+            raise URLError(f"invalid page {url}: {e}")
+
+    def linked(self, url: str):
+        """Pages of a "next" or "cursor" feed, one request at a time (each page names the next)."""
+        seen = set()
+        current = url
+        while current is not None:
+            records, nxt = self.get(current)
+            yield records
+            if nxt in (None, "") or self.stopped.is_set():
+                return
+            if nxt in seen:
+                raise URLError(f"pagination loop at {current}: next {nxt!r} was already requested")
+            seen.add(nxt)
+            current = urljoin(current, str(nxt)) if self.mode == "next" else http_pool.with_query(url, {self.cursor_param: nxt})
+
+    def numbered(self, url: str):
+        """Pages of a "page" feed, `prefetch` requests ahead, in order, up to the first empty page."""
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="page") as pool:
+            pending = []
+            n = 1
+            try:
+                while True:
+                    while len(pending) < self.prefetch:
+                        pending.append(pool.submit(metrics.in_run(self.get), http_pool.with_query(url, {self.page_param: n})))
+                        n += 1
+                    records, _ = pending.pop(0).result()
+                    if not records:
+                        return
+                    yield records
+            finally:
+                for fut in pending:
+                    fut.cancel()  # pages past the end may fail (404); their results are never read
+
+    def open(self, urls: list) -> list:
+        """Start a producer per feed; returns the _Feed objects in the given order."""
+        feeds = [_Feed(u, self) for u in urls]
+        for f in feeds:
+            f.thread.start()
+        return feeds
+
+    def close(self) -> None:
+        """Stop the producers (an abandoned ingest must not keep fetching pages)."""
+        self.stopped.set()
+
+
+def iter_feeds(pager: Pager, feeds: list):
+    """Records of every feed, in feed order then page order; stops the producers when done or abandoned."""
+    try:
+        for f in feeds:
+            yield from f
+    finally:
+        pager.close()
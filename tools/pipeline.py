@@ -0,0 +1,371 @@
+"""
+Run the full pipeline in one process: ingest → clean → analyze → report → send_payload.
+Stages hand records to each other as iterators; raw_input.json and cleaned_data.col/.json are written
+only when checkpointing is on (PIPELINE_CHECKPOINT=1). analytics_result.json and report_output.json
+are always written. The per-tool CLIs remain the file-based path.
+Every run persists a watermark and the aggregate partial state in .tmp/pipeline_state.json; incremental runs
+(PIPELINE_INCREMENTAL=1) ingest only records past the watermark and fold them into that state.
+Checkpointed runs also record a manifest per stage in .tmp/manifests/<stage>.json (input hash, output hash,
+tool version). A stage whose input hash and tool version match its manifest, and whose outputs are untouched,
+is skipped and its files reused, so a failed run resumes at the first stage that did not complete.
+Each run records per-stage metrics (tools/metrics.py); in the streamed part, stage times are split by timing the
+record iterators between stages.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from itertools import chain
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+
+# Allow running as a script (python tools/pipeline.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import ingest_data, clean_data, analyze, generate_report, send_payload, metrics, pagination, query, render, rollup, sketches, validation
+from tools.columnar import open_columns
+from tools.jsonstream import open_records_file, tee_records
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+STATE_FILE = TMP_DIR / "pipeline_state.json"
+MANIFEST_DIR = TMP_DIR / "manifests"
+STAGES = ("ingest", "clean", "analyze", "report", "deliver")
+STAGE_TOOLS = {"ingest": ingest_data, "clean": clean_data, "analyze": analyze, "report": generate_report, "deliver": send_payload}
+# Helper modules whose code also shapes a stage's output; they are hashed into its tool version.
+STAGE_HELPERS = {"ingest": (pagination,), "clean": (validation,), "analyze": (rollup, sketches), "report": (render,)}
+_HASH_CHUNK = 1 << 20
+_PROGRESS_EVERY = 50_000
+
+
+def _env_flag(name: str) -> bool:
+    return (os.environ.get(name) or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def load_state() -> dict | None:
+    """Stored watermark + aggregate partial state, or None if missing or unreadable."""
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state: dict) -> None:
+    """Write the state atomically so the watermark and the aggregate it covers never disagree."""
+    part = STATE_FILE.with_name(STATE_FILE.name + ".part")
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(part, STATE_FILE)
+
+
+# — Stage manifests
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_parts(*parts) -> str:
+    """SHA-256 of the JSON encoding of `parts` (anything not JSON-native is hashed by its str())."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def tool_version(stage: str) -> str:
+    """Schema version plus a content hash of the stage's tool module and helpers, so editing them invalidates its outputs."""
+    module = STAGE_TOOLS[stage]
+    digest = hash_parts([hash_file(Path(m.__file__)) for m in (module, *STAGE_HELPERS.get(stage, ()))])
+    return f"{getattr(module, 'SCHEMA_VERSION', '-')}+{digest[:12]}"
+
+
+def stage_outputs(stage: str) -> list:
+    """Files a stage writes in a checkpointed run; the ones that exist make up its output hash."""
+    if stage == "ingest":
+        return [ingest_data.OUTPUT_FILE]
+    if stage == "clean":
+        return [clean_data.COLUMNS_FILE, clean_data.OUTPUT_FILE]
+    if stage == "analyze":
+        return [analyze.OUTPUT_FILE, STATE_FILE, rollup.ROLLUP_DB]
+    if stage == "report":
+        return [generate_report.OUTPUT_FILE, *render.output_files()]
+    return [send_payload.SUMMARY_FILE]
+
+
+def _fingerprints(stage: str) -> dict:
+    """Size and mtime of each existing output; a cheap check that nothing rewrote them since the manifest."""
+    out = {}
+    for p in stage_outputs(stage):
+        if p.is_file():
+            st = p.stat()
+            out[p.name] = [st.st_size, st.st_mtime_ns]
+    return out
+
+
+def load_manifest(stage: str) -> dict | None:
+    try:
+        with open(MANIFEST_DIR / f"{stage}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(stage: str, input_hash: str | None, **extra) -> dict:
+    """Record a completed stage: its input hash, the content hash of its outputs, the tool version and `extra`."""
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "stage": stage,
+        "input_hash": input_hash,
+        "output_hash": hash_parts([[p.name, hash_file(p)] for p in stage_outputs(stage) if p.is_file()]),
+        "tool_version": tool_version(stage),
+        "outputs": _fingerprints(stage),
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+        **extra,
+    }
+    part = MANIFEST_DIR / f"{stage}.json.part"
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(part, MANIFEST_DIR / f"{stage}.json")
+    return manifest
+
+
+def _fresh_manifest(stage: str, input_hash: str | None) -> dict | None:
+    """The stage's manifest if it can be reused for `input_hash`, else None."""
+    if input_hash is None:
+        return None
+    m = load_manifest(stage)
+    if not m or m.get("input_hash") != input_hash or m.get("tool_version") != tool_version(stage):
+        return None
+    if not m.get("outputs") or m["outputs"] != _fingerprints(stage):
+        return None
+    return m
+
+
+def _source_hash(ctx: dict) -> str | None:
+    """
+    Content hash of the source: DATA_SOURCE_PATH's bytes, or the cached bodies of the URL sources after a
+    conditional GET (kept in ctx["fetched"] so ingest does not request them again). None if it cannot be known
+    (including paginated sources, so they always run).
+    """
+    path = os.environ.get("DATA_SOURCE_PATH", "").strip()
+    if path:
+        return hash_file(Path(path)) if Path(path).is_file() else None
+    urls = ingest_data.source_urls()
+    if urls and pagination.mode() != "none":
+        return None  # a paginated feed's content is only known by reading every page
+    if urls:
+        ctx["fetched"] = ingest_data.fetch_sources(ingest_data.request_urls(urls, ctx["since"]))
+        if any(entry is None for _, entry, _ in ctx["fetched"]):
+            return None
+        return hash_parts([entry["sha256"] for _, entry, _ in ctx["fetched"]])
+    return "none"
+
+
+def _stage_input(stage: str, upstream: str | None, ctx: dict) -> str | None:
+    """Input hash of a stage: the upstream output hash plus the settings that change what the stage writes."""
+    if upstream is None:
+        return None
+    if stage == "ingest":
+        return hash_parts(stage, upstream, os.environ.get("DATA_SOURCE_FORMAT", "json"), ctx["field"], ctx["since_key"])
+    if stage == "clean":
+        return hash_parts(stage, upstream, clean_data.output_format(), clean_data.dedup_key(), validation.rule_settings())
+    if stage == "analyze":
+        return hash_parts(stage, upstream, ctx["incremental"])
+    if stage == "report":
+        return hash_parts(stage, upstream, ctx["title"], ctx["period"], render.report_formats())
+    return hash_parts(stage, upstream, send_payload.webhook_urls())
+
+
+# — Run
+
+
+def run(checkpoint: bool | None = None, title: str = "", period: str = "", incremental: bool | None = None, full_rebuild: bool = False, on_stage=None) -> int:
+    """
+    Run all stages in-process. Returns exit code.
+    checkpoint=None reads PIPELINE_CHECKPOINT; incremental=None reads PIPELINE_INCREMENTAL.
+    full_rebuild=True ignores the stored state and the stage manifests and recomputes from the whole source.
+    on_stage(stage, status, **info) is called as stages progress: status "skipped", "running" (again every
+    50k records with records=<count> while records stream), "done" or "failed".
+    Stage metrics are recorded under the active metrics run (a job's) or a new "full_pipeline" run.
+    """
+    with metrics.recording("full_pipeline") as rec:
+        rec.exit_code = _run(rec, checkpoint, title, period, incremental, full_rebuild, on_stage)
+        for stage in STAGES:
+            if stage in rec.stages:
+                rec.written_since_start(stage, stage_outputs(stage))
+        return rec.exit_code
+
+
+def _run(rec, checkpoint, title, period, incremental, full_rebuild, on_stage) -> int:
+    notify = on_stage or (lambda stage, status, **info: None)
+    if checkpoint is None:
+        checkpoint = _env_flag("PIPELINE_CHECKPOINT")
+    if incremental is None:
+        incremental = _env_flag("PIPELINE_INCREMENTAL")
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+
+    field = ingest_data.watermark_field()
+    state = load_state() if incremental and not full_rebuild else None
+    if state is not None and state.get("watermark", {}).get("field") != field:
+        state = None  # watermark field changed: the stored aggregate cannot be extended safely
+    if state is not None and "ids_hll" not in state.get("partial", {}):
+        state = None  # stored before the partial state carried sketches; rebuilding is the only way to fill them
+    since = state["watermark"]["value"] if state else None
+    ctx = {"field": field, "state": state, "since": since, "since_key": since,
+           "incremental": bool(incremental), "title": title, "period": period, "notify": notify}
+    if state is not None and state.get("folded") and state["folded"] == (load_manifest("clean") or {}).get("output_hash"):
+        # The state already includes the checkpointed records, so the ingest that produced them is still current.
+        ctx["since_key"] = state.get("since")
+
+    # Walk the manifests to the first stage that has to run; everything before it is reused as-is.
+    first, upstream = 0, None
+    if checkpoint:
+        upstream = _source_hash(ctx)
+        if not full_rebuild:
+            for first, stage in enumerate(STAGES):
+                fresh = _fresh_manifest(stage, _stage_input(stage, upstream, ctx))
+                if fresh is None:
+                    break
+                notify(stage, "skipped")
+                upstream = fresh["output_hash"]
+            else:
+                return 0
+    ctx["upstream"] = upstream
+
+    if first <= STAGES.index("analyze"):
+        streamed = STAGES[first:STAGES.index("analyze") + 1]
+        for stage in streamed:
+            notify(stage, "running")
+        try:
+            result = _run_records(STAGES[first], checkpoint, ctx, rec)
+        except (HTTPError, URLError, TimeoutError) as e:
+            print(f"Paginated source failed mid-stream: {e}", file=sys.stderr)
+            result = None
+        for stage in streamed:
+            notify(stage, "failed" if result is None else "done")
+        if result is None:
+            return 1
+        if checkpoint and first <= STAGES.index("clean"):
+            query.refresh_in_background()
+    else:
+        with open(analyze.OUTPUT_FILE, "r", encoding="utf-8") as f:
+            result = json.load(f)
+
+    if first <= STAGES.index("report"):
+        notify("report", "running")
+        with rec.measure("report"):
+            report = generate_report.build_report(result, title=title, period=period)
+            generate_report.write_report(report)
+            render.render_all(result, report)
+            if checkpoint:
+                _complete("report", ctx)
+        notify("report", "done")
+    else:
+        with open(generate_report.OUTPUT_FILE, "r", encoding="utf-8") as f:
+            report = json.load(f)
+
+    notify("deliver", "running")
+    with rec.measure("deliver"):
+        code = send_payload.deliver(report)
+        if code == 0 and checkpoint:
+            _complete("deliver", ctx)
+    notify("deliver", "failed" if code else "done")
+    return code
+
+
+def _counted(records, stage: str, notify):
+    """Pass records through, reporting the running count every _PROGRESS_EVERY records."""
+    n = 0
+    for r in records:
+        n += 1
+        if n % _PROGRESS_EVERY == 0:
+            notify(stage, "running", records=n)
+        yield r
+
+
+def _complete(stage: str, ctx: dict, **extra) -> None:
+    """Write the stage's manifest and make its output hash the next stage's upstream."""
+    ctx["upstream"] = save_manifest(stage, _stage_input(stage, ctx["upstream"], ctx), **extra)["output_hash"]
+
+
+def _run_records(start: str, checkpoint: bool, ctx: dict, rec) -> dict | None:
+    """
+    Run the record-level stages from `start` ("ingest", "clean" or "analyze") through analyze as one stream,
+    reading the checkpoint file of the stage before `start`. Returns the Analytics Result, or None on failure.
+    Stage metrics go to `rec`: the whole stream is timed as analyze, the cleaned and raw record iterators as clean
+    and ingest, and each stage's time is then made exclusive of the one it pulled from.
+    """
+    state = ctx["state"]
+    rollups = rollup.RollupBuilder()
+    since, mark = ctx["since"], {"value": ctx["since"]}
+    if start != "ingest":
+        ingested = load_manifest("ingest") or {}
+        since, mark["value"] = ingested.get("since"), ingested.get("watermark")
+    if start == "ingest":
+        opened = ingest_data.read_batches(since=ctx["since"], mark=mark, fetched=ctx.get("fetched"))
+        if opened is None:
+            return None
+        head, batches = opened
+        head, records, tail = ingest_data.raw_parts({**head, "records": chain.from_iterable(batches)})
+        if checkpoint:
+            records = tee_records(ingest_data.OUTPUT_FILE, head, records, tail)
+        records = rec.timed(records, "ingest")
+    elif start == "clean":
+        metrics.note("clean", bytes_read=ingest_data.OUTPUT_FILE.stat().st_size)
+        _, records = open_records_file(ingest_data.OUTPUT_FILE)
+
+    with rec.measure("analyze"):
+        if start != "analyze":
+            stats = {}
+            cleaned = clean_data.clean_records(_counted(records, start, ctx["notify"]), stats)
+            if checkpoint:
+                cleaned = clean_data.tee_cleaned(cleaned, stats)
+            partial = analyze.partial_from_records(rollups.tee(rec.timed(cleaned, "clean")))
+            rec.add("clean", records_in=sum(stats.get(k, 0) for k in ("record_count", "validation_errors_count", "duplicates_dropped_count")))
+            if checkpoint:
+                if start == "ingest":
+                    _complete("ingest", ctx, since=since, watermark=mark["value"])
+                _complete("clean", ctx)
+        elif state is not None and state.get("folded") == ctx["upstream"]:
+            partial = analyze.empty_partial()  # these cleaned records are already folded into the stored state
+        elif clean_data.COLUMNS_FILE.is_file():
+            metrics.note("analyze", bytes_read=clean_data.COLUMNS_FILE.stat().st_size)
+            cols = open_columns(clean_data.COLUMNS_FILE)
+            partial = analyze.partial_from_columns(cols)
+            rollups.add_columns(cols)
+        else:
+            metrics.note("analyze", bytes_read=clean_data.OUTPUT_FILE.stat().st_size)
+            _, records = open_records_file(clean_data.OUTPUT_FILE)
+            partial = analyze.partial_from_records(rollups.tee(records))
+        rec.add("analyze", records_in=partial["record_count"])
+
+        if state is not None:
+            partial = analyze.merge_partials(state["partial"], partial)
+        rec.add("analyze", records_out=partial["record_count"])
+        result = analyze.finalize(partial)
+        analyze.write_result(result)
+        rollup.write_rollups(rollups, replace=state is None)
+        save_state({
+            "watermark": {"field": ctx["field"], "value": mark["value"]},
+            "since": since,
+            "partial": partial,
+            "folded": ctx["upstream"] if checkpoint else None,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        })
+        if checkpoint:
+            _complete("analyze", ctx)
+    if start != "analyze":
+        rec.exclusive("analyze", "clean")
+    if start == "ingest":
+        rec.exclusive("clean", "ingest")
+        rec.add("ingest", records_in=rec.entry("ingest")["records_out"])
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(run())
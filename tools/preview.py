@@ -0,0 +1,316 @@
+"""
+Sampled preview of the Analytics Result for large sources: one pass over the configured source (ingest_data) keeps
+a uniform reservoir sample of PREVIEW_SAMPLE_SIZE raw records (Algorithm L), optionally split by source
+(post-stratified), and only the sample is validated and de-duplicated (clean_data) and aggregated. Totals, record_count
+and per-source sums are scaled to the population, each with a normal-approximation confidence interval.
+Output: .tmp/analytics_preview.json (Analytics Preview, gemini.md 1.3). Nothing else in .tmp/ is touched and the
+single-flight lock is not taken, so a preview can run while the full pipeline does. The web app runs previews
+as background jobs (tools/jobs.py, kind "preview").
+CLI: python tools/preview.py [--sample N] [--stratify source|none] [--confidence 0.95] [--seed N]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import NormalDist
+
+# Allow running as a script (python tools/preview.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import analyze, clean_data, ingest_data, metrics
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+OUTPUT_FILE = TMP_DIR / "analytics_preview.json"
+SCHEMA_VERSION = "1.0"
+METRICS = analyze.METRICS
+STRATIFY = ("source", "none")
+DEFAULT_SAMPLE = 10_000
+DEFAULT_CONFIDENCE = 0.95
+MAX_SAMPLE = 1_000_000
+MAX_STRATA = 20
+OTHER_STRATUM = "\x00other"
+
+
+def sample_size() -> int:
+    try:
+        return min(MAX_SAMPLE, max(1, int(os.environ.get("PREVIEW_SAMPLE_SIZE", DEFAULT_SAMPLE) or DEFAULT_SAMPLE)))
+    except ValueError:
+        return DEFAULT_SAMPLE
+
+
+def stratify_by() -> str:
+    value = (os.environ.get("PREVIEW_STRATIFY", "source") or "source").strip().lower()
+    return value if value in STRATIFY else "source"
+
+
+def confidence_level() -> float:
+    try:
+        value = float(os.environ.get("PREVIEW_CONFIDENCE", DEFAULT_CONFIDENCE) or DEFAULT_CONFIDENCE)
+    except ValueError:
+        return DEFAULT_CONFIDENCE
+    return value if 0 < value < 1 else DEFAULT_CONFIDENCE
+
+
+# — Sampling
+
+
+class Reservoir:
+    """
+    Uniform sample of at most k items from a stream of unknown length (Li's Algorithm L): after the first k items,
+    it draws how many items to skip before the next replacement, so random numbers are drawn O(k log(n/k)) times, not per item.
+    """
+
+    def __init__(self, k: int, rng: random.Random):
+        self.k = k
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self._w = 1.0
+        self._skip = 0
+
+    def _next_skip(self) -> None:
+        self._w *= math.exp(math.log(1.0 - self.rng.random()) / self.k)
+        self._skip = int(math.log(1.0 - self.rng.random()) / math.log1p(-self._w)) if 0.0 < self._w < 1.0 else 0
+
+    def add(self, item) -> None:
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+            if len(self.items) == self.k:
+                self._next_skip()
+        elif self._skip:
+            self._skip -= 1
+        else:
+            self.items[self.rng.randrange(self.k)] = item
+            self._next_skip()
+
+
+def _stratum(record: dict) -> str:
+    """Source stratum of a raw or cleaned record; cleaning keeps str(source), so both give the same name."""
+    return str(record.get("source", "")).strip() or "unknown"
+
+
+def sample_records(batches, k: int, stratify: str = "source", seed: int = 0) -> dict:
+    """
+    One pass over batches of raw records. Returns {stratum: (population count, sample)}; stratum "" when not
+    stratified. With stratify="source", one reservoir of k samples the whole stream and its records are split by
+    source (the first MAX_STRATA sources are strata, later ones share OTHER_STRATUM), which gives each stratum about
+    its proportional share; each stratum also keeps a reservoir of 2, used when the shared sample holds fewer than 2
+    of its records (2 are needed for a variance). At most k + 2 * (MAX_STRATA + 1) records are held.
+    """
+    rng = random.Random(seed)
+    res = Reservoir(k, rng)
+    if stratify == "none":
+        for batch in batches:
+            for r in batch:
+                res.add(r)
+        return {"": (res.seen, res.items)}
+    strata = {}
+    for batch in batches:
+        for r in batch:
+            key = _stratum(r)
+            small = strata.get(key)
+            if small is None:
+                key = key if len(strata) < MAX_STRATA else OTHER_STRATUM
+                small = strata.get(key) or strata.setdefault(key, Reservoir(2, rng))
+            small.add(r)
+            res.add((key, r))
+    shared = {}
+    for key, r in res.items:
+        shared.setdefault(key, []).append(r)
+    out = {}
+    for key, small in sorted(strata.items()):
+        sample = shared.get(key, [])
+        out[key] = (small.seen, sample if len(sample) >= min(2, small.seen) else small.items)
+    return out
+
+
+def check_args(size: int | None = None, stratify: str | None = None, confidence: float | None = None) -> tuple:
+    """Resolve (size, stratify, confidence) against PREVIEW_* defaults. Raises ValueError on an invalid argument."""
+    size = sample_size() if size is None else size
+    stratify = stratify_by() if stratify is None else stratify
+    confidence = confidence_level() if confidence is None else confidence
+    if not isinstance(size, int) or not 1 <= size <= MAX_SAMPLE:
+        raise ValueError(f"sample must be between 1 and {MAX_SAMPLE}")
+    if stratify not in STRATIFY:
+        raise ValueError(f"stratify must be one of {', '.join(STRATIFY)}")
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    return size, stratify, confidence
+
+
+# — Estimation
+
+
+class _Domain:
+    """Per-stratum sums and sums of squares of one domain's values (a source, or all records), for the estimator."""
+
+    __slots__ = ("sums",)
+
+    def __init__(self):
+        self.sums = {}  # stratum → [sum, sum of squares] per figure (record_count, then METRICS)
+
+    def add(self, stratum: str, values: tuple) -> None:
+        acc = self.sums.get(stratum)
+        if acc is None:
+            acc = self.sums[stratum] = [[0.0, 0.0] for _ in values]
+        for a, v in zip(acc, values):
+            a[0] += v
+            a[1] += v * v
+
+    def merge(self, other: "_Domain") -> None:
+        for stratum, acc in other.sums.items():
+            mine = self.sums.setdefault(stratum, [[0.0, 0.0] for _ in acc])
+            for a, b in zip(mine, acc):
+                a[0] += b[0]
+                a[1] += b[1]
+
+
+def _estimate(domain: _Domain, strata: dict, z: float) -> list:
+    """
+    Stratified expansion estimate of each figure's population total: sum over strata of N_h * mean_h, with variance
+    sum of N_h^2 (1 - n_h/N_h) s_h^2 / n_h; a sampled record outside the domain, or rejected by cleaning, counts as 0.
+    """
+    out = None
+    for stratum, (population, n) in strata.items():
+        acc = domain.sums.get(stratum)
+        if acc is None or n == 0:
+            continue
+        if out is None:
+            out = [[0.0, 0.0] for _ in acc]
+        for o, (s, s2) in zip(out, acc):
+            o[0] += population * s / n
+            if n > 1 and population > n:
+                var = max(0.0, (s2 - s * s / n) / (n - 1))
+                o[1] += population * population * (1 - n / population) * var / n
+    if out is None:
+        out = [[0.0, 0.0] for _ in ("record_count", *METRICS)]
+    return [_interval(total, math.sqrt(var), z) for total, var in out]
+
+
+def _interval(estimate: float, stderr: float, z: float) -> dict:
+    return {
+        "estimate": round(estimate, 4),
+        "low": round(estimate - z * stderr, 4),
+        "high": round(estimate + z * stderr, 4),
+        "stderr": round(stderr, 4),
+    }
+
+
+def estimate(strata: dict, confidence: float = DEFAULT_CONFIDENCE, stratify: str = "source") -> dict:
+    """
+    Clean the whole sample at once (duplicates are dropped across strata, like the full run) and scale it to an
+    Analytics Preview dict (without file or timing fields).
+    """
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    total, by_source = _Domain(), {}
+    sizes = {stratum: (population, len(sample)) for stratum, (population, sample) in strata.items()}
+    stats = {}
+    ts_min = ts_max = None
+    sample = [r for _, records in strata.values() for r in records]
+    for r in clean_data.clean_records(sample, stats, capacity=max(1000, len(sample))):
+        src = _stratum(r)
+        stratum = "" if stratify != "source" else src if src in strata else OTHER_STRATUM
+        values = (1.0, *(float(r.get(m, 0) or 0) for m in METRICS))
+        total.add(stratum, values)
+        by_source.setdefault(src, _Domain()).add(stratum, values)
+        ts = r.get("timestamp")
+        if ts:
+            ts_min = ts if ts_min is None or ts < ts_min else ts_min
+            ts_max = ts if ts_max is None or ts > ts_max else ts_max
+    population = sum(p for p, _ in sizes.values())
+    sampled = sum(n for _, n in sizes.values())
+    count, *totals = _estimate(total, sizes, z)
+
+    k, top_by = analyze._top_sources(), analyze._top_by()
+    ranked = sorted(by_source.items(), key=lambda item: (-_estimate(item[1], sizes, 0)[1 + METRICS.index(top_by)]["estimate"], item[0]))
+    rows = []
+    for name, domain in (sorted(ranked) if len(ranked) <= k else ranked[:k]):
+        _, *sums = _estimate(domain, sizes, z)
+        rows.append({"source": name, **dict(zip(METRICS, sums))})
+    if len(ranked) > k:
+        other = _Domain()
+        for _, domain in ranked[k:]:
+            other.merge(domain)
+        _, *sums = _estimate(other, sizes, z)
+        rows.append({"source": "other", **dict(zip(METRICS, sums)), "folded_sources": len(ranked) - k})
+
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "preview": True,
+        "method": "stratified_reservoir" if stratify == "source" else "reservoir",
+        "confidence": confidence,
+        "population_count": population,
+        "sample_size": sampled,
+        "sample_fraction": round(sampled / population, 6) if population else None,
+        "strata": len(sizes) if stratify == "source" else 1,
+        "exact": sampled == population,
+        "period_start": ts_min,
+        "period_end": ts_max,
+        "record_count": count,
+        "totals": dict(zip(METRICS, totals)),
+        "by_source": rows,
+        "validation_errors_count": stats.get("validation_errors_count", 0),
+        "duplicates_dropped_count": stats.get("duplicates_dropped_count", 0),
+        "summary": (
+            f"Estimated visits: {totals[0]['estimate']:.0f}, conversions: {totals[1]['estimate']:.0f}, "
+            f"revenue: ${totals[2]['estimate']:.2f} ({confidence:.0%} CI ${totals[2]['low']:.2f}–${totals[2]['high']:.2f}; "
+            f"{sampled} of {population} records sampled)"
+        ),
+    }
+
+
+def preview(size: int | None = None, stratify: str | None = None, confidence: float | None = None, seed: int = 0) -> dict | None:
+    """
+    Sample the configured source and write the Analytics Preview to analytics_preview.json. Arguments default to
+    PREVIEW_SAMPLE_SIZE, PREVIEW_STRATIFY and PREVIEW_CONFIDENCE. Returns the preview, or None if the source cannot be
+    read (error printed). Raises ValueError on an invalid argument. The same source, arguments and seed give the same sample.
+    """
+    size, stratify, confidence = check_args(size, stratify, confidence)
+    with metrics.recording("preview") as rec:
+        rec.exit_code = 1
+        with rec.measure("ingest"):
+            opened = ingest_data.read_batches()
+            if opened is None:
+                return None
+            strata = sample_records(opened[1], size, stratify, seed)
+        rec.add("ingest", records_out=sum(p for p, _ in strata.values()))
+        with rec.measure("analyze"):
+            out = estimate(strata, confidence, stratify)
+        rec.add("analyze", records_in=out["sample_size"], records_out=out["sample_size"])
+        out = {**out, "computed_at": datetime.now(timezone.utc).isoformat(), "seed": seed}
+        TMP_DIR.mkdir(parents=True, exist_ok=True)
+        part = OUTPUT_FILE.with_name(OUTPUT_FILE.name + ".part")
+        with open(part, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=2)
+        os.replace(part, OUTPUT_FILE)
+        rec.exit_code = 0
+        return out
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Estimate the Analytics Result from a sample of the source.")
+    parser.add_argument("--sample", type=int, default=None, help="records to sample (default PREVIEW_SAMPLE_SIZE or 10000)")
+    parser.add_argument("--stratify", choices=STRATIFY, default=None, help="one reservoir per source, or none (default PREVIEW_STRATIFY or source)")
+    parser.add_argument("--confidence", type=float, default=None, help="confidence level of the intervals (default PREVIEW_CONFIDENCE or 0.95)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    try:
+        out = preview(args.sample, args.stratify, args.confidence, args.seed)
+    except ValueError as e:
+        print(f"Preview: {e}", file=sys.stderr)
+        return 1
+    if out is None:
+        return 1
+    print(out["summary"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,441 @@
+"""
+Ad-hoc filter / group-by / aggregate queries over the cleaned records.
+Input: .tmp/cleaned_data.col (preferred) or .tmp/cleaned_data.json. Store: .tmp/query_store.db (SQLite), loaded from
+the cleaned file (data version = its size, mtime and inode) and indexed on timestamp and (source, timestamp). The
+store is never built in a query: a query that finds it missing or stale starts a rebuild in a background thread and
+is answered from the previous store meanwhile (StoreBuilding when there is none yet). Runs that rewrite the cleaned
+file (clean_data, checkpointed pipeline runs) start that rebuild themselves when a store exists. A query spec (JSON) is compiled to one parameterized SQL
+statement, so filters run inside SQLite against the indexes; results are cached in memory by (spec, data version).
+CLI: python tools/query.py '<spec JSON>' prints the result. Served by POST /api/query.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+# Allow running as a script (python tools/query.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.columnar import iter_strings, open_columns
+from tools.jsonstream import open_records_file
+from tools.rollup import to_utc, utc_bound
+
+# Optional: fcntl for the cross-process build lock. Without it (non-POSIX) builds are only serialized within one process.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+COLUMNS_FILE = TMP_DIR / "cleaned_data.col"
+INPUT_FILE = TMP_DIR / "cleaned_data.json"
+STORE_DB = TMP_DIR / "query_store.db"
+BUILD_LOCK = TMP_DIR / "query_store.lock"
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+DEFAULT_CACHE_SIZE = 256
+
+# Cleaned Data fields (gemini.md 1.2) → store columns.
+FIELDS = {"id": "id", "timestamp": "ts", "source": "source", "visits": "visits", "conversions": "conversions", "revenue": "revenue"}
+NUMERIC = ("visits", "conversions", "revenue")
+# UTC bucket starts, formatted like the rollup buckets.
+BUCKETS = {
+    "hour": "substr(ts, 1, 13) || ':00:00Z'",
+    "day": "substr(ts, 1, 10) || 'T00:00:00Z'",
+    "week": "date(substr(ts, 1, 10), '-6 days', 'weekday 1') || 'T00:00:00Z'",
+    "month": "substr(ts, 1, 7) || '-01T00:00:00Z'",
+}
+OPS = {"eq": "=", "ne": "!=", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+SET_OPS = ("in", "not_in")
+TEXT_OPS = ("glob", "prefix")
+AGGREGATES = ("count", "sum", "avg", "min", "max", "count_distinct")
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_build_here = threading.Lock()
+_store = {"version": None, "builder": None}
+
+
+class StoreBuilding(Exception):
+    """The store is being built and there is no previous one to answer from."""
+
+
+def _cache_size() -> int:
+    try:
+        return max(0, int(os.environ.get("QUERY_CACHE_SIZE", DEFAULT_CACHE_SIZE) or DEFAULT_CACHE_SIZE))
+    except ValueError:
+        return DEFAULT_CACHE_SIZE
+
+
+# — Store
+
+
+def source_file() -> Path | None:
+    """The cleaned data file queries read, like analyze: columnar when present, else JSON; None if neither exists."""
+    for p in (COLUMNS_FILE, INPUT_FILE):
+        if p.is_file():
+            return p
+    return None
+
+
+def data_version() -> str | None:
+    """Fingerprint of the cleaned data file (name, size, mtime, inode); None if there is none."""
+    path = source_file()
+    if path is None:
+        return None
+    st = path.stat()
+    return hashlib.sha256(f"{path.name}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}".encode()).hexdigest()[:16]
+
+
+def _rows(path: Path):
+    if path.suffix == ".col":
+        cols = open_columns(path)
+        sources = cols["sources"]
+        for rid, ts, code, v, c, r in zip(iter_strings(cols, "id"), iter_strings(cols, "timestamp"), cols["source"],
+                                          cols["visits"], cols["conversions"], cols["revenue"]):
+            yield rid, to_utc(ts), sources[code], v, c, r
+    else:
+        _, records = open_records_file(path)
+        for rec in records:
+            yield (rec.get("id", ""), to_utc(rec.get("timestamp", "")), rec.get("source", ""),
+                   *(float(rec.get(m, 0) or 0) for m in NUMERIC))
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or STORE_DB)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def build_store(path: Path, version: str) -> int:
+    """Load the cleaned file into a fresh store, then swap it in atomically. Returns the record count."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    fd, part = tempfile.mkstemp(prefix=STORE_DB.name + ".", suffix=".part", dir=TMP_DIR)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(part)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("""
+                CREATE TABLE records (
+                    id TEXT NOT NULL,
+                    ts TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    visits REAL NOT NULL,
+                    conversions REAL NOT NULL,
+                    revenue REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            with conn:
+                conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", _rows(path))
+            # Indexes after the load: one sort each instead of a B-tree update per row.
+            conn.execute("CREATE INDEX idx_records_ts ON records (ts)")
+            conn.execute("CREATE INDEX idx_records_source ON records (source, ts)")
+            conn.execute("ANALYZE")
+            count = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            with conn:
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [("version", version), ("source", path.name), ("record_count", str(count))])
+        finally:
+            conn.close()
+        os.replace(part, STORE_DB)
+    except BaseException:
+        Path(part).unlink(missing_ok=True)
+        raise
+    return count
+
+
+def _store_version() -> str | None:
+    if not STORE_DB.is_file():
+        return None
+    conn = connect()
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    return row and row["value"]
+
+
+@contextmanager
+def _building(wait: bool):
+    """Hold the build lock (one builder across threads and processes); yields False if wait=False and it is taken."""
+    if not _build_here.acquire(blocking=wait):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        TMP_DIR.mkdir(parents=True, exist_ok=True)
+        with open(BUILD_LOCK, "a") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    finally:
+        _build_here.release()
+
+
+def refresh_store(wait: bool = True) -> str | None:
+    """
+    Build the store if it does not match the current cleaned data; called after the cleaned file is written. Returns the
+    data version, or None if there is no cleaned data or (wait=False) another build is running.
+    """
+    version = data_version()
+    if version is None:
+        return None
+    with _building(wait) as acquired:
+        if not acquired:
+            return None
+        for part in TMP_DIR.glob(STORE_DB.name + ".*.part"):
+            part.unlink(missing_ok=True)  # left by a builder whose process exited mid-build
+        if _store_version() != version:
+            build_store(source_file(), version)
+    return version
+
+
+def refresh_in_background() -> bool:
+    """
+    Called after the cleaned file is written: if a store exists (queries are in use), start rebuilding it in a
+    background thread, so the cleaning run never waits for the load. Returns whether a rebuild was started.
+    """
+    if not STORE_DB.is_file():
+        return False
+    _refresh_in_background()
+    return True
+
+
+def _refresh_in_background() -> None:
+    def work():
+        try:
+            refresh_store(wait=False)
+        except (OSError, sqlite3.Error, ValueError) as e:
+            print(f"Query store rebuild failed: {e}", file=sys.stderr)
+
+    with _lock:
+        if _store["builder"] is None or not _store["builder"].is_alive():
+            _store["builder"] = threading.Thread(target=work, name="query-store", daemon=True)
+            _store["builder"].start()
+
+
+def ensure_store() -> tuple[str, bool]:
+    """
+    (data version of the store to read, stale). Never builds: if the store does not match the current cleaned data, a
+    rebuild starts in the background and the previous store answers (stale=True). Raises FileNotFoundError when there
+    is no cleaned data, StoreBuilding when there is no store yet.
+    """
+    version = data_version()
+    if version is None:
+        raise FileNotFoundError("cleaned_data not found. Run clean_data or a checkpointed pipeline first.")
+    with _lock:
+        if _store["version"] == version:
+            return version, False
+    current = _store_version()
+    if current == version:
+        with _lock:
+            _store["version"] = version
+        return version, False
+    _refresh_in_background()
+    if current is None:
+        raise StoreBuilding("query store is being built; retry shortly")
+    return current, True
+
+
+# — Query specs
+
+
+def _field(name) -> str:
+    if not isinstance(name, str) or name not in FIELDS:
+        raise ValueError(f"unknown field {name!r}; expected one of {', '.join(FIELDS)}")
+    return FIELDS[name]
+
+
+def _value(field: str, value):
+    """Check a filter value's type; timestamps are normalized to UTC like the stored ones."""
+    if field in NUMERIC:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{field} filters need numbers")
+        return value
+    if not isinstance(value, str) or (field == "timestamp" and not value):
+        raise ValueError(f"{field} filters need {'ISO-8601 ' if field == 'timestamp' else ''}strings")
+    return utc_bound(value) if field == "timestamp" else value
+
+
+def _where(filters: list) -> tuple[list, list]:
+    clauses, params = [], []
+    for f in filters:
+        if not isinstance(f, dict):
+            raise ValueError("each filter must be an object with field, op and value")
+        name, op, value = f.get("field"), f.get("op", "eq"), f.get("value")
+        col = _field(name)
+        if op in OPS:
+            clauses.append(f"{col} {OPS[op]} ?")
+            params.append(_value(name, value))
+        elif op == "between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError("between needs [low, high]; the range is low <= value < high")
+            clauses.append(f"{col} >= ? AND {col} < ?")
+            params.extend(_value(name, v) for v in value)
+        elif op in SET_OPS:
+            if not isinstance(value, list) or not value:
+                raise ValueError(f"{op} needs a non-empty list")
+            clauses.append(f"{col} {'NOT IN' if op == 'not_in' else 'IN'} ({', '.join('?' * len(value))})")
+            params.extend(_value(name, v) for v in value)
+        elif op in TEXT_OPS:
+            if name in NUMERIC or name == "timestamp":
+                raise ValueError(f"{op} applies to id and source")
+            pattern = _value(name, value)
+            if op == "prefix":
+                pattern = "".join(f"[{ch}]" if ch in "*?[" else ch for ch in pattern) + "*"
+            clauses.append(f"{col} GLOB ?")  # case-sensitive, so a literal prefix can use the source index
+            params.append(pattern)
+        else:
+            raise ValueError(f"unknown op {op!r}; expected one of {', '.join([*OPS, 'between', *SET_OPS, *TEXT_OPS])}")
+    return clauses, params
+
+
+def _aggregate(spec) -> tuple[str, str]:
+    if not isinstance(spec, dict):
+        raise ValueError("each aggregate must be an object with fn and field")
+    fn, field = spec.get("fn"), spec.get("field")
+    if fn not in AGGREGATES:
+        raise ValueError(f"unknown aggregate {fn!r}; expected one of {', '.join(AGGREGATES)}")
+    if fn == "count" and field is None:
+        expr = "COUNT(*)"
+    else:
+        col = _field(field)
+        if fn in ("sum", "avg") and field not in NUMERIC:
+            raise ValueError(f"{fn} applies to {', '.join(NUMERIC)}")
+        expr = f"COUNT(DISTINCT {col})" if fn == "count_distinct" else f"{fn.upper()}({col})"
+    alias = spec.get("as") or (f"{fn}_{field}" if field else fn)
+    if not isinstance(alias, str) or not alias.isidentifier():
+        raise ValueError(f"invalid aggregate name {alias!r}")
+    return expr, alias
+
+
+def compile_query(spec: dict) -> tuple[str, list, list]:
+    """
+    Compile a query spec to (sql, params, columns). Raises ValueError on an invalid spec.
+    spec: {"filters": [{"field", "op", "value"}], "group_by": [field or hour/day/week/month],
+           "aggregates": [{"fn", "field", "as"}], "order_by": [{"field", "desc"}], "limit": n}
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("query spec must be an object")
+    unknown = set(spec) - {"filters", "group_by", "aggregates", "order_by", "limit"}
+    if unknown:
+        raise ValueError(f"unknown spec keys: {', '.join(sorted(unknown))}")
+    clauses, params = _where(spec.get("filters") or [])
+    groups = []
+    for g in spec.get("group_by") or []:
+        if not isinstance(g, str) or (g not in BUCKETS and g not in FIELDS):
+            raise ValueError(f"unknown group {g!r}; expected a field or one of {', '.join(BUCKETS)}")
+        groups.append((BUCKETS.get(g) or FIELDS[g], g))
+    aggregates = [_aggregate(a) for a in (spec.get("aggregates") or [{"fn": "count"}])]
+    columns = [name for _, name in groups] + [alias for _, alias in aggregates]
+    if len(set(columns)) != len(columns):
+        raise ValueError("output column names must be unique")
+    order = []
+    for o in spec.get("order_by") or []:
+        o = {"field": o} if isinstance(o, str) else o
+        if not isinstance(o, dict) or o.get("field") not in columns:
+            raise ValueError(f"order_by must name output columns: {', '.join(columns)}")
+        order.append(f'"{o["field"]}"{" DESC" if o.get("desc") else ""}')
+    limit = spec.get("limit", DEFAULT_LIMIT)
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    select = [f'{expr} AS "{name}"' for expr, name in groups + aggregates]
+    sql = f"SELECT {', '.join(select)} FROM records"
+    if clauses:
+        sql += f" WHERE {' AND '.join(clauses)}"
+    if groups:
+        sql += f" GROUP BY {', '.join(str(i + 1) for i in range(len(groups)))}"
+    order = order or [str(i + 1) for i in range(len(groups))]
+    if order:
+        sql += f" ORDER BY {', '.join(order)}"
+    sql += f" LIMIT {limit}"
+    return sql, params, columns
+
+
+def _cache_key(spec: dict, version: str) -> str:
+    return version + ":" + json.dumps(spec, sort_keys=True, separators=(",", ":"))
+
+
+def run(spec: dict) -> dict:
+    """
+    Answer a query spec over the cleaned records: {"data_version", "stale", "cached", "columns", "rows"}; stale is True
+    while a rebuild runs and the previous store answers. Raises ValueError on an invalid spec, FileNotFoundError when
+    there is no cleaned data, StoreBuilding while the first store is built.
+    """
+    sql, params, columns = compile_query(spec)
+    version, stale = ensure_store()
+    key = _cache_key(spec, version)
+    with _lock:
+        rows = _cache.get(key)
+        if rows is not None:
+            _cache.move_to_end(key)
+    if rows is None:
+        conn = connect()
+        try:
+            rows = [dict(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+        size = _cache_size()
+        with _lock:
+            if size:
+                _cache[key] = rows
+                while len(_cache) > size:
+                    _cache.popitem(last=False)
+        return {"data_version": version, "stale": stale, "cached": False, "columns": columns, "rows": rows}
+    return {"data_version": version, "stale": stale, "cached": True, "columns": columns, "rows": rows}
+
+
+def explain(spec: dict) -> list:
+    """SQLite's query plan for a spec (which index each filter uses), one line per step."""
+    sql, params, _ = compile_query(spec)
+    ensure_store()
+    conn = connect()
+    try:
+        return [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    finally:
+        conn.close()
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+        _store["version"] = None
+
+
+def main(argv: list) -> int:
+    if len(argv) != 1:
+        print("usage: python tools/query.py '<spec JSON>'", file=sys.stderr)
+        return 2
+    try:
+        spec = json.loads(argv[0])
+        refresh_store()  # a one-shot process: build in the foreground rather than in a thread that exits with it
+        result = run(spec)
+    except (ValueError, FileNotFoundError, StoreBuilding) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,239 @@
+"""
+Render the Report Payload as CSV, HTML and Markdown next to report_output.json (.tmp/report_output.<ext>).
+Each format is streamed chunk by chunk into a content-addressed cache (.tmp/render_cache/<key>.<ext>), keyed by a
+hash of the Analytics Result (computed_at excluded), the format, title and period and the renderer code. A report for
+an unchanged result is copied (hard-linked where possible) from the cache without rendering again.
+Formats: REPORT_FORMATS (comma-separated; default "csv,html,md"; "none" renders nothing). Cache size: RENDER_CACHE_MAX files.
+"""
+
+import csv
+import hashlib
+import html
+import json
+import os
+import shutil
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+# Allow running as a script (python tools/render.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import metrics
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+CACHE_DIR = TMP_DIR / "render_cache"
+SCHEMA_VERSION = "1.0"
+METRICS = ("visits", "conversions", "revenue")
+DEFAULT_FORMATS = ("csv", "html", "md")
+DEFAULT_CACHE_MAX = 256
+_VOLATILE = ("computed_at",)
+
+
+def report_formats() -> tuple:
+    """REPORT_FORMATS as a tuple of known formats, in RENDERERS order; unknown names are ignored."""
+    raw = (os.environ.get("REPORT_FORMATS", ",".join(DEFAULT_FORMATS)) or "").strip().lower()
+    if raw in ("none", "off", "0"):
+        return ()
+    wanted = {p.strip() for p in raw.replace(" ", ",").split(",")}
+    return tuple(f for f in RENDERERS if f in wanted)
+
+
+def _cache_max() -> int:
+    try:
+        return max(1, int(os.environ.get("RENDER_CACHE_MAX", DEFAULT_CACHE_MAX) or DEFAULT_CACHE_MAX))
+    except ValueError:
+        return DEFAULT_CACHE_MAX
+
+
+def output_file(fmt: str) -> Path:
+    return TMP_DIR / f"report_output.{fmt}"
+
+
+def output_files() -> list:
+    """Rendered files the configured formats write (for the pipeline's report manifest)."""
+    return [output_file(f) for f in report_formats()]
+
+
+# — Renderers: each yields the document in chunks, one row or section at a time
+
+
+def _money(value) -> str:
+    return f"${float(value or 0):,.2f}"
+
+
+def _count(value) -> str:
+    return f"{float(value or 0):,.0f}"
+
+
+def _cells(row: dict) -> list:
+    return [_count(row.get("visits")), _count(row.get("conversions")), _money(row.get("revenue"))]
+
+
+class _Line:
+    """File-like sink for csv.writer that hands each written row back to the generator."""
+
+    def __init__(self):
+        self.text = ""
+
+    def write(self, s: str) -> None:
+        self.text += s
+
+    def take(self) -> str:
+        text, self.text = self.text, ""
+        return text
+
+
+def render_csv(report: dict):
+    """One row per source, then a total row: source, visits, conversions, revenue, folded_sources."""
+    line = _Line()
+    writer = csv.writer(line, lineterminator="\n")
+    writer.writerow(["source", *METRICS, "folded_sources"])
+    yield line.take()
+    for row in report.get("by_source", []):
+        writer.writerow([row.get("source", ""), *(row.get(m, 0) for m in METRICS), row.get("folded_sources", "")])
+        yield line.take()
+    totals = report.get("metrics", {})
+    writer.writerow(["total", *(totals.get(m, 0) for m in METRICS), ""])
+    yield line.take()
+
+
+def render_html(report: dict):
+    """Standalone HTML page: title, period, narrative, totals and the by-source table."""
+    e = html.escape
+    title = e(str(report.get("title", "")))
+    yield (
+        f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n'
+        "<style>body{font-family:sans-serif;margin:2rem}table{border-collapse:collapse}"
+        "th,td{border:1px solid #ccc;padding:.3rem .6rem}td.n{text-align:right}</style>\n</head>\n<body>\n"
+        f"<h1>{title}</h1>\n<p>{e(str(report.get('period', '')))}</p>\n<p>{e(str(report.get('narrative', '')))}</p>\n"
+    )
+    totals = report.get("metrics", {})
+    yield "<table>\n<tr>" + "".join(f"<th>{m.title()}</th>" for m in METRICS) + "</tr>\n"
+    yield "<tr>" + "".join(f'<td class="n">{c}</td>' for c in _cells(totals)) + "</tr>\n</table>\n"
+    extra = []
+    if report.get("distinct_ids") is not None:
+        extra.append(f"Distinct ids (estimate): {_count(report['distinct_ids'])}")
+    if report.get("revenue_percentiles"):
+        extra.append("Revenue percentiles: " + ", ".join(f"{k} {_money(v)}" for k, v in report["revenue_percentiles"].items()))
+    if extra:
+        yield "".join(f"<p>{e(x)}</p>\n" for x in extra)
+    yield "<h2>By source</h2>\n<table>\n<tr><th>Source</th>" + "".join(f"<th>{m.title()}</th>" for m in METRICS) + "</tr>\n"
+    for row in report.get("by_source", []):
+        name = str(row.get("source", ""))
+        if "folded_sources" in row:
+            name += f" ({row['folded_sources']} sources)"
+        yield f"<tr><td>{e(name)}</td>" + "".join(f'<td class="n">{c}</td>' for c in _cells(row)) + "</tr>\n"
+    yield "</table>\n</body>\n</html>\n"
+
+
+def _md(text) -> str:
+    return str(text).replace("\\", "\\\\").replace("|", "\\|").replace("\n", " ")
+
+
+def render_md(report: dict):
+    """Markdown: heading, period, narrative, totals table and by-source table."""
+    yield f"# {_md(report.get('title', ''))}\n\n_{_md(report.get('period', ''))}_\n\n{_md(report.get('narrative', ''))}\n\n"
+    yield "| " + " | ".join(m.title() for m in METRICS) + " |\n|" + "---:|" * len(METRICS) + "\n"
+    yield "| " + " | ".join(_cells(report.get("metrics", {}))) + " |\n\n"
+    if report.get("distinct_ids") is not None:
+        yield f"Distinct ids (estimate): {_count(report['distinct_ids'])}\n\n"
+    if report.get("revenue_percentiles"):
+        yield "Revenue percentiles: " + ", ".join(f"{k} {_money(v)}" for k, v in report["revenue_percentiles"].items()) + "\n\n"
+    yield "## By source\n\n| Source | " + " | ".join(m.title() for m in METRICS) + " |\n|---|" + "---:|" * len(METRICS) + "\n"
+    for row in report.get("by_source", []):
+        name = _md(row.get("source", ""))
+        if "folded_sources" in row:
+            name += f" ({row['folded_sources']} sources)"
+        yield f"| {name} | " + " | ".join(_cells(row)) + " |\n"
+
+
+RENDERERS = {"csv": render_csv, "html": render_html, "md": render_md}
+
+
+# — Cache
+
+
+@lru_cache(maxsize=1)
+def renderer_version() -> str:
+    """SCHEMA_VERSION plus a hash of this module and generate_report (which builds what is rendered)."""
+    from tools import generate_report
+    h = hashlib.sha256()
+    for module in (sys.modules[__name__], generate_report):
+        h.update(Path(module.__file__).read_bytes())
+    return f"{SCHEMA_VERSION}+{h.hexdigest()[:12]}"
+
+
+def result_hash(result: dict) -> str:
+    """SHA-256 of the Analytics Result as canonical JSON, without the fields that change on every run."""
+    stable = {k: v for k, v in result.items() if k not in _VOLATILE}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def render_key(digest: str, fmt: str, title: str, period: str) -> str:
+    return hashlib.sha256(json.dumps([digest, fmt, title, period, renderer_version()]).encode("utf-8")).hexdigest()
+
+
+def _publish(src: Path, dst: Path) -> None:
+    """Put the cached file at dst atomically: a hard link where the filesystem allows it, else a copy."""
+    if dst.is_file() and os.path.samefile(src, dst):
+        return  # already linked (rename onto a link to the same file would leave the .part behind)
+    part = dst.with_name(dst.name + ".part")
+    part.unlink(missing_ok=True)
+    try:
+        os.link(src, part)
+    except OSError:
+        shutil.copyfile(src, part)
+    os.replace(part, dst)
+
+
+def _prune() -> None:
+    """Drop the least recently used cache files past RENDER_CACHE_MAX."""
+    files = [p for p in CACHE_DIR.iterdir() if p.is_file() and not p.name.endswith(".part")]
+    limit = _cache_max()
+    if len(files) <= limit:
+        return
+    files.sort(key=lambda p: p.stat().st_mtime_ns)
+    for p in files[:len(files) - limit]:
+        p.unlink(missing_ok=True)
+
+
+def render(result: dict, report: dict, fmt: str, digest: str | None = None) -> tuple[Path, bool]:
+    """
+    Write report_output.<fmt> for `report` (built from `result`). Returns (path, cached); cached is True when the
+    artifact came from the cache. Raises ValueError on an unknown format.
+    """
+    if fmt not in RENDERERS:
+        raise ValueError(f"format must be one of {', '.join(RENDERERS)}")
+    key = render_key(digest or result_hash(result), fmt, str(report.get("title", "")), str(report.get("period", "")))
+    cached = CACHE_DIR / f"{key}.{fmt}"
+    hit = cached.is_file()
+    if hit:
+        os.utime(cached)  # most recently used
+    else:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        part = cached.with_name(cached.name + ".part")
+        with open(part, "w", encoding="utf-8", newline="") as f:
+            for chunk in RENDERERS[fmt](report):
+                f.write(chunk)
+        os.replace(part, cached)
+        metrics.note("report", bytes_written=cached.stat().st_size)
+        _prune()
+    out = output_file(fmt)
+    _publish(cached, out)
+    return out, hit
+
+
+def render_all(result: dict, report: dict, formats=None) -> dict:
+    """Render every format in `formats` (default REPORT_FORMATS); {format: {"path", "cached"}}."""
+    formats = report_formats() if formats is None else formats
+    if not formats:
+        return {}
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    digest = result_hash(result)
+    out = {}
+    for fmt in formats:
+        path, hit = render(result, report, fmt, digest)
+        out[fmt] = {"path": str(path), "cached": hit}
+    return out
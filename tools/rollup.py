@@ -0,0 +1,329 @@
+"""
+Time-bucketed rollups of cleaned records: record count and metric sums per (grain, bucket, source)
+for hour, day and week (ISO, Monday-start) buckets in UTC.
+Output: .tmp/analytics_rollup.db (SQLite, clustered on grain, bucket, source) — queried by /api/analytics/rollup.
+Rollups are additive, so incremental runs add their new records to the stored buckets.
+"""
+
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Allow running as a script (python tools/rollup.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools.columnar import iter_strings
+
+# Optional: NumPy for bucketing columnar input in bulk. Falls back to the per-row loop if unavailable.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
+ROLLUP_DB = TMP_DIR / "analytics_rollup.db"
+GRAINS = ("hour", "day", "week")
+METRICS = ("visits", "conversions", "revenue")
+GROUP_BY = ("bucket", "source")
+
+
+# — Bucketing
+
+
+def _parse(ts: str) -> datetime | None:
+    try:
+        dt = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)  # naive timestamps are taken as UTC
+    return dt.astimezone(timezone.utc)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def buckets_for(ts: str) -> tuple | None:
+    """(hour, day, week) bucket starts for an ISO-8601 timestamp, as UTC "YYYY-MM-DDTHH:MM:SSZ"; None if unparseable."""
+    dt = _parse(ts)
+    if dt is None:
+        return None
+    hour = dt.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    week = day - timedelta(days=day.weekday())
+    return _iso(hour), _iso(day), _iso(week)
+
+
+def _hour_bucket(ts: str) -> str | None:
+    """Hour bucket only (buckets_for(ts)[0]), for the per-record path."""
+    dt = _parse(ts)
+    return dt and _iso(dt.replace(minute=0, second=0, microsecond=0))
+
+
+def _hour_key(ts: str) -> tuple | None:
+    """
+    Cache key that determines the buckets of `ts` without parsing it: the "YYYY-MM-DDTHH" prefix plus the UTC
+    offset, for a "Z" or whole-hour "±HH:00" suffix only. None for every other form (naive, "+0500", "+05",
+    "+05:30"), which is parsed in full: an offset the key cannot see must not share a naive timestamp's entry.
+    """
+    if len(ts) < 13:
+        return None
+    if ts.endswith("Z"):
+        return ts[:13], "Z"
+    if len(ts) >= 19 and ts[-6] in "+-" and ts[-3] == ":" and ts[-2:] == "00":
+        return ts[:13], ts[-6:]
+    return None
+
+
+class RollupBuilder:
+    """
+    Accumulates cleaned records into hourly (bucket, source) → [record_count, visits, conversions, revenue] cells;
+    day and week cells are summed from the hourly ones in cells(), so each record costs one dict update.
+    """
+
+    def __init__(self):
+        self.hours = {}
+        self.skipped = 0  # records whose timestamp could not be parsed
+        self._hour_of = {}
+
+    def _hour(self, ts: str) -> str | None:
+        key = _hour_key(ts)
+        if key is None:
+            return _hour_bucket(ts)
+        hour = self._hour_of.get(key)
+        if hour is None:
+            hour = self._hour_of[key] = _hour_bucket(ts)
+        return hour
+
+    def add(self, ts: str, source: str, visits: float, conversions: float, revenue: float) -> None:
+        hour = self._hour(ts) if ts else None
+        if hour is None:
+            self.skipped += 1
+            return
+        key = (hour, str(source or "").strip() or "unknown")
+        cell = self.hours.get(key)
+        if cell is None:
+            self.hours[key] = [1, visits, conversions, revenue]
+        else:
+            cell[0] += 1
+            cell[1] += visits
+            cell[2] += conversions
+            cell[3] += revenue
+
+    def cells(self) -> dict:
+        """(grain, bucket, source) → [record_count, visits, conversions, revenue] for every grain."""
+        out = {}
+        for (hour, source), vals in self.hours.items():
+            _, day, week = buckets_for(hour)
+            for key in (("hour", hour, source), ("day", day, source), ("week", week, source)):
+                cell = out.get(key)
+                if cell is None:
+                    out[key] = list(vals)
+                else:
+                    for i in range(4):
+                        cell[i] += vals[i]
+        return out
+
+    def tee(self, records):
+        """Yield each cleaned record unchanged while adding it to the rollups."""
+        for r in records:
+            self.add(r.get("timestamp", ""), r.get("source", ""), float(r.get("visits", 0) or 0),
+                     float(r.get("conversions", 0) or 0), float(r.get("revenue", 0) or 0))
+            yield r
+
+    def add_columns(self, cols: dict) -> None:
+        """Add every row of memory-mapped columns (tools.columnar.open_columns); in bulk with NumPy when installed."""
+        if NUMPY_AVAILABLE and cols["record_count"]:
+            self._add_columns_numpy(cols)
+            return
+        sources = cols["sources"]
+        for ts, code, v, c, r in zip(iter_strings(cols, "timestamp"), cols["source"], cols["visits"], cols["conversions"], cols["revenue"]):
+            self.add(ts, sources[code], v, c, r)
+
+    def _hour_codes(self, cols: dict):
+        """
+        (hour code per row, -1 if unparseable; hour bucket per code). Rows that _hour_key() would cache are keyed the
+        same way in NumPy, by their first 13 bytes plus "Z" or their "±HH:00" suffix, and one row per distinct key is
+        parsed; every other row goes through _hour().
+        """
+        n = cols["record_count"]
+        offsets, data = cols["timestamp"]
+        offs = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        starts, ends = offs[:-1], offs[1:]
+        codes = np.full(n, -1, dtype=np.int64)
+        hours, code_of = [], {}
+
+        def code(hour):
+            if hour is None:
+                return -1
+            c = code_of.get(hour)
+            if c is None:
+                c = code_of[hour] = len(hours)
+                hours.append(hour)
+            return c
+
+        def text(i):
+            return bytes(buf[starts[i]:ends[i]]).decode("utf-8")
+
+        fast = np.zeros(n, dtype=bool)
+        if len(buf) >= 13:
+            # ts[:13] and ts[-6:] of every row, gathered from windows over the data; the indexes are clipped, so rows
+            # shorter than what is read get other rows' bytes, but the length checks keep them off the fast path.
+            window = np.lib.stride_tricks.sliding_window_view
+            head = window(buf, 13)[np.minimum(starts, len(buf) - 13)]
+            tail = window(buf, 6)[np.clip(ends - 6, 0, len(buf) - 6)]
+            length = ends - starts
+            z = (length >= 13) & (tail[:, 5] == ord("Z"))
+            offset = (length >= 19) & ((tail[:, 0] == ord("+")) | (tail[:, 0] == ord("-"))) & (tail[:, 3] == ord(":")) \
+                & (tail[:, 4] == ord("0")) & (tail[:, 5] == ord("0"))
+            fast = z | offset
+            rows = np.flatnonzero(fast)
+            # The _hour_key bytes as two integers per row: ts[:8], then ts[8:13] + sign and HH of the offset (zeros for "Z").
+            key = np.zeros((len(rows), 16), dtype=np.uint8)
+            key[:, :13] = head[rows]
+            key[:, 13:] = np.where(offset[rows, None], tail[rows, :3], 0)
+            words = key.view(np.uint64)
+            _, hi = np.unique(words[:, 0], return_inverse=True)
+            lo_keys, lo = np.unique(words[:, 1], return_inverse=True)
+            _, first, inverse = np.unique(hi.reshape(-1) * len(lo_keys) + lo.reshape(-1), return_index=True, return_inverse=True)
+            key_codes = np.array([code(self._hour(text(i))) for i in rows[first].tolist()], dtype=np.int64)
+            codes[rows] = key_codes[inverse.reshape(-1)]
+        for i in np.flatnonzero(~fast).tolist():
+            ts = text(i)
+            codes[i] = code(self._hour(ts) if ts else None)
+        return codes, hours
+
+    def _add_columns_numpy(self, cols: dict) -> None:
+        """Sum every (hour, source) cell with np.bincount, in row order like add()."""
+        codes, hours = self._hour_codes(cols)
+        names, index = [], {}
+        group_of_code = []
+        for s in cols["sources"]:
+            name = str(s or "").strip() or "unknown"
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+            group_of_code.append(index[name])
+        groups = np.asarray(group_of_code, dtype=np.int64)[np.frombuffer(cols["source"], dtype=np.uint32)]
+        values = [np.frombuffer(cols[m], dtype=np.float64) for m in METRICS]
+        valid = codes >= 0
+        skipped = len(codes) - int(np.count_nonzero(valid))
+        if skipped:
+            self.skipped += skipped
+            codes, groups, values = codes[valid], groups[valid], [v[valid] for v in values]
+        cells, inverse = np.unique(codes * len(names) + groups, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(cells)).tolist()
+        sums = [np.bincount(inverse, weights=v, minlength=len(cells)).tolist() for v in values]
+        keys = zip(map(hours.__getitem__, (cells // len(names)).tolist()), map(names.__getitem__, (cells % len(names)).tolist()))
+        added = dict(zip(keys, map(list, zip(counts, *sums))))
+        for key in added.keys() & self.hours.keys():
+            added[key] = [a + b for a, b in zip(self.hours[key], added[key])]
+        self.hours.update(added)
+
+
+# — Store
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or ROLLUP_DB)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollups (
+            grain TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            source TEXT NOT NULL,
+            record_count INTEGER NOT NULL,
+            visits REAL NOT NULL,
+            conversions REAL NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (grain, bucket, source)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rollups_source ON rollups (grain, source, bucket)")
+    return conn
+
+
+def write_rollups(builder: RollupBuilder, replace: bool = True) -> None:
+    """Store the builder's cells in one transaction. replace=False adds them to the existing buckets (incremental runs)."""
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    rows = [(g, b, s, *vals) for (g, b, s), vals in builder.cells().items()]
+    conn = connect()
+    try:
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM rollups")
+            conn.executemany("""
+                INSERT INTO rollups (grain, bucket, source, record_count, visits, conversions, revenue)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (grain, bucket, source) DO UPDATE SET
+                    record_count = record_count + excluded.record_count,
+                    visits = visits + excluded.visits,
+                    conversions = conversions + excluded.conversions,
+                    revenue = revenue + excluded.revenue
+            """, rows)
+    finally:
+        conn.close()
+
+
+def to_utc(ts: str) -> str:
+    """Timestamp as a UTC "YYYY-MM-DDTHH:MM:SSZ" string without parsing the common UTC forms; unparseable ones unchanged."""
+    if len(ts) == 25 and ts.endswith("+00:00") and ts[19] == "+":
+        return ts[:19] + "Z"
+    if len(ts) == 20 and ts.endswith("Z"):
+        return ts
+    dt = _parse(ts)
+    return ts if dt is None else _iso(dt)
+
+
+def utc_bound(value: str | None) -> str | None:
+    """Normalize a range bound to the bucket string format; raises ValueError if unparseable."""
+    if value is None or value == "":
+        return None
+    dt = _parse(value)
+    if dt is None:
+        raise ValueError(f"invalid timestamp: {value!r}")
+    return _iso(dt)
+
+
+def query(grain: str = "day", start: str | None = None, end: str | None = None, sources: list | None = None, group_by=GROUP_BY) -> list:
+    """
+    Sum rollups of `grain` over buckets in [start, end) (ISO-8601; bucket start times), optionally limited to
+    `sources`, grouped by any of "bucket" and "source". Raises ValueError on an invalid grain, group or bound.
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"grain must be one of {', '.join(GRAINS)}")
+    if any(g not in GROUP_BY for g in group_by):
+        raise ValueError(f"group_by must be a subset of {', '.join(GROUP_BY)}")
+    group_by = [g for g in GROUP_BY if g in group_by]
+    where, params = ["grain = ?"], [grain]
+    lo, hi = utc_bound(start), utc_bound(end)
+    if lo is not None:
+        where.append("bucket >= ?")
+        params.append(lo)
+    if hi is not None:
+        where.append("bucket < ?")
+        params.append(hi)
+    if sources:
+        where.append(f"source IN ({', '.join('?' * len(sources))})")
+        params.extend(sources)
+    cols = ", ".join(group_by)
+    sql = (
+        f"SELECT {cols + ', ' if cols else ''}SUM(record_count) AS record_count, "
+        + ", ".join(f"SUM({m}) AS {m}" for m in METRICS)
+        + f" FROM rollups WHERE {' AND '.join(where)}"
+        + (f" GROUP BY {cols} ORDER BY {cols}" if cols else "")
+    )
+    if not ROLLUP_DB.is_file():
+        return []
+    conn = connect()
+    try:
+        rows = [dict(r) for r in conn.execute(sql, params)]
+    finally:
+        conn.close()
+    return [r for r in rows if r["record_count"]]
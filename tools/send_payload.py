@@ -1,46 +1,124 @@
 """
-Deliver report to webhook and/or write .tmp/report_summary.txt.
-Input: .tmp/report_output.json. Environment: DELIVERY_WEBHOOK_URL, DELIVERY_TIMEOUT_SEC.
+Deliver report to webhooks and/or write .tmp/report_summary.txt.
+Input: .tmp/report_output.json. Environment: DELIVERY_WEBHOOK_URLS or DELIVERY_WEBHOOK_URL, DELIVERY_TIMEOUT_SEC,
+DELIVERY_CONCURRENCY, DELIVERY_RETRIES, DELIVERY_BACKOFF_SEC, DELIVERY_BACKOFF_MAX_SEC.
+Webhooks are posted concurrently over pooled keep-alive connections (tools/http_pool.py), each retried with
+exponential backoff and full jitter. Per-target outcomes are kept in .tmp/delivery_state.json, so delivering the same
+payload again only posts to the targets that have not accepted it yet.
 Deterministic; no calculations.
 """
 
+import hashlib
 import os
+import random
 import sys
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from urllib.request import urlopen, Request
 from urllib.error import HTTPError, URLError
 
+# Allow running as a script (python tools/send_payload.py) as well as importing from app.
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tools import http_pool, metrics
+
 TMP_DIR = Path(__file__).resolve().parent.parent / ".tmp"
 INPUT_FILE = TMP_DIR / "report_output.json"
 SUMMARY_FILE = TMP_DIR / "report_summary.txt"
+STATE_FILE = TMP_DIR / "delivery_state.json"
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SEC = 0.5
+DEFAULT_BACKOFF_MAX_SEC = 30.0
+RETRY_STATUSES = (408, 425, 429)  # plus every 5xx
 
+# Webhook connections are kept apart from ingest's pool and reused across retries and runs in the same process.
+_pool = http_pool.HostPool()
 
-def send_payload() -> int:
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
-    if not INPUT_FILE.is_file():
-        print("report_output.json not found. Run generate_report first.", file=sys.stderr)
-        return 1
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        payload = json.load(f)
-    timeout = int(os.environ.get("DELIVERY_TIMEOUT_SEC", "10") or "10")
-    webhook = (os.environ.get("DELIVERY_WEBHOOK_URL") or "").strip()
-    if webhook:
+
+def _env_number(name: str, default, cast=int, low=0):
+    try:
+        return max(low, cast(os.environ.get(name, default) or default))
+    except ValueError:
+        return default
+
+
+def webhook_urls() -> list:
+    """Configured targets: DELIVERY_WEBHOOK_URLS (comma- or whitespace-separated), else DELIVERY_WEBHOOK_URL."""
+    many = (os.environ.get("DELIVERY_WEBHOOK_URLS") or "").replace(",", " ").split()
+    if many:
+        return list(dict.fromkeys(many))
+    url = (os.environ.get("DELIVERY_WEBHOOK_URL") or "").strip()
+    return [url] if url else []
+
+
+def load_state() -> dict | None:
+    """Per-target outcome of the last delivered payload, or None if missing or unreadable."""
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state: dict) -> None:
+    part = STATE_FILE.with_name(STATE_FILE.name + ".part")
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(part, STATE_FILE)
+
+
+def _retry_after(e: HTTPError) -> float | None:
+    try:
+        return max(0.0, float(e.headers.get("Retry-After")))
+    except (AttributeError, TypeError, ValueError):
+        return None  # missing, or an HTTP date: fall back to the backoff
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter delay before retry number `attempt` (0-based): uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def post(url: str, body: bytes, headers: dict, timeout: float, retries: int, base: float, cap: float) -> dict:
+    """
+    POST `body` to one target until it answers 2xx or the retries run out. Connection errors, timeouts, 5xx and
+    408/425/429 are retried (honouring a numeric Retry-After, up to `cap`); other 4xx fail at once.
+    Returns the target's outcome {"status", "attempts", "http_status", "error", "finished_at"}.
+    """
+    outcome = {"status": "failed", "attempts": 0, "http_status": None, "error": None}
+    for attempt in range(retries + 1):
+        outcome["attempts"] = attempt + 1
+        delay = None
         try:
-            body = json.dumps(payload).encode("utf-8")
-            req = Request(
-                webhook,
-                data=body,
-                headers={"Content-Type": "application/json", "User-Agent": "BLAST-Analytics/1.0"},
-                method="POST",
-            )
-            with urlopen(req, timeout=timeout) as resp:
-                if resp.status >= 400:
-                    print(f"Webhook returned {resp.status}", file=sys.stderr)
-                    return 1
-        except (HTTPError, URLError) as e:
-            print(f"Webhook delivery failed: {e}", file=sys.stderr)
-            return 1
+            with _pool.open(url, headers, timeout, method="POST", body=body) as (resp, reader):
+                reader.read_all()
+                outcome.update(status="delivered", http_status=resp.status, error=None)
+                metrics.note("deliver", bytes_written=len(body))
+                break
+        except HTTPError as e:
+            outcome.update(http_status=e.code, error=f"HTTP {e.code}")
+            if e.code < 500 and e.code not in RETRY_STATUSES:
+                break
+            delay = _retry_after(e)
+        except (URLError, TimeoutError, OSError) as e:
+            outcome.update(http_status=None, error=str(getattr(e, "reason", e)) or type(e).__name__)
+        if attempt < retries:
+            time.sleep(min(cap, delay) if delay is not None else backoff(attempt, base, cap))
+    outcome["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return outcome
+
+
+def deliver(payload: dict) -> int:
+    """
+    POST the report payload to every configured webhook and write report_summary.txt. Targets that already
+    accepted this exact payload (same SHA-256, per delivery_state.json) are not posted again.
+    Returns 0 when every target has it, 1 if any failed.
+    """
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
     lines = [
         payload.get("title", "Report"),
         "Period: " + payload.get("period", ""),
@@ -49,7 +127,46 @@ def send_payload() -> int:
     ]
     with open(SUMMARY_FILE, "w", encoding="utf-8") as f:
         f.write("\n".join(lines))
-    return 0
+    urls = webhook_urls()
+    if not urls:
+        return 0
+
+    body = json.dumps(payload).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()
+    previous = load_state() or {}
+    done = previous.get("targets", {}) if previous.get("payload_sha256") == digest else {}
+    targets = {u: done[u] for u in urls if done.get(u, {}).get("status") == "delivered"}
+    pending = [u for u in urls if u not in targets]
+    if pending:
+        timeout = _env_number("DELIVERY_TIMEOUT_SEC", 10, float, 0.1)
+        retries = _env_number("DELIVERY_RETRIES", DEFAULT_RETRIES)
+        base = _env_number("DELIVERY_BACKOFF_SEC", DEFAULT_BACKOFF_SEC, float)
+        cap = _env_number("DELIVERY_BACKOFF_MAX_SEC", DEFAULT_BACKOFF_MAX_SEC, float)
+        headers = {"Content-Type": "application/json", "X-Delivery-Id": digest}
+        workers = min(_env_number("DELIVERY_CONCURRENCY", DEFAULT_CONCURRENCY, int, 1), len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            post_in_run = metrics.in_run(post)
+            futures = {u: ex.submit(post_in_run, u, body, headers, timeout, retries, base, cap) for u in pending}
+            for u, fut in futures.items():
+                targets[u] = fut.result()
+    _save_state({"payload_sha256": digest, "updated_at": datetime.now(timezone.utc).isoformat(),
+                 "targets": {u: targets[u] for u in urls}})
+    failed = [u for u in urls if targets[u]["status"] != "delivered"]
+    for u in failed:
+        t = targets[u]
+        print(f"Webhook delivery to {u} failed after {t['attempts']} attempt(s): {t['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def send_payload() -> int:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    if not INPUT_FILE.is_file():
+        print("report_output.json not found. Run generate_report first.", file=sys.stderr)
+        return 1
+    metrics.note("deliver", bytes_read=INPUT_FILE.stat().st_size)
+    with open(INPUT_FILE, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    return deliver(payload)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,309 @@
+"""
+Mergeable sketches for analyze's partial states: HyperLogLog for distinct counts and t-digest for quantiles.
+Both are JSON-serializable (to_state / from_state) so they live in pipeline_state.json next to the exact sums,
+and merging two sketches gives the sketch of the combined input, like merge_partials does for the sums.
+Memory is fixed (HLL: 2**HLL_PRECISION bytes) or bounded by the compression (t-digest), not by record count.
+Values are buffered and absorbed in batches of _BATCH; with NumPy installed each batch is hashed or sorted in bulk.
+"""
+
+import base64
+import math
+
+# Optional: NumPy for hashing and sorting whole batches. Falls back to per-value loops if unavailable.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+HLL_PRECISION = 14  # 16384 registers, ~0.8% standard error
+TDIGEST_COMPRESSION = 100
+_BUFFER_FACTOR = 20  # pre-clusters per batch, per unit of compression
+_BATCH = 1 << 16  # values absorbed at once
+
+_MASK64 = (1 << 64) - 1
+_SEED = 0x9E3779B97F4A7C15
+_C1, _C2 = 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53
+
+
+def _fmix(h: int) -> int:
+    """MurmurHash3's 64-bit finalizer: a bijection that spreads every input bit over the output."""
+    h ^= h >> 33
+    h = (h * _C1) & _MASK64
+    h ^= h >> 33
+    h = (h * _C2) & _MASK64
+    return h ^ (h >> 33)
+
+
+def hash64(value: bytes) -> int:
+    """64-bit hash of a byte string: the length, then each 8-byte little-endian word, chained through _fmix."""
+    h = _fmix(len(value) ^ _SEED)
+    for i in range(0, len(value), 8):
+        h = _fmix(h ^ int.from_bytes(value[i:i + 8], "little"))
+    return h
+
+
+if NUMPY_AVAILABLE:
+    def _fmix_array(h):
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(_C1)
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(_C2)
+        return h ^ (h >> np.uint64(33))
+
+    def hash64_array(offsets, data):
+        """hash64 of every string data[offsets[i]:offsets[i + 1]] (int64 offsets, uint8 data) as a uint64 array."""
+        starts, lens = offsets[:-1], np.diff(offsets)
+        buf = np.concatenate([data, np.zeros(8, dtype=np.uint8)])  # the last word may read past the end
+        words = np.lib.stride_tricks.sliding_window_view(buf, 8)
+        h = _fmix_array(lens.astype(np.uint64) ^ np.uint64(_SEED))
+        for k in range(0, int(lens.max(initial=0)), 8):
+            rows = np.flatnonzero(lens > k)
+            w = words[starts[rows] + k].copy().view("<u8").ravel()
+            rest = lens[rows] - k
+            short = rest < 8
+            w[short] &= (np.uint64(1) << (8 * rest[short]).astype(np.uint64)) - np.uint64(1)
+            h[rows] = _fmix_array(h[rows] ^ w)
+        return h
+
+
+class HyperLogLog:
+    """HyperLogLog over 64-bit hashes (hash64), with linear counting for small cardinalities."""
+
+    def __init__(self, p: int = HLL_PRECISION, registers: bytearray | None = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+        self.buffer = []
+
+    def add_hash(self, h: int) -> None:
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+        i = h >> (64 - self.p)
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def add(self, value: bytes) -> None:
+        self.buffer.append(value)
+        if len(self.buffer) >= _BATCH:
+            self._flush()
+
+    def update(self, values) -> None:
+        """Add many byte strings."""
+        for v in values:
+            self.buffer.append(v)
+            if len(self.buffer) >= _BATCH:
+                self._flush()
+
+    def _flush(self) -> None:
+        values, self.buffer = self.buffer, []
+        if not values:
+            return
+        if NUMPY_AVAILABLE:
+            offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, values), dtype=np.int64, count=len(values)), out=offsets[1:])
+            self.update_packed(offsets, np.frombuffer(b"".join(values), dtype=np.uint8))
+            return
+        p, shift, mask, regs = self.p, 64 - self.p, (1 << (64 - self.p)) - 1, self.registers
+        for v in values:
+            h = hash64(v)
+            rank = shift - (h & mask).bit_length() + 1
+            i = h >> shift
+            if rank > regs[i]:
+                regs[i] = rank
+
+    def update_packed(self, offsets, data) -> None:
+        """
+        Add the strings data[offsets[i]:offsets[i + 1]] (NumPy int64 offsets from 0, uint8 data), skipping empty
+        ones: hashed with hash64_array and folded into the registers with np.maximum.at. Requires NumPy.
+        """
+        h = hash64_array(offsets, data)[np.diff(offsets) > 0]
+        shift = 64 - self.p
+        rest = (h & np.uint64((1 << shift) - 1)).astype(np.float64)  # exact: below 2**53 for p >= 11
+        rank = shift + 1 - np.frexp(rest)[1]  # frexp's exponent is the bit length
+        np.maximum.at(np.frombuffer(self.registers, dtype=np.uint8), (h >> np.uint64(shift)).astype(np.intp), rank.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError("cannot merge HyperLogLogs of different precision")
+        self._flush()
+        other._flush()
+        return HyperLogLog(self.p, bytearray(map(max, self.registers, other.registers)))
+
+    def estimate(self) -> int:
+        self._flush()
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def error(self) -> float:
+        """Relative standard error of estimate()."""
+        return 1.04 / math.sqrt(self.m)
+
+    def to_state(self) -> dict:
+        self._flush()
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_state(cls, state: dict | None) -> "HyperLogLog":
+        if not state:
+            return cls()
+        return cls(state["p"], bytearray(base64.b64decode(state["registers"])))
+
+
+class TDigest:
+    """
+    Merging t-digest: values are buffered and merged in batches into at most ~compression centroids, sized so
+    that the tails (where quantiles change fastest) keep small centroids. Exact min and max are kept.
+    """
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION, centroids: list | None = None, lo=None, hi=None):
+        self.compression = compression
+        self.centroids = centroids or []  # [[mean, weight, exact], ...] sorted by mean; exact: all values equal
+        self.buffer = []
+        self.min = lo
+        self.max = hi
+
+    def add(self, x: float) -> None:
+        self.buffer.append(x)
+        if len(self.buffer) >= _BATCH:
+            self._compress()
+
+    def update(self, values) -> None:
+        """
+        Add many values (a list or a NumPy array). Batches are cut at the same points as repeated add(), so the
+        result is identical; a whole batch of an array is absorbed without going through the buffer.
+        """
+        i = 0
+        while i < len(values):
+            take = _BATCH - len(self.buffer)
+            batch = values[i:i + take]
+            i += take
+            if not self.buffer and len(batch) == _BATCH:
+                self._absorb(batch)
+                continue
+            self.buffer.extend(batch.tolist() if NUMPY_AVAILABLE and isinstance(batch, np.ndarray) else batch)
+            if len(self.buffer) >= _BATCH:
+                self._compress()
+
+    def _compress(self, extra: list | None = None) -> None:
+        batch, self.buffer = self.buffer, []
+        self._absorb(batch, extra)
+
+    def _points(self, batch) -> list:
+        """Sorted batch as [mean, weight, exact] points; updates min and max."""
+        if NUMPY_AVAILABLE:
+            values = np.sort(np.asarray(batch, dtype=np.float64))
+            lo, hi = float(values[0]), float(values[-1])
+            points = self._cluster(values)
+        else:
+            values = sorted(batch)
+            lo, hi = values[0], values[-1]
+            # Runs of equal values become one weighted point before merging.
+            points = []
+            prev, w = values[0], 0
+            for x in values:
+                if x == prev:
+                    w += 1
+                else:
+                    points.append([prev, w, True])
+                    prev, w = x, 1
+            points.append([prev, w, True])
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        return points
+
+    def _cluster(self, values) -> list:
+        """
+        Pre-cluster a sorted array into about compression * _BUFFER_FACTOR points on an arcsine scale (singletons at
+        the tails). A run of equal values at least as large as an average cluster starts and ends a cluster, so it
+        stays exact; the merge in _absorb joins its pieces.
+        """
+        n = len(values)
+        clusters = self.compression * _BUFFER_FACTOR
+        change = np.ones(n, dtype=bool)
+        change[1:] = values[1:] != values[:-1]
+        run = np.cumsum(change) - 1
+        run_starts = np.flatnonzero(change)
+        heavy = (np.diff(np.append(run_starts, n)) >= max(2, n // clusters))[run]
+        k = np.floor((np.arcsin(2 * (np.arange(n) + 0.5) / n - 1) / np.pi + 0.5) * clusters)
+        split = np.ones(n, dtype=bool)
+        split[1:] = (k[1:] != k[:-1]) | (change[1:] & (heavy[1:] | heavy[:-1]))
+        starts = np.flatnonzero(split)
+        weights = np.diff(np.append(starts, n))
+        firsts, lasts = values[starts], values[np.append(starts[1:], n) - 1]
+        exact = firsts == lasts
+        means = np.where(exact, firsts, np.bincount(np.cumsum(split) - 1, weights=values) / weights)
+        return [[m, w, e] for m, w, e in zip(means.tolist(), weights.tolist(), exact.tolist())]
+
+    def _absorb(self, batch, extra: list | None = None) -> None:
+        """Merge a batch of values (and extra centroids) into the centroids in one pass."""
+        points = sorted(self.centroids + (self._points(batch) if len(batch) else []) + (extra or []))
+        if not points:
+            return
+        total = sum(c[1] for c in points)
+        out = []
+        mean, weight, exact = points[0]
+        done = 0.0
+        for m, w, e in points[1:]:
+            q = (done + (weight + w) / 2) / total
+            if m == mean and exact and e:
+                weight += w  # equal values always share a centroid and keep it exact
+            elif weight + w <= max(1.0, 4 * total * q * (1 - q) / self.compression):
+                weight += w
+                mean += (m - mean) * w / weight
+                exact = False
+            else:
+                out.append([mean, weight, exact])
+                done += weight
+                mean, weight, exact = m, w, e
+        out.append([mean, weight, exact])
+        self.centroids = out
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        merged = TDigest(self.compression, [list(c) for c in self.centroids], self.min, self.max)
+        merged.buffer = self.buffer + other.buffer
+        if other.min is not None:
+            merged.min = other.min if merged.min is None else min(merged.min, other.min)
+            merged.max = other.max if merged.max is None else max(merged.max, other.max)
+        merged._compress([list(c) for c in other.centroids])
+        return merged
+
+    def quantile(self, q: float) -> float | None:
+        """Estimated value at quantile q (0..1), interpolating between centroid centers; None if empty."""
+        if self.buffer:
+            self._compress()
+        if not self.centroids:
+            return None
+        total = sum(c[1] for c in self.centroids)
+        target = q * total
+        done = 0.0
+        prev_center, prev_mean = 0.0, self.min
+        for mean, w, exact in self.centroids:
+            center = done + w / 2
+            if exact and done <= target < done + w:
+                return mean
+            if target < center:
+                if center == prev_center:
+                    return mean
+                return prev_mean + (mean - prev_mean) * (target - prev_center) / (center - prev_center)
+            done += w
+            prev_center, prev_mean = center, mean
+        if total == prev_center:
+            return self.max
+        return prev_mean + (self.max - prev_mean) * (target - prev_center) / (total - prev_center)
+
+    def to_state(self) -> dict:
+        if self.buffer:
+            self._compress()
+        return {"compression": self.compression, "centroids": self.centroids, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_state(cls, state: dict | None) -> "TDigest":
+        if not state:
+            return cls()
+        return cls(state["compression"], [list(c) for c in state["centroids"]], state["min"], state["max"])
@@ -0,0 +1,140 @@
+"""
+Batch validation of raw records for clean_data: rules are compiled once per run (from CLEAN_* settings) and
+applied column by column to batches of records, so the per-row work is a few list comprehensions instead of a
+dict walk with try/except per value.
+Rules: metrics must be numeric (missing counts as 0), finite and non-negative (CLEAN_ALLOW_NEGATIVE lists
+metrics that may be negative); timestamps must be ISO-8601 and between CLEAN_TIMESTAMP_MIN and
+CLEAN_MAX_FUTURE_HOURS past the run start. A rejected row is dropped whole; counts are kept per field and reason,
+with a few sample rows per field.
+"""
+
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+METRICS = ("visits", "conversions", "revenue")
+DEFAULT_TIMESTAMP_MIN = "2000-01-01T00:00:00+00:00"
+DEFAULT_MAX_FUTURE_HOURS = 24
+DEFAULT_SAMPLES = 5
+_EMPTY = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default) or default)
+    except ValueError:
+        return default
+
+
+def rule_settings() -> tuple:
+    """The settings that decide which rows pass, for stage input hashes."""
+    return tuple(os.environ.get(k, "") for k in ("CLEAN_TIMESTAMP_MIN", "CLEAN_MAX_FUTURE_HOURS", "CLEAN_ALLOW_NEGATIVE"))
+
+
+def _parse_ts(value: str) -> datetime:
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)  # naive timestamps are taken as UTC
+
+
+def _as_float(value) -> float:
+    """Metric value as float: None and "" count as 0; raises ValueError/TypeError if not numeric."""
+    return 0.0 if value is None or value == "" else float(value)
+
+
+class Validator:
+    """Rules compiled from the environment at construction; clean_batch() applies them to one batch."""
+
+    def __init__(self, now: datetime | None = None):
+        now = now or datetime.now(timezone.utc)
+        self.now = now.isoformat()
+        try:
+            self.ts_min = _parse_ts((os.environ.get("CLEAN_TIMESTAMP_MIN") or DEFAULT_TIMESTAMP_MIN).strip())
+        except ValueError:
+            self.ts_min = _parse_ts(DEFAULT_TIMESTAMP_MIN)
+        self.ts_max = now + timedelta(hours=_env_float("CLEAN_MAX_FUTURE_HOURS", DEFAULT_MAX_FUTURE_HOURS))
+        allowed = {m.strip() for m in (os.environ.get("CLEAN_ALLOW_NEGATIVE") or "").lower().split(",")}
+        self.nonnegative = tuple(m for m in METRICS if m not in allowed)
+        self.samples = max(0, int(_env_float("CLEAN_REJECT_SAMPLES", DEFAULT_SAMPLES)))
+        # Timestamp strings already seen valid, so repeated values are parsed once (cleared past 65536 entries).
+        self._ts_ok = set()
+
+    def _reject(self, stats: dict, bad: dict, i: int, offset: int, field: str, reason: str, value) -> None:
+        by_field = stats["rejections"].setdefault(field, {})
+        by_field[reason] = by_field.get(reason, 0) + 1
+        bad.setdefault(i, field)
+        samples = stats["rejected_samples"]
+        if sum(1 for s in samples if s["field"] == field) < self.samples:
+            samples.append({"row": offset + i, "field": field, "reason": reason, "value": str(value)[:200]})
+
+    def _floats(self, column: list, field: str, stats: dict, bad: dict, offset: int) -> list:
+        try:
+            out = [0.0 if v is None or v == "" else float(v) for v in column]
+        except (TypeError, ValueError):
+            out = []
+            for i, v in enumerate(column):
+                try:
+                    out.append(_as_float(v))
+                except (TypeError, ValueError):
+                    out.append(0.0)
+                    self._reject(stats, bad, i, offset, field, "not_numeric", v)
+        if not all(map(math.isfinite, out)):
+            for i, v in enumerate(out):
+                if not math.isfinite(v):
+                    self._reject(stats, bad, i, offset, field, "not_finite", column[i])
+        if field in self.nonnegative and out and min(out) < 0:
+            for i, v in enumerate(out):
+                if v < 0:
+                    self._reject(stats, bad, i, offset, field, "negative", column[i])
+        return out
+
+    def _timestamps(self, column: list, stats: dict, bad: dict, offset: int) -> list:
+        out = [self.now if v is None else str(v) for v in column]
+        if len(self._ts_ok) > 65536:
+            self._ts_ok.clear()
+        invalid = {}
+        for v in set(out).difference(self._ts_ok):  # each distinct new string is parsed once
+            try:
+                dt = _parse_ts(v)
+            except ValueError:
+                invalid[v] = "unparseable"
+                continue
+            if dt < self.ts_min or dt > self.ts_max:
+                invalid[v] = "out_of_range"
+            else:
+                self._ts_ok.add(v)
+        if invalid:
+            for i, v in enumerate(out):
+                if v in invalid:
+                    self._reject(stats, bad, i, offset, "timestamp", invalid[v], v)
+        return out
+
+    def clean_batch(self, rows: list, stats: dict, offset: int = 0) -> list:
+        """
+        Validate a batch of raw records (any objects; non-dicts are rejected) and return the cleaned dicts of the
+        rows that pass, in order. offset is the batch's position in the stream, used for sample row numbers.
+        Updates stats: validation_errors_count (rows dropped), rejections {field: {reason: count}} and
+        rejected_samples [{row, field, reason, value}].
+        """
+        stats.setdefault("validation_errors_count", 0)
+        stats.setdefault("rejections", {})
+        stats.setdefault("rejected_samples", [])
+        bad = {}
+        if not all(type(r) is dict for r in rows):
+            for i, r in enumerate(rows):
+                if not isinstance(r, dict):
+                    self._reject(stats, bad, i, offset, "record", "not_object", type(r).__name__)
+            rows = [r if isinstance(r, dict) else _EMPTY for r in rows]
+        metrics = [m if type(m) is dict else _EMPTY for m in (r.get("metrics") for r in rows)]
+        ids = [str(r.get("id", "")) for r in rows]
+        sources = [str(r.get("source", "")) for r in rows]
+        timestamps = self._timestamps([r.get("timestamp") for r in rows], stats, bad, offset)
+        visits, conversions, revenue = (self._floats([m.get(f) for m in metrics], f, stats, bad, offset) for f in METRICS)
+        stats["validation_errors_count"] += len(bad)
+        return [
+            {"id": i, "timestamp": t, "source": s, "visits": v, "conversions": c, "revenue": rv}
+            for n, (i, t, s, v, c, rv) in enumerate(zip(ids, timestamps, sources, visits, conversions, revenue))
+            if n not in bad
+        ] if bad else [
+            {"id": i, "timestamp": t, "source": s, "visits": v, "conversions": c, "revenue": rv}
+            for i, t, s, v, c, rv in zip(ids, timestamps, sources, visits, conversions, revenue)
+        ]